@@ -1,44 +1,53 @@
 """Agent Manager - مدير الـ AI Agents"""
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
 from datetime import datetime
 import asyncio
+import hashlib
+import json
 import structlog
-from app.ai.coach import CoachAI
-from app.ai.orchestrator import OrchestratorAI
+from app.ai.registry import agent_registry, AgentRegistry
+from app.ai.metrics import agent_metrics
+from app.ai.coordination import COORDINATION_FLOWS, run_flow
+from app.config import settings
 
 logger = structlog.get_logger()
 
 class AgentManager:
     """مدير مركزي لجميع الـ AI Agents"""
     
-    def __init__(self):
-        self.agents = {}
+    def __init__(self, registry: AgentRegistry = agent_registry):
+        self.registry = registry
         self.agent_stats = {}
         self.agent_tasks = {}
+        # الطلبات الجارية حالياً لدمج الطلبات المتطابقة (single-flight)
+        self._inflight: Dict[str, asyncio.Task] = {}
         self._initialize_agents()
     
+    @property
+    def agents(self) -> Dict[str, Any]:
+        """الـ Agents المُنشأة حالياً"""
+        return self.registry.loaded_agents()
+    
+    @staticmethod
+    def _new_agent_stats() -> Dict[str, Any]:
+        """إحصائيات فارغة لـ Agent جديد"""
+        return {
+            "total_requests": 0,
+            "successful_requests": 0,
+            "failed_requests": 0,
+            "coalesced_requests": 0,
+            "last_activity": None,
+            "total_response_time": 0.0,
+            "average_response_time": 0.0
+        }
+    
     def _initialize_agents(self):
-        """تهيئة جميع الـ Agents"""
+        """تهيئة إحصائيات الـ Agents المسجلة - الـ Agents نفسها تُنشأ عند أول استخدام"""
         try:
-            self.agents["coach"] = CoachAI()
-            self.agents["orchestrator"] = OrchestratorAI()
-            
             # إحصائيات الأداء
             self.agent_stats = {
-                "coach": {
-                    "total_requests": 0,
-                    "successful_requests": 0,
-                    "failed_requests": 0,
-                    "last_activity": None,
-                    "average_response_time": 0.0
-                },
-                "orchestrator": {
-                    "total_requests": 0,
-                    "successful_requests": 0,
-                    "failed_requests": 0,
-                    "last_activity": None,
-                    "average_response_time": 0.0
-                }
+                agent_type: self._new_agent_stats()
+                for agent_type in self.registry.agent_types()
             }
             
             logger.info("Agent Manager initialized successfully")
@@ -47,14 +56,57 @@ class AgentManager:
             logger.error(f"Failed to initialize agents: {e}")
     
     async def get_agent(self, agent_type: str) -> Optional[Any]:
-        """جلب Agent معين"""
-        if agent_type not in self.agents:
+        """جلب Agent معين (يُنشأ عند أول طلب)"""
+        if not self.registry.is_registered(agent_type):
             logger.warning(f"Agent {agent_type} not found")
             return None
         
-        return self.agents[agent_type]
+        return self.registry.get(agent_type)
     
     async def execute_agent_task(self, agent_type: str, task_name: str, **kwargs) -> Dict[str, Any]:
+        """تنفيذ مهمة على Agent معين مع دمج الطلبات المتطابقة الجارية
+
+        الطلبات بنفس الـ Agent والمهمة والمعاملات (بعد التطبيع) تنتظر
+        تنفيذاً واحداً بدلاً من استدعاء الـ LLM عدة مرات.
+        """
+        flight_key = self._make_flight_key(agent_type, task_name, kwargs)
+        
+        inflight = self._inflight.get(flight_key)
+        if inflight is not None:
+            if agent_type in self.agent_stats:
+                self.agent_stats[agent_type]["coalesced_requests"] += 1
+            logger.info(f"Coalesced duplicate {agent_type}/{task_name} request")
+            result = await asyncio.shield(inflight)
+            return {**result, "coalesced": True}
+        
+        task = asyncio.create_task(self._execute_agent_task(agent_type, task_name, **kwargs))
+        self._inflight[flight_key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        
+        # shield حتى لا يلغي انقطاع أحد المنتظرين التنفيذ المشترك
+        return await asyncio.shield(task)
+    
+    @staticmethod
+    def _make_flight_key(agent_type: str, task_name: str, kwargs: Dict[str, Any]) -> str:
+        """مفتاح الدمج: الـ Agent والمهمة والمعاملات
+
+        تُطبّع المعرفات فقط (الإيميلات) - باقي النصوص كما هي لأن الحالة
+        والمسافات قد تغير معنى الطلب ونتيجته.
+        """
+        def normalize(key, value):
+            if isinstance(value, str) and key and key.endswith(("email", "emails")):
+                return value.strip().casefold()
+            if isinstance(value, dict):
+                return {item_key: normalize(item_key, item) for item_key, item in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [normalize(key, item) for item in value]
+            return value
+        
+        payload = json.dumps(normalize(None, kwargs), sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return f"{agent_type}:{task_name}:{digest}"
+    
+    async def _execute_agent_task(self, agent_type: str, task_name: str, **kwargs) -> Dict[str, Any]:
         """تنفيذ مهمة على Agent معين مع تتبع الأداء"""
         start_time = datetime.now()
         
@@ -68,12 +120,8 @@ class AgentManager:
                     "task": task_name
                 }
             
-            # تنفيذ المهمة
-            if agent_type == "coach" and task_name == "generate_message":
-                result = await agent.generate_coach_message(kwargs.get("user_data", {}))
-            elif agent_type == "orchestrator" and task_name == "expand_goal":
-                result = await agent.expand_goal_to_tasks(kwargs.get("goal_text", ""), **kwargs)
-            else:
+            handler = self.registry.get_task_handler(agent_type, task_name)
+            if not handler:
                 return {
                     "success": False,
                     "error": f"Unknown task {task_name} for agent {agent_type}",
@@ -81,8 +129,11 @@ class AgentManager:
                     "task": task_name
                 }
             
+            # تنفيذ المهمة
+            result = await handler(agent, **kwargs)
+            
             # تحديث الإحصائيات
-            await self._update_agent_stats(agent_type, True, start_time)
+            await self._update_agent_stats(agent_type, True, start_time, task_name)
             
             return {
                 "success": True,
@@ -94,7 +145,7 @@ class AgentManager:
             
         except Exception as e:
             logger.error(f"Error executing task {task_name} on agent {agent_type}: {e}")
-            await self._update_agent_stats(agent_type, False, start_time)
+            await self._update_agent_stats(agent_type, False, start_time, task_name)
             
             return {
                 "success": False,
@@ -104,7 +155,27 @@ class AgentManager:
                 "execution_time": (datetime.now() - start_time).total_seconds()
             }
     
-    async def _update_agent_stats(self, agent_type: str, success: bool, start_time: datetime):
+    async def stream_agent_task(self, agent_type: str, task_name: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """تنفيذ مهمة بث على Agent معين مع تتبع الأداء عند انتهاء البث"""
+        handler = self.registry.get_stream_handler(agent_type, task_name)
+        if not handler:
+            raise ValueError(f"Unknown streaming task {task_name} for agent {agent_type}")
+        
+        agent = await self.get_agent(agent_type)
+        start_time = datetime.now()
+        success = False
+        
+        try:
+            async for event in handler(agent, **kwargs):
+                yield event
+            success = True
+        except Exception as e:
+            logger.error(f"Error streaming task {task_name} on agent {agent_type}: {e}")
+            raise
+        finally:
+            await self._update_agent_stats(agent_type, success, start_time, task_name)
+    
+    async def _update_agent_stats(self, agent_type: str, success: bool, start_time: datetime, task_name: str = "unknown"):
         """تحديث إحصائيات Agent"""
         if agent_type not in self.agent_stats:
             return
@@ -118,12 +189,13 @@ class AgentManager:
         else:
             stats["failed_requests"] += 1
         
-        # حساب متوسط وقت الاستجابة
+        # المتوسط الحسابي الفعلي لوقت الاستجابة
         execution_time = (datetime.now() - start_time).total_seconds()
-        if stats["average_response_time"] == 0:
-            stats["average_response_time"] = execution_time
-        else:
-            stats["average_response_time"] = (stats["average_response_time"] + execution_time) / 2
+        stats["total_response_time"] += execution_time
+        stats["average_response_time"] = stats["total_response_time"] / stats["total_requests"]
+        
+        # histogram للـ percentiles والإنتاجية
+        agent_metrics.record_task(agent_type, task_name, execution_time, success)
     
     async def get_agent_status(self, agent_type: str = None) -> Dict[str, Any]:
         """جلب حالة Agent أو جميع الـ Agents"""
@@ -133,7 +205,7 @@ class AgentManager:
             
             return {
                 "agent_type": agent_type,
-                "status": "active" if agent_type in self.agents else "inactive",
+                "status": "active" if self.registry.is_loaded(agent_type) else "idle",
                 "stats": self.agent_stats[agent_type]
             }
         
@@ -141,7 +213,7 @@ class AgentManager:
         all_status = {}
         for agent_type in self.agent_stats:
             all_status[agent_type] = {
-                "status": "active" if agent_type in self.agents else "inactive",
+                "status": "active" if self.registry.is_loaded(agent_type) else "idle",
                 "stats": self.agent_stats[agent_type]
             }
         
@@ -150,24 +222,16 @@ class AgentManager:
     async def restart_agent(self, agent_type: str) -> Dict[str, Any]:
         """إعادة تشغيل Agent معين"""
         try:
-            if agent_type == "coach":
-                self.agents["coach"] = CoachAI()
-            elif agent_type == "orchestrator":
-                self.agents["orchestrator"] = OrchestratorAI()
-            else:
+            # الـ Agent يُعاد إنشاؤه عند الطلب القادم
+            if not self.registry.reset(agent_type):
                 return {
                     "success": False,
                     "error": f"Unknown agent type: {agent_type}"
                 }
             
             # إعادة تعيين الإحصائيات
-            self.agent_stats[agent_type] = {
-                "total_requests": 0,
-                "successful_requests": 0,
-                "failed_requests": 0,
-                "last_activity": None,
-                "average_response_time": 0.0
-            }
+            self.agent_stats[agent_type] = self._new_agent_stats()
+            agent_metrics.reset_agent(agent_type)
             
             logger.info(f"Agent {agent_type} restarted successfully")
             
@@ -193,9 +257,8 @@ class AgentManager:
             "timestamp": datetime.now().isoformat()
         }
         
-        for agent_type in self.agents:
+        for agent_type in self.agent_stats:
             try:
-                agent = self.agents[agent_type]
                 stats = self.agent_stats[agent_type]
                 
                 # حساب معدل النجاح
@@ -214,11 +277,20 @@ class AgentManager:
                     status = "critical"
                     health_status["overall_status"] = "unhealthy"
                 
+                # كشف تراجع زمن الاستجابة في الذيل (p99)
+                worst_p99 = agent_metrics.get_worst_p99(agent_type)
+                tail_latency_alert = worst_p99 is not None and worst_p99 > settings.agent_p99_alert_seconds
+                if tail_latency_alert and status in ["excellent", "good"]:
+                    status = "warning"
+                
                 health_status["agents"][agent_type] = {
                     "status": status,
                     "success_rate": success_rate,
                     "total_requests": stats["total_requests"],
                     "average_response_time": stats["average_response_time"],
+                    "p99_response_time": worst_p99,
+                    "tail_latency_alert": tail_latency_alert,
+                    "latency": agent_metrics.get_agent_summary(agent_type),
                     "last_activity": stats["last_activity"].isoformat() if stats["last_activity"] else None
                 }
                 
@@ -232,65 +304,26 @@ class AgentManager:
         return health_status
     
     async def coordinate_agents(self, task_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        """تنسيق بين الـ Agents لمهمة معقدة"""
+        """تنسيق بين الـ Agents لمهمة معقدة - الخطوات المستقلة تعمل بالتوازي"""
         try:
-            if task_type == "project_with_coaching":
-                # مشروع مع رسائل تحفيز
-                goal_text = data.get("goal_text", "")
-                user_data = data.get("user_data", {})
-                
-                # تفكيك الهدف
-                orchestrator_result = await self.execute_agent_task(
-                    "orchestrator", 
-                    "expand_goal", 
-                    goal_text=goal_text
-                )
-                
-                # رسالة تحفيز
-                coach_result = await self.execute_agent_task(
-                    "coach", 
-                    "generate_message", 
-                    user_data=user_data
-                )
-                
-                return {
-                    "success": True,
-                    "project_plan": orchestrator_result.get("result"),
-                    "motivation_message": coach_result.get("result"),
-                    "coordination_type": "project_with_coaching"
-                }
-            
-            elif task_type == "performance_analysis":
-                # تحليل الأداء مع توصيات
-                user_data = data.get("user_data", {})
-                
-                # رسالة تحفيز
-                coach_result = await self.execute_agent_task(
-                    "coach", 
-                    "generate_message", 
-                    user_data=user_data
-                )
-                
-                # اقتراح مشروع تحسين
-                improvement_goal = f"تحسين أداء {user_data.get('name', 'الموظف')} في قسم {user_data.get('department', 'العام')}"
-                orchestrator_result = await self.execute_agent_task(
-                    "orchestrator", 
-                    "expand_goal", 
-                    goal_text=improvement_goal
-                )
-                
-                return {
-                    "success": True,
-                    "motivation_message": coach_result.get("result"),
-                    "improvement_plan": orchestrator_result.get("result"),
-                    "coordination_type": "performance_analysis"
-                }
-            
-            else:
+            steps = COORDINATION_FLOWS.get(task_type)
+            if not steps:
                 return {
                     "success": False,
                     "error": f"Unknown coordination type: {task_type}"
                 }
+            
+            flow = await run_flow(self, steps, data, settings.coordination_step_timeout)
+            
+            return {
+                "success": True,
+                # نتيجة كل خطوة (None إذا فشلت أو تجاوزت المهلة)
+                **{step.name: flow["results"].get(step.name) for step in steps},
+                "steps": flow["steps"],
+                "partial": flow["partial"],
+                "timing": flow["timing"],
+                "coordination_type": task_type
+            }
                 
         except Exception as e:
             logger.error(f"Error in agent coordination: {e}")
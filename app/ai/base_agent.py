@@ -1,8 +1,14 @@
 """Base class لجميع الـ AI agents مع دعم الـ prompts المرنة"""
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, AsyncIterator
 from app.config import settings
+from app.ai.prompt_cache import prompt_cache
+from app.ai.rate_limiter import llm_rate_limiter
+from app.ai.circuit_breaker import get_circuit_breaker
+from app.ai.metrics import agent_metrics
+import asyncio
 import structlog
+import time
 import os
 
 logger = structlog.get_logger()
@@ -10,6 +16,62 @@ logger = structlog.get_logger()
 # متغير تعطيل الذكاء الاصطناعي
 DISABLE_AI = os.getenv("DISABLE_AI", "false").lower() == "true"
 
+# عميل OpenAI المشترك (pool اتصالات keep-alive واحد لكل العملية)
+_shared_client = None
+
+def get_shared_openai_client():
+    """جلب عميل AsyncOpenAI المشترك وإنشاؤه عند أول استخدام"""
+    global _shared_client
+    if _shared_client is None:
+        import httpx
+        import openai
+        
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive,
+                keepalive_expiry=settings.openai_keepalive_expiry
+            ),
+            timeout=httpx.Timeout(
+                settings.openai_timeout,
+                connect=settings.openai_connect_timeout
+            )
+        )
+        _shared_client = openai.AsyncOpenAI(
+            # الخوادم المحلية لا تتحقق من المفتاح
+            api_key=settings.openai_api_key or "local",
+            base_url=settings.openai_base_url or None,
+            http_client=http_client,
+            max_retries=settings.openai_max_retries
+        )
+        logger.info(
+            "Shared OpenAI client created",
+            max_connections=settings.openai_max_connections,
+            max_keepalive=settings.openai_max_keepalive,
+            base_url=settings.openai_base_url or "default"
+        )
+    return _shared_client
+
+# استدعاءات تجاوزت latency budget وما زالت تعمل في الخلفية
+_background_calls = set()
+
+def _deliver_late_result(call: "asyncio.Future", on_late_result):
+    """تمرير رد متأخر ناجح إلى callback غير متزامن"""
+    if call.cancelled() or call.exception() is not None:
+        return
+    result = call.result()
+    if result:
+        task = asyncio.ensure_future(on_late_result(result))
+        _background_calls.add(task)
+        task.add_done_callback(_background_calls.discard)
+
+async def close_shared_openai_client():
+    """إغلاق pool الاتصالات عند إيقاف التطبيق"""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.close()
+        _shared_client = None
+
 class BaseAgent(ABC):
     """Base class لجميع الـ AI agents مع دعم الـ prompts المرنة"""
     
@@ -23,51 +85,57 @@ class BaseAgent(ABC):
             return
         
         try:
-            if not settings.openai_api_key:
+            if not settings.openai_api_key and not settings.openai_base_url:
                 logger.warning(f"OpenAI API key not configured for {agent_type}")
                 return
+            
+            # عميل غير متزامن مشترك بين جميع الـ agents
+            self.client = get_shared_openai_client()
+            logger.info(f"OpenAI client initialized successfully for {agent_type}")
                 
-            # استيراد OpenAI بطريقة آمنة
-            try:
-                import openai
-                # إنشاء عميل OpenAI مع المعاملات الأساسية فقط
-                self.client = openai.OpenAI(
-                    api_key=settings.openai_api_key
-                )
-                logger.info(f"OpenAI client initialized successfully for {agent_type}")
-            except ImportError:
-                logger.error(f"OpenAI package not available for {agent_type}")
-            except Exception as import_error:
-                logger.error(f"OpenAI import error for {agent_type}: {import_error}")
-                # محاولة بديلة مع httpx مباشرة
-                try:
-                    import httpx
-                    self.client = httpx.Client()
-                    logger.info(f"Using HTTP client as fallback for {agent_type}")
-                except:
-                    logger.error(f"No HTTP client available for {agent_type}")
-                
+        except ImportError:
+            logger.error(f"OpenAI package not available for {agent_type}")
         except Exception as e:
             logger.error(f"OpenAI client initialization failed for {agent_type}: {e}")
             self.client = None
     
     async def get_prompt_template(self, prompt_name: str) -> Optional[str]:
         """جلب prompt من قاعدة البيانات أو الملف"""
+        template, _ = await self.get_prompt_with_version(prompt_name)
+        return template
+    
+    async def get_prompt_with_version(self, prompt_name: str) -> Tuple[str, int]:
+        """جلب prompt مع رقم إصداره (من الكاش إن أمكن)"""
+        cached = prompt_cache.get(self.agent_type, prompt_name)
+        if cached:
+            return cached["template"], cached["version"]
+        
         from app.db import get_db
         
+        generation = prompt_cache.generation
+        
         # جرب جلب من قاعدة البيانات أولاً
-        db = await get_db()
-        prompt_doc = await db.ai_prompts.find_one({
-            "agent_type": self.agent_type,
-            "prompt_name": prompt_name,
-            "is_active": True
-        })
+        with agent_metrics.phase_timer(self.agent_type, "prompt"):
+            db = await get_db()
+            prompt_doc = await db.ai_prompts.find_one(
+                {
+                    "agent_type": self.agent_type,
+                    "prompt_name": prompt_name,
+                    "is_active": True
+                },
+                {"template": 1, "version": 1}
+            )
         
         if prompt_doc:
-            return prompt_doc["template"]
+            template = prompt_doc["template"]
+            version = prompt_doc.get("version", 1)
+        else:
+            # إذا لم توجد، ارجع للملف الافتراضي (الإصدار 0)
+            template = self._get_default_prompt(prompt_name)
+            version = 0
         
-        # إذا لم توجد، ارجع للملف الافتراضي
-        return self._get_default_prompt(prompt_name)
+        prompt_cache.set(self.agent_type, prompt_name, template, version, generation)
+        return template, version
     
     @abstractmethod
     def _get_default_prompt(self, prompt_name: str) -> str:
@@ -76,34 +144,155 @@ class BaseAgent(ABC):
     
     async def call_openai(self, messages: list, **kwargs) -> Optional[str]:
         """استدعاء OpenAI مع معالجة الأخطاء"""
+        response = await self._complete(messages, **kwargs)
+        if response is None:
+            return self._get_fallback_response()
+        return response
+    
+    async def _complete(self, messages: list, **kwargs) -> Optional[str]:
+        """استدعاء OpenAI وإرجاع None عند الفشل بدلاً من الرد الاحتياطي
+
+        - إذا كانت الدائرة مفتوحة يرجع None فوراً (المسار الاحتياطي)
+        - latency_budget: بعد هذه المدة يرجع None ويكمل الاستدعاء في الخلفية،
+          ويُمرر الرد المتأخر إلى on_late_result (مثلاً لتعبئة الكاش)
+        """
+        if not self.client:
+            logger.warning(f"OpenAI client not available for {self.agent_type}")
+            return None
+        
+        model = kwargs.get('model', settings.openai_model)
+        breaker = get_circuit_breaker(self.agent_type, model)
+        if not breaker.allow_request():
+            logger.warning(f"Circuit open for {self.agent_type}/{model}, using fallback")
+            return None
+        
+        call = asyncio.ensure_future(self._call_llm(messages, breaker, **kwargs))
+        
+        latency_budget = kwargs.get('latency_budget')
+        if not latency_budget:
+            return await call
+        
         try:
-            if not self.client:
-                logger.warning(f"OpenAI client not available for {self.agent_type}")
-                return self._get_fallback_response()
+            return await asyncio.wait_for(asyncio.shield(call), latency_budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"Latency budget {latency_budget}s exceeded for {self.agent_type}, using fallback")
+            _background_calls.add(call)
+            call.add_done_callback(_background_calls.discard)
             
-            # التحقق من نوع العميل
-            if hasattr(self.client, 'chat'):
-                # عميل OpenAI عادي
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    max_tokens=kwargs.get('max_tokens', 200),
-                    temperature=kwargs.get('temperature', 0.7)
+            on_late_result = kwargs.get('on_late_result')
+            if on_late_result:
+                call.add_done_callback(lambda done: _deliver_late_result(done, on_late_result))
+            return None
+    
+    async def _call_llm(self, messages: list, breaker, **kwargs) -> Optional[str]:
+        """الاستدعاء الفعلي لـ OpenAI مع تسجيل النتيجة في الـ circuit breaker"""
+        # None حتى تُعرف النتيجة - الإلغاء أو رفض محدد المعدل لا يُحسب على OpenAI
+        outcome = None
+        requested = False
+        try:
+            max_tokens = kwargs.get('max_tokens', 200)
+            
+            # انتظار الدور في محدد المعدل العام حسب الأولوية
+            estimated_tokens = llm_rate_limiter.estimate_tokens(messages, max_tokens)
+            await llm_rate_limiter.acquire(kwargs.get('priority', 'interactive'), estimated_tokens)
+            requested = True
+            
+            # استدعاء غير متزامن - لا يوقف الـ event loop أثناء انتظار الرد
+            start_time = time.perf_counter()
+            response = await self.client.chat.completions.create(
+                model=kwargs.get('model', settings.openai_model),
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=kwargs.get('temperature', 0.7),
+                timeout=kwargs.get('timeout', settings.openai_timeout)
+            )
+            duration = time.perf_counter() - start_time
+            outcome = "success"
+            breaker.record_success(duration)
+            agent_metrics.record_phase(self.agent_type, "llm", duration)
+            
+            if response.usage:
+                llm_rate_limiter.adjust(estimated_tokens, response.usage.total_tokens)
+            
+            if not response.choices:
+                logger.warning(f"No response content from OpenAI for {self.agent_type}")
+                return None
+            
+            # content يكون None مع الرفض أو tool calls - رد صالح من الخادم وليس عطلاً
+            choice = response.choices[0]
+            content = (choice.message.content or "").strip()
+            if not content:
+                logger.warning(
+                    f"Empty response content from OpenAI for {self.agent_type}",
+                    finish_reason=choice.finish_reason
                 )
-                
-                if response.choices and len(response.choices) > 0:
-                    return response.choices[0].message.content.strip()
-                else:
-                    logger.warning(f"No response content from OpenAI for {self.agent_type}")
-                    return self._get_fallback_response()
-            else:
-                # عميل HTTP بديل - إرجاع رسالة احتياطية
-                logger.warning(f"Using fallback response for {self.agent_type} (no OpenAI client)")
-                return self._get_fallback_response()
+                return None
+            return content
                 
         except Exception as e:
+            if requested and outcome is None:
+                outcome = "failure"
+                breaker.record_failure()
             logger.error(f"OpenAI error for {self.agent_type}: {e}")
-            return self._get_fallback_response()
+            return None
+        finally:
+            if outcome is None:
+                # لم يصل الطلب لـ OpenAI أو أُلغي قبل الرد: تحرير الاستدعاء التجريبي فقط
+                breaker.release()
+    
+    async def stream_openai(self, messages: list, **kwargs) -> AsyncIterator[str]:
+        """استدعاء OpenAI بوضع البث - يرجع أجزاء النص فور وصولها"""
+        if not self.client:
+            logger.warning(f"OpenAI client not available for {self.agent_type}")
+            return
+        
+        model = kwargs.get('model', settings.openai_model)
+        breaker = get_circuit_breaker(self.agent_type, model)
+        if not breaker.allow_request():
+            logger.warning(f"Circuit open for {self.agent_type}/{model}, using fallback")
+            return
+        
+        max_tokens = kwargs.get('max_tokens', 200)
+        estimated_tokens = llm_rate_limiter.estimate_tokens(messages, max_tokens)
+        # None حتى تُعرف النتيجة - إغلاق البث من المستهلك أو الإلغاء لا يُحسب فشلاً
+        outcome = None
+        received = False
+        requested = False
+        start_time = time.perf_counter()
+        try:
+            await llm_rate_limiter.acquire(kwargs.get('priority', 'interactive'), estimated_tokens)
+            requested = True
+            start_time = time.perf_counter()
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=kwargs.get('temperature', 0.7),
+                timeout=kwargs.get('timeout', settings.openai_timeout),
+                stream=True
+            )
+            
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    received = True
+                    yield chunk.choices[0].delta.content
+            outcome = "success"
+        except Exception:
+            # رفض أو مهلة في محدد المعدل ليست عطلاً في OpenAI
+            if requested:
+                outcome = "failure"
+            raise
+        finally:
+            duration = time.perf_counter() - start_time
+            if outcome == "failure":
+                breaker.record_failure()
+            elif outcome == "success" or received:
+                # المزود كان يرد - البث المقطوع من جهة العميل نجاح جزئي
+                breaker.record_success(duration)
+                agent_metrics.record_phase(self.agent_type, "llm", duration)
+            else:
+                # أُغلق قبل أي رد: لا نجاح ولا فشل، فقط تحرير الاستدعاء التجريبي
+                breaker.release()
     
     @abstractmethod
     def _get_fallback_response(self) -> str:
@@ -0,0 +1,114 @@
+"""Circuit breaker لاستدعاءات الـ LLM لكل Agent ونموذج"""
+from typing import Dict, Any, Tuple
+import time
+from app.config import settings
+import structlog
+
+logger = structlog.get_logger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """يفتح الدائرة بعد عدد من الأخطاء أو الاستدعاءات البطيئة المتتالية
+
+    - closed: الاستدعاءات تمر بشكل طبيعي
+    - open: الاستدعاءات تُرفض فوراً (المسار الاحتياطي) لمدة open_seconds
+    - half_open: يُسمح بعدد محدود من الاستدعاءات التجريبية للتعافي
+    """
+
+    def __init__(self, name: str, failure_threshold: int, slow_call_seconds: float,
+                 open_seconds: float, half_open_max_calls: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_in_flight = 0
+        self.half_open_since = 0.0
+        self.rejected_calls = 0
+        self.times_opened = 0
+
+    def allow_request(self) -> bool:
+        """هل يُسمح بالاستدعاء الآن؟"""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected_calls += 1
+                return False
+            self.state = HALF_OPEN
+            self.half_open_in_flight = 0
+            self.half_open_since = time.monotonic()
+            logger.info(f"Circuit {self.name} half-open, probing provider")
+
+        if self.state == HALF_OPEN:
+            if time.monotonic() - self.half_open_since > self.open_seconds:
+                # استدعاء تجريبي أُلغي دون نتيجة - اسمح بمحاولة جديدة
+                self.half_open_in_flight = 0
+                self.half_open_since = time.monotonic()
+            if self.half_open_in_flight >= self.half_open_max_calls:
+                self.rejected_calls += 1
+                return False
+            self.half_open_in_flight += 1
+
+        return True
+
+    def record_success(self, duration: float):
+        """تسجيل استدعاء ناجح - البطيء جداً يُحسب كفشل"""
+        if self.slow_call_seconds and duration > self.slow_call_seconds:
+            logger.warning(f"Slow LLM call on {self.name}: {duration:.2f}s")
+            self.record_failure()
+            return
+
+        if self.state == HALF_OPEN:
+            logger.info(f"Circuit {self.name} closed, provider recovered")
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.half_open_in_flight = 0
+
+    def release(self):
+        """استدعاء انتهى بدون نتيجة (أُلغي أو أغلقه المستهلك) - يحرر مكان الاستدعاء التجريبي فقط"""
+        if self.state == HALF_OPEN and self.half_open_in_flight > 0:
+            self.half_open_in_flight -= 1
+
+    def record_failure(self):
+        """تسجيل فشل وفتح الدائرة عند تجاوز الحد"""
+        self.consecutive_failures += 1
+
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+                logger.warning(f"Circuit {self.name} opened after {self.consecutive_failures} failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.half_open_in_flight = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "rejected_calls": self.rejected_calls,
+            "times_opened": self.times_opened
+        }
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+def get_circuit_breaker(agent_type: str, model: str) -> CircuitBreaker:
+    """Circuit breaker مشترك لكل (agent_type, model)"""
+    key = (agent_type, model)
+    if key not in _breakers:
+        _breakers[key] = CircuitBreaker(
+            name=f"{agent_type}/{model}",
+            failure_threshold=settings.llm_breaker_failure_threshold,
+            slow_call_seconds=settings.llm_breaker_slow_call_seconds,
+            open_seconds=settings.llm_breaker_open_seconds,
+            half_open_max_calls=settings.llm_breaker_half_open_calls
+        )
+    return _breakers[key]
+
+def get_circuit_breaker_stats() -> Dict[str, Any]:
+    """حالة جميع الـ circuit breakers"""
+    return {breaker.name: breaker.get_stats() for breaker in _breakers.values()}
@@ -3,6 +3,8 @@ from typing import Dict, Any, Optional
 from datetime import datetime
 import random
 from app.ai.base_agent import BaseAgent
+from app.ai.response_cache import coach_response_cache
+from app.config import settings
 from app.ai.prompts.coach_prompts import (
     COACH_AI_SYSTEM_PROMPT, 
     COACH_USER_TEMPLATE,
@@ -10,10 +12,19 @@ from app.ai.prompts.coach_prompts import (
     DEPARTMENT_VARIABLES
 )
 from app.utils.quiet_mode import QuietMode
+from app.services.coach_throttle import coach_throttle
+from app.services.deferred_delivery import deferred_delivery
 import structlog
 
 logger = structlog.get_logger()
 
+# يوضع مكان اسم الموظف في الـ prompt حتى يكون الرد قابلاً لإعادة الاستخدام
+NAME_PLACEHOLDER = "{name}"
+NAME_PLACEHOLDER_INSTRUCTION = (
+    f"\n\nمهم: اكتب {NAME_PLACEHOLDER} حرفياً كما هو مكان اسم الموظف "
+    "(بنفس الأقواس، بدون ترجمة أو تغيير) لأنه يُستبدل بالاسم لاحقاً."
+)
+
 class CoachAI(BaseAgent):
     """مدرب ذكي متخصص في تحفيز الموظفين"""
     
@@ -43,57 +54,94 @@ class CoachAI(BaseAgent):
         else:
             return "critical"
     
-    def _should_send_message(self, performance_level: str, last_message_time: datetime = None) -> bool:
+    def _should_send_message(self, performance_level: str, last_message_time: datetime = None,
+                             timezone: Optional[str] = None) -> bool:
         """تحديد ما إذا كان يجب إرسال رسالة"""
         # لا ترسل للأداء الممتاز
         if performance_level == "excellent":
             return False
         
-        # استخدام QuietMode للتحقق من الوقت والتكرار
-        return QuietMode.should_send_message(last_message_time)
+        # استخدام QuietMode للتحقق من الوقت (بتوقيت الموظف) والتكرار
+        return QuietMode.should_send_message(last_message_time, timezone)
     
-    async def generate_coach_message(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
-        """إنشاء رسالة تحفيز مخصصة للموظف"""
+    async def get_prompt_versions(self) -> Dict[str, int]:
+        """إصدارات الـ prompts الحالية التي تُبنى منها الرسائل"""
+        _, system_version = await self.get_prompt_with_version("system")
+        _, user_version = await self.get_prompt_with_version("user_template")
+        return {"system": system_version, "user_template": user_version}
+    
+    async def generate_coach_message(self, user_data: Dict[str, Any], bypass_cache: bool = False,
+                                     priority: str = "interactive", latency_budget: Optional[float] = None,
+                                     check_schedule: bool = True) -> Dict[str, Any]:
+        """إنشاء رسالة تحفيز مخصصة للموظف
+
+        check_schedule=False يتجاوز Quiet Mode للتوليد المسبق (الإرسال
+        نفسه يبقى خاضعاً له عند تقديم الرسالة).
+        """
+        # حجز في سجل التباعد لم يُثبت بعد - يُلغى إن لم نصل إلى record
+        reserved = False
         try:
             # جلب البيانات المطلوبة
             name = user_data.get("name", "عزيزي الموظف")
             department = user_data.get("department", "عام")
             drift = user_data.get("drift", 0.0)
             summary = user_data.get("summary", "")
+            user_email = user_data.get("user_email")
             
             # تحديد مستوى الأداء
             performance_level = self._determine_performance_level(drift)
             
-            # التحقق من الوقت الحالي
-            now = datetime.now()
+            # الوقت الحالي بتوقيت الموظف (نفس المنطقة التي يقيّم بها Quiet Mode)
+            now = QuietMode.local_now(user_data.get("timezone"))
             
             # تحديد ما إذا كان يجب إرسال الرسالة
-            should_send = self._should_send_message(performance_level)
+            if check_schedule:
+                should_send = self._should_send_message(performance_level, timezone=user_data.get("timezone"))
+            else:
+                should_send = performance_level != "excellent"
             
             if not should_send:
+                source = "skipped"
+                # ممنوعة بسبب Quiet Mode: تُرسل عند بداية فترة الموظف
+                if performance_level != "excellent" and user_email:
+                    await deferred_delivery.defer(user_data)
+                    source = "deferred"
                 return {
                     "message": "",
                     "performance_level": performance_level,
-                    "should_send": False
+                    "should_send": False,
+                    "source": source
                 }
             
+            # قاعدة التباعد بين الرسائل قبل أي prompt أو LLM
+            if check_schedule and user_email:
+                allowed, last_message = await coach_throttle.try_reserve(user_email)
+                if not allowed:
+                    return self._throttled_response(last_message, performance_level)
+                reserved = True
+            
             # جلب الـ prompts المرنة
-            system_prompt = await self.get_prompt_template("system")
-            user_template = await self.get_prompt_template("user_template")
+            system_prompt, system_version = await self.get_prompt_with_version("system")
+            user_template, user_version = await self.get_prompt_with_version("user_template")
+            
+            use_cache = settings.response_cache_enabled and not bypass_cache
             
-            # إعداد المتغيرات
+            # إعداد المتغيرات - مع الكاش يُستبدل الاسم بعد الاستدعاء
+            # ويُقرّب الوقت للساعة حتى تتطابق مفاتيح الكاش
             variables = {
-                "name": name,
+                "name": NAME_PLACEHOLDER if use_cache else name,
                 "department": department,
                 "role": user_data.get("role", "موظف"),
                 "performance_level": performance_level,
                 "summary": summary,
-                "current_time": now.strftime("%H:%M"),
+                "current_time": now.strftime("%H:00" if use_cache else "%H:%M"),
                 "current_day": "اليوم"  # مبسط
             }
             
             # تنسيق القالب
             user_prompt = self.format_template(user_template, variables)
+            if use_cache:
+                user_prompt += NAME_PLACEHOLDER_INSTRUCTION
             
             # استدعاء OpenAI
             messages = [
@@ -101,16 +149,37 @@ class CoachAI(BaseAgent):
                 {"role": "user", "content": user_prompt}
             ]
             
-            ai_response = await self.call_openai(messages)
+            if latency_budget is None:
+                latency_budget = settings.coach_latency_budget or None
+            
+            if use_cache:
+                ai_response = await self._complete_cached(messages, priority=priority, latency_budget=latency_budget)
+                if ai_response and NAME_PLACEHOLDER not in ai_response:
+                    # النموذج لم يحافظ على الـ placeholder - رد خاص بهذا الموظف بدون كاش
+                    logger.warning("Coach response dropped name placeholder, regenerating per user")
+                    variables.update({"name": name, "current_time": now.strftime("%H:%M")})
+                    messages[1]["content"] = self.format_template(user_template, variables)
+                    ai_response = await self._complete(messages, priority=priority, latency_budget=latency_budget)
+            else:
+                ai_response = await self._complete(messages, priority=priority, latency_budget=latency_budget)
             
             # إذا فشل AI، استخدم القوالب الجاهزة
+            source = "ai"
             if not ai_response:
                 ai_response = self._get_template_message(performance_level, department)
+                source = "template"
+            
+            message = ai_response.replace(NAME_PLACEHOLDER, name)
+            if reserved:
+                await coach_throttle.record(user_email, message, performance_level)
+                reserved = False
             
             return {
-                "message": ai_response,
+                "message": message,
                 "performance_level": performance_level,
-                "should_send": True
+                "should_send": True,
+                "source": source,
+                "prompt_versions": {"system": system_version, "user_template": user_version}
             }
             
         except Exception as e:
@@ -118,8 +187,48 @@ class CoachAI(BaseAgent):
             return {
                 "message": self._get_fallback_response(),
                 "performance_level": "good",
-                "should_send": True
+                "should_send": True,
+                "source": "fallback"
             }
+        finally:
+            if reserved:
+                coach_throttle.release(user_email)
+    
+    @staticmethod
+    def _throttled_response(last_message: Dict[str, Any], performance_level: str) -> Dict[str, Any]:
+        """رد بدون رسالة لموظف وصلته رسالة قبل أقل من التباعد المطلوب"""
+        return {
+            "message": "",
+            "performance_level": last_message.get("performance_level") or performance_level,
+            "should_send": False,
+            "source": "throttled"
+        }
+    
+    async def _complete_cached(self, messages: list, **kwargs) -> Optional[str]:
+        """استدعاء OpenAI عبر كاش الردود"""
+        cache_key = coach_response_cache.make_key(
+            messages,
+            model=kwargs.get("model", settings.openai_model),
+            max_tokens=kwargs.get("max_tokens", 200),
+            temperature=kwargs.get("temperature", 0.7)
+        )
+        
+        cached = await coach_response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        async def fill_cache(late_response: str):
+            if NAME_PLACEHOLDER in late_response:
+                await coach_response_cache.set(cache_key, late_response)
+        
+        # إذا تجاوز الرد latency budget يُخزن عند وصوله للطلبات القادمة
+        ai_response = await self._complete(messages, on_late_result=fill_cache, **kwargs)
+        
+        # لا نخزن الفشل ولا رداً بدون الـ placeholder (سيظهر بلا اسم لكل من يُقدم له)
+        if ai_response and NAME_PLACEHOLDER in ai_response:
+            await coach_response_cache.set(cache_key, ai_response)
+        
+        return ai_response
     
     def _get_template_message(self, performance_level: str, department: str) -> str:
         """جلب رسالة من القوالب الجاهزة"""
@@ -0,0 +1,135 @@
+"""تدفقات التنسيق بين الـ Agents كرسوم اعتماديات صغيرة"""
+from typing import Dict, Any, List, Callable, Optional, Sequence
+import asyncio
+import time
+import structlog
+
+logger = structlog.get_logger()
+
+class FlowStep:
+    """خطوة في تدفق تنسيق: مهمة على Agent مع اعتمادياتها"""
+
+    def __init__(self, name: str, agent_type: str, task_name: str,
+                 build_kwargs: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]],
+                 depends_on: Sequence[str] = (), timeout: Optional[float] = None):
+        self.name = name
+        self.agent_type = agent_type
+        self.task_name = task_name
+        # (data, نتائج الخطوات السابقة) -> معاملات المهمة
+        self.build_kwargs = build_kwargs
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+
+def _improvement_goal(data: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, Any]:
+    user_data = data.get("user_data", {})
+    return {
+        "goal_text": f"تحسين أداء {user_data.get('name', 'الموظف')} في قسم {user_data.get('department', 'العام')}"
+    }
+
+# الخطوات بدون اعتماديات تعمل بالتوازي
+COORDINATION_FLOWS: Dict[str, List[FlowStep]] = {
+    "project_with_coaching": [
+        FlowStep(
+            "project_plan", "orchestrator", "expand_goal",
+            lambda data, results: {"goal_text": data.get("goal_text", "")}
+        ),
+        FlowStep(
+            "motivation_message", "coach", "generate_message",
+            lambda data, results: {"user_data": data.get("user_data", {})}
+        )
+    ],
+    "performance_analysis": [
+        FlowStep(
+            "motivation_message", "coach", "generate_message",
+            lambda data, results: {"user_data": data.get("user_data", {})}
+        ),
+        FlowStep("improvement_plan", "orchestrator", "expand_goal", _improvement_goal)
+    ]
+}
+
+async def run_flow(manager, steps: List[FlowStep], data: Dict[str, Any], default_timeout: float) -> Dict[str, Any]:
+    """تنفيذ خطوات التدفق بأقصى توازي تسمح به الاعتماديات
+
+    يرجع نتيجة كل خطوة (حتى لو فشلت خطوات أخرى) مع زمن المسار الحرج
+    مقابل مجموع زمن العمل.
+    """
+    flow_start = time.perf_counter()
+    step_tasks: Dict[str, asyncio.Task] = {}
+    results: Dict[str, Any] = {}
+    reports: Dict[str, Dict[str, Any]] = {}
+
+    async def run_step(step: FlowStep):
+        if step.depends_on:
+            await asyncio.gather(*(step_tasks[dependency] for dependency in step.depends_on))
+
+        failed_dependencies = [
+            dependency for dependency in step.depends_on
+            if reports[dependency]["status"] != "success"
+        ]
+        if failed_dependencies:
+            reports[step.name] = {
+                "status": "skipped",
+                "error": f"Dependencies failed: {', '.join(failed_dependencies)}",
+                "duration": 0.0
+            }
+            return
+
+        timeout = step.timeout or default_timeout
+        start = time.perf_counter()
+        report = {"agent_type": step.agent_type, "task": step.task_name}
+
+        try:
+            outcome = await asyncio.wait_for(
+                manager.execute_agent_task(
+                    step.agent_type,
+                    step.task_name,
+                    **step.build_kwargs(data, results)
+                ),
+                timeout
+            )
+            if outcome.get("success"):
+                results[step.name] = outcome.get("result")
+                report["status"] = "success"
+            else:
+                report["status"] = "failed"
+                report["error"] = outcome.get("error")
+        except asyncio.TimeoutError:
+            report["status"] = "timeout"
+            report["error"] = f"Step exceeded {timeout}s"
+        except Exception as e:
+            logger.error(f"Coordination step {step.name} failed: {e}")
+            report["status"] = "failed"
+            report["error"] = str(e)
+
+        report["started_at"] = round(start - flow_start, 3)
+        report["duration"] = round(time.perf_counter() - start, 3)
+        reports[step.name] = report
+
+    for step in steps:
+        unknown = [dependency for dependency in step.depends_on if dependency not in step_tasks]
+        if unknown:
+            raise ValueError(f"Step {step.name} depends on undefined steps: {unknown}")
+        step_tasks[step.name] = asyncio.create_task(run_step(step))
+
+    await asyncio.gather(*step_tasks.values())
+
+    # المسار الحرج: أطول سلسلة اعتماديات من حيث الزمن
+    finish_times: Dict[str, float] = {}
+    for step in steps:
+        earliest_start = max((finish_times[dependency] for dependency in step.depends_on), default=0.0)
+        finish_times[step.name] = earliest_start + reports[step.name]["duration"]
+
+    total_work_time = sum(report["duration"] for report in reports.values())
+    wall_time = time.perf_counter() - flow_start
+
+    return {
+        "results": results,
+        "steps": reports,
+        "partial": any(report["status"] != "success" for report in reports.values()),
+        "timing": {
+            "wall_time": round(wall_time, 3),
+            "critical_path_time": round(max(finish_times.values(), default=0.0), 3),
+            "total_work_time": round(total_work_time, 3),
+            "parallel_speedup": round(total_work_time / wall_time, 2) if wall_time > 0 else None
+        }
+    }
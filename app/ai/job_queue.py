@@ -0,0 +1,258 @@
+"""طابور مهام الـ Agents غير المتزامن - النتيجة تُسترجع لاحقاً بمعرف المهمة"""
+from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import asyncio
+import ipaddress
+import socket
+import time
+import uuid
+from app.db import get_db
+from app.config import settings
+from app.ai.metrics import LatencyHistogram
+from app.ai.agent_manager import agent_manager
+import structlog
+
+logger = structlog.get_logger()
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class QueueFullError(Exception):
+    """الطابور ممتلئ - يجب على العميل إعادة المحاولة لاحقاً"""
+
+class CallbackURLError(ValueError):
+    """callback_url غير مسموح (ليس https أو خارج القائمة أو عنوان داخلي)"""
+
+async def _resolve(host: str, port: int) -> set:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return {info[4][0] for info in infos}
+
+async def validate_callback_url(url: str) -> str:
+    """التحقق من callback_url قبل قبول المهمة وقبل الإرسال (حماية من SSRF)"""
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.hostname:
+        raise CallbackURLError("callback_url must be an https URL")
+    if parts.username or parts.password:
+        raise CallbackURLError("callback_url must not contain credentials")
+
+    host = parts.hostname.lower()
+    if host not in settings.agent_job_callback_allowed_hosts:
+        raise CallbackURLError(f"callback_url host {host} is not allowed")
+
+    try:
+        addresses = await _resolve(host, parts.port or 443)
+    except socket.gaierror:
+        raise CallbackURLError(f"callback_url host {host} does not resolve")
+
+    # host في القائمة قد يشير لعنوان داخلي (DNS) - نرفض أي عنوان غير عام
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global:
+            raise CallbackURLError(f"callback_url host {host} resolves to a private address")
+    return url
+
+class AgentJobQueue:
+    """طابور داخل العملية مع pool من الـ workers وتخزين النتائج في agent_jobs
+
+    المهام تُنفذ عبر AgentManager.execute_agent_task فتستفيد من الدمج
+    والإحصائيات. المهام التي لم تكتمل تضيع عند إعادة تشغيل العملية.
+    """
+
+    def __init__(self, manager, worker_count: int, max_queue_size: int, ttl_hours: float):
+        self.manager = manager
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self.ttl_hours = ttl_hours
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._busy_workers = 0
+        # مهام قُبلت وتُكتب الآن في agent_jobs ولم تدخل الطابور بعد
+        self._reserved = 0
+        self._busy_time = 0.0
+        self._started_at: Optional[float] = None
+        self.stats = {
+            "submitted": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "rejected": 0,
+            "callbacks_sent": 0,
+            "callbacks_failed": 0
+        }
+        self.queue_wait = LatencyHistogram()
+        self.run_time = LatencyHistogram()
+
+    def start(self):
+        """تشغيل الـ workers (يُستدعى عند البدء أو مع أول مهمة)"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._started_at = time.monotonic()
+        self._workers = [
+            asyncio.create_task(self._worker(index))
+            for index in range(self.worker_count)
+        ]
+        logger.info(f"Agent job queue started with {self.worker_count} workers")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def submit(self, agent_type: str, task_name: str, params: Dict[str, Any],
+                     callback_url: Optional[str] = None) -> Dict[str, Any]:
+        """إضافة مهمة للطابور وإرجاع معرفها فوراً"""
+        if callback_url:
+            await validate_callback_url(callback_url)
+
+        self.start()
+        # المكان يُحجز قبل أول await حتى لا يملأ طلب متزامن الطابور أثناء الكتابة
+        if self.max_queue_size > 0 and self._queue.qsize() + self._reserved >= self.max_queue_size:
+            self.stats["rejected"] += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queue_size} jobs)")
+        self._reserved += 1
+
+        now = datetime.utcnow()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "agent_type": agent_type,
+            "task": task_name,
+            "params": params,
+            "status": QUEUED,
+            "callback_url": callback_url,
+            "created_at": now,
+            "expires_at": now + timedelta(hours=self.ttl_hours)
+        }
+
+        try:
+            db = await get_db()
+            await db.agent_jobs.insert_one(job)
+        finally:
+            self._reserved -= 1
+
+        self._queue.put_nowait((job, time.perf_counter()))
+        self.stats["submitted"] += 1
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        db = await get_db()
+        job = await db.agent_jobs.find_one({"_id": job_id}, {"params": 0})
+        if job:
+            job["job_id"] = job.pop("_id")
+        return job
+
+    async def _worker(self, index: int):
+        while True:
+            job, enqueued_at = await self._queue.get()
+            self._busy_workers += 1
+            start = time.perf_counter()
+            self.queue_wait.record(start - enqueued_at)
+            try:
+                await self._run_job(job)
+            except Exception as e:
+                logger.error(f"Job worker {index} failed on job {job['_id']}: {e}")
+                await self._mark_failed(job, str(e))
+            finally:
+                duration = time.perf_counter() - start
+                self.run_time.record(duration)
+                self._busy_time += duration
+                self._busy_workers -= 1
+                self._queue.task_done()
+
+    async def _run_job(self, job: Dict[str, Any]):
+        db = await get_db()
+        await db.agent_jobs.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": RUNNING, "started_at": datetime.utcnow()}}
+        )
+
+        outcome = await self.manager.execute_agent_task(job["agent_type"], job["task"], **job["params"])
+
+        update = {
+            "status": SUCCEEDED if outcome["success"] else FAILED,
+            "finished_at": datetime.utcnow(),
+            "execution_time": outcome.get("execution_time")
+        }
+        if outcome["success"]:
+            update["result"] = outcome["result"]
+        else:
+            update["error"] = outcome["error"]
+
+        await db.agent_jobs.update_one({"_id": job["_id"]}, {"$set": update})
+        # العد بعد الكتابة: إن فشلت يعدها _mark_failed مرة واحدة
+        self.stats["succeeded" if outcome["success"] else "failed"] += 1
+
+        if job.get("callback_url"):
+            await self._send_callback(job, update)
+
+    async def _mark_failed(self, job: Dict[str, Any], error: str):
+        """تسجيل فشل المهمة حتى لا تبقى في حالة running"""
+        try:
+            db = await get_db()
+            result = await db.agent_jobs.update_one(
+                {"_id": job["_id"], "status": {"$in": [QUEUED, RUNNING]}},
+                {"$set": {"status": FAILED, "error": error, "finished_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.error(f"Could not mark job {job['_id']} as failed: {e}")
+            self.stats["failed"] += 1
+            return
+        # مهمة انتهت حالتها مسبقاً (مثلاً فشل الـ callback بعد النجاح) حُسبت بالفعل
+        if result.modified_count:
+            self.stats["failed"] += 1
+
+    async def _send_callback(self, job: Dict[str, Any], update: Dict[str, Any]):
+        """إرسال النتيجة إلى callback_url (محاولة واحدة)"""
+        import httpx
+
+        payload = {
+            "job_id": job["_id"],
+            "agent_type": job["agent_type"],
+            "task": job["task"],
+            "status": update["status"],
+            "result": update.get("result"),
+            "error": update.get("error"),
+            "execution_time": update.get("execution_time")
+        }
+        try:
+            # إعادة التحقق عند الإرسال: القائمة أو الـ DNS قد تتغير بعد قبول المهمة
+            await validate_callback_url(job["callback_url"])
+            async with httpx.AsyncClient(timeout=settings.agent_job_callback_timeout) as client:
+                response = await client.post(job["callback_url"], json=payload)
+                response.raise_for_status()
+            self.stats["callbacks_sent"] += 1
+            callback_status = "sent"
+        except Exception as e:
+            logger.warning(f"Callback for job {job['_id']} failed: {e}")
+            self.stats["callbacks_failed"] += 1
+            callback_status = "failed"
+
+        db = await get_db()
+        await db.agent_jobs.update_one({"_id": job["_id"]}, {"$set": {"callback_status": callback_status}})
+
+    def get_stats(self) -> Dict[str, Any]:
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        capacity = uptime * self.worker_count
+        return {
+            "running": bool(self._workers),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue_size": self.max_queue_size,
+            "workers": self.worker_count,
+            "busy_workers": self._busy_workers,
+            "utilization": round(self._busy_time / capacity * 100, 2) if capacity else 0.0,
+            **self.stats,
+            "queue_wait": self.queue_wait.summary(),
+            "run_time": self.run_time.summary()
+        }
+
+# طابور مشترك لكل العملية
+agent_job_queue = AgentJobQueue(
+    agent_manager,
+    worker_count=settings.agent_job_workers,
+    max_queue_size=settings.agent_job_queue_size,
+    ttl_hours=settings.agent_job_ttl_hours
+)
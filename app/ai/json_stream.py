@@ -0,0 +1,141 @@
+"""تحليل تدريجي لمخرجات JSON من الـ LLM أثناء وصولها"""
+from typing import List, Dict, Any, Optional, Tuple
+import json
+import re
+import structlog
+
+logger = structlog.get_logger()
+
+TASKS_ARRAY_PATTERN = re.compile(r'"tasks"\s*:\s*\[')
+
+class TaskStreamParser:
+    """يستخرج عناصر مصفوفة "tasks" المكتملة من نص JSON يصل على دفعات
+
+    كل استدعاء لـ feed يرجع المهام التي اكتمل نصها منذ الاستدعاء السابق.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._scan_pos = 0
+        self._in_array = False
+        self._array_done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """إضافة جزء جديد من النص وإرجاع المهام المكتملة"""
+        self.text += chunk
+        tasks = []
+
+        if self._array_done:
+            return tasks
+
+        if not self._in_array:
+            match = TASKS_ARRAY_PATTERN.search(self.text)
+            if not match:
+                return tasks
+            self._in_array = True
+            self._scan_pos = match.end()
+
+        while self._scan_pos < len(self.text):
+            char = self.text[self._scan_pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._object_start = self._scan_pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # نهاية مصفوفة المهام
+                    self._array_done = True
+                    self._scan_pos += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    task = self._decode(self.text[self._object_start:self._scan_pos + 1])
+                    if task is not None:
+                        tasks.append(task)
+                    self._object_start = None
+
+            self._scan_pos += 1
+
+        return tasks
+
+    @staticmethod
+    def _decode(raw: str) -> Optional[Dict[str, Any]]:
+        try:
+            task = json.loads(raw)
+            return task if isinstance(task, dict) else None
+        except json.JSONDecodeError:
+            logger.warning("Skipping malformed task object in stream")
+            return None
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+def strip_code_fences(text: str) -> str:
+    """إزالة ```json ... ``` وأي نص قبل بداية الـ JSON"""
+    if not text:
+        return ""
+
+    match = CODE_FENCE_PATTERN.search(text)
+    if match:
+        text = match.group(1)
+
+    start = text.find("{")
+    return text[start:].strip() if start >= 0 else text.strip()
+
+def recover_truncated_project(text: str) -> Optional[Dict[str, Any]]:
+    """استرجاع أطول جزء صالح من JSON مشروع مقطوع
+
+    الحقول قبل مصفوفة tasks تُقرأ كما هي، والمهام المكتملة فقط تُضاف،
+    وأي حقول بعد المصفوفة المقطوعة تُترك لتُكمل من القوالب.
+    """
+    match = TASKS_ARRAY_PATTERN.search(text)
+    if not match:
+        return None
+
+    head = text[:match.start()].rstrip().rstrip(",")
+    try:
+        project = json.loads(head + "}")
+    except json.JSONDecodeError:
+        project = {}
+
+    if not isinstance(project, dict):
+        project = {}
+
+    parser = TaskStreamParser()
+    project["tasks"] = parser.feed(text)
+    return project
+
+def parse_project_json(text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """تحليل رد المنسق بتسامح
+
+    يرجع (البيانات، الحالة) والحالة: parsed أو repaired أو failed.
+    """
+    cleaned = strip_code_fences(text)
+    if not cleaned:
+        return None, "failed"
+
+    try:
+        data = json.loads(cleaned)
+        if isinstance(data, dict):
+            return data, "parsed" if cleaned == text.strip() else "repaired"
+    except json.JSONDecodeError:
+        pass
+
+    data = recover_truncated_project(cleaned)
+    if data and data.get("tasks"):
+        return data, "repaired"
+
+    return None, "failed"
@@ -0,0 +1,185 @@
+"""مقاييس زمن الاستجابة للـ Agents - histograms بذاكرة ثابتة"""
+from typing import Dict, Any, Optional, Tuple
+from contextlib import contextmanager
+import math
+import time
+
+# دقة الـ buckets: 2^(SUB_BUCKET_BITS-1) bucket لكل مضاعف (~3%)
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS // 2
+# أقصى قيمة: 2^36 ميكروثانية (~19 ساعة)
+MAX_EXPONENT = 36
+BUCKET_COUNT = SUB_BUCKETS + (MAX_EXPONENT - SUB_BUCKET_BITS) * HALF_SUB_BUCKETS
+
+class LatencyHistogram:
+    """Histogram بأسلوب HDR: buckets لوغاريتمية-خطية بالميكروثانية
+
+    الذاكرة ثابتة مهما كان عدد القياسات، والـ percentiles بدقة ~3%.
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _bucket_index(microseconds: int) -> int:
+        if microseconds < SUB_BUCKETS:
+            return microseconds
+        exponent = microseconds.bit_length() - SUB_BUCKET_BITS
+        mantissa = microseconds >> exponent
+        index = SUB_BUCKETS + (exponent - 1) * HALF_SUB_BUCKETS + (mantissa - HALF_SUB_BUCKETS)
+        return min(index, BUCKET_COUNT - 1)
+
+    @staticmethod
+    def _bucket_value(index: int) -> float:
+        """منتصف الـ bucket بالميكروثانية"""
+        if index < SUB_BUCKETS:
+            return float(index)
+        offset = index - SUB_BUCKETS
+        exponent = offset // HALF_SUB_BUCKETS + 1
+        mantissa = offset % HALF_SUB_BUCKETS + HALF_SUB_BUCKETS
+        low = mantissa << exponent
+        high = ((mantissa + 1) << exponent) - 1
+        return (low + high) / 2
+
+    def record(self, seconds: float):
+        microseconds = max(0, int(seconds * 1_000_000))
+        self.counts[self._bucket_index(microseconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """الـ percentile بالثواني"""
+        if self.count == 0:
+            return 0.0
+
+        target = max(1, math.ceil(percent / 100 * self.count))
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return min(self._bucket_value(index) / 1_000_000, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": round(self.percentile(50), 4),
+            "p90": round(self.percentile(90), 4),
+            "p99": round(self.percentile(99), 4),
+            "max": round(self.max, 4)
+        }
+
+class WindowCounter:
+    """عداد طلبات وأخطاء في نافذة زمنية متحركة (slot لكل ثانية)"""
+
+    def __init__(self, window_seconds: int = 60):
+        self.window_seconds = window_seconds
+        self._seconds = [0] * window_seconds
+        self._requests = [0] * window_seconds
+        self._errors = [0] * window_seconds
+
+    def record(self, success: bool = True):
+        now = int(time.time())
+        slot = now % self.window_seconds
+        if self._seconds[slot] != now:
+            self._seconds[slot] = now
+            self._requests[slot] = 0
+            self._errors[slot] = 0
+        self._requests[slot] += 1
+        if not success:
+            self._errors[slot] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        oldest = int(time.time()) - self.window_seconds
+        requests = 0
+        errors = 0
+        for slot in range(self.window_seconds):
+            if self._seconds[slot] > oldest:
+                requests += self._requests[slot]
+                errors += self._errors[slot]
+        return {
+            "window_seconds": self.window_seconds,
+            "requests": requests,
+            "throughput_per_second": round(requests / self.window_seconds, 3),
+            "error_rate": round(errors / requests * 100, 2) if requests else 0.0
+        }
+
+class AgentMetrics:
+    """مقاييس لكل (agent, task) ولكل مرحلة: db / prompt / llm"""
+
+    def __init__(self, window_seconds: int = 60):
+        self.window_seconds = window_seconds
+        self._tasks: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._phases: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    def record_task(self, agent_type: str, task_name: str, seconds: float, success: bool):
+        key = (agent_type, task_name)
+        if key not in self._tasks:
+            self._tasks[key] = {
+                "latency": LatencyHistogram(),
+                "window": WindowCounter(self.window_seconds),
+                "errors": 0
+            }
+        entry = self._tasks[key]
+        entry["latency"].record(seconds)
+        entry["window"].record(success)
+        if not success:
+            entry["errors"] += 1
+
+    def record_phase(self, agent_type: str, phase: str, seconds: float):
+        key = (agent_type, phase)
+        if key not in self._phases:
+            self._phases[key] = LatencyHistogram()
+        self._phases[key].record(seconds)
+
+    @contextmanager
+    def phase_timer(self, agent_type: str, phase: str):
+        """قياس زمن مرحلة: with agent_metrics.phase_timer("coach", "db"): ..."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(agent_type, phase, time.perf_counter() - start_time)
+
+    def get_agent_summary(self, agent_type: str) -> Dict[str, Any]:
+        tasks = {}
+        for (task_agent, task_name), entry in self._tasks.items():
+            if task_agent != agent_type:
+                continue
+            latency = entry["latency"]
+            tasks[task_name] = {
+                "latency": latency.summary(),
+                "recent": entry["window"].summary(),
+                "error_rate": round(entry["errors"] / latency.count * 100, 2) if latency.count else 0.0
+            }
+
+        phases = {
+            phase: histogram.summary()
+            for (phase_agent, phase), histogram in self._phases.items()
+            if phase_agent == agent_type
+        }
+        return {"tasks": tasks, "phases": phases}
+
+    def get_worst_p99(self, agent_type: str) -> Optional[float]:
+        """أعلى p99 بين مهام الـ agent"""
+        values = [
+            entry["latency"].percentile(99)
+            for (task_agent, _), entry in self._tasks.items()
+            if task_agent == agent_type and entry["latency"].count
+        ]
+        return max(values) if values else None
+
+    def reset_agent(self, agent_type: str):
+        for key in [key for key in self._tasks if key[0] == agent_type]:
+            del self._tasks[key]
+        for key in [key for key in self._phases if key[0] == agent_type]:
+            del self._phases[key]
+
+# مقاييس مشتركة لكل العملية
+agent_metrics = AgentMetrics()
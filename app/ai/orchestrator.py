@@ -1,7 +1,11 @@
 """OrchestratorAI - منسق المشاريع الذكي"""
 import json
-from typing import Dict, Any, List
+import time
+from typing import Dict, Any, List, Optional, AsyncIterator
 from app.ai.base_agent import BaseAgent
+from app.ai.json_stream import TaskStreamParser, parse_project_json
+from app.schemas import ProjectResponse, TaskBreakdown
+from pydantic import ValidationError
 from app.ai.prompts.orchestrator_prompts import (
     ORCHESTRATOR_SYSTEM_PROMPT,
     ORCHESTRATOR_USER_TEMPLATE,
@@ -16,6 +20,20 @@ class OrchestratorAI(BaseAgent):
     
     def __init__(self):
         super().__init__("orchestrator")
+        self.stream_stats = {
+            "streams": 0,
+            "with_tasks": 0,
+            "total_time_to_first_task": 0.0,
+            "last_time_to_first_task": None,
+            "total_time": 0.0
+        }
+        # نتائج تحليل ردود OpenAI: parsed / repaired / failed / no_response
+        self.parse_stats = {
+            "parsed": 0,
+            "repaired": 0,
+            "failed": 0,
+            "no_response": 0
+        }
     
     def _get_default_prompt(self, prompt_name: str) -> str:
         """جلب الـ prompt الافتراضي من الملف"""
@@ -49,44 +67,215 @@ class OrchestratorAI(BaseAgent):
             "recommended_timeline": "أسبوعين"
         }, ensure_ascii=False)
     
+    async def _build_messages(self, goal_text: str, **kwargs) -> List[Dict[str, str]]:
+        """تجهيز رسائل OpenAI لتفكيك الهدف"""
+        # جلب الـ prompts المرنة
+        system_prompt = await self.get_prompt_template("system")
+        user_template = await self.get_prompt_template("user_template")
+        
+        # إعداد المتغيرات
+        variables = {
+            "goal_text": goal_text,
+            "timeline": kwargs.get("timeline", "غير محدد"),
+            "available_departments": "مبيعات، تسويق، تقنية، سندس",
+            "budget": kwargs.get("budget", "غير محدد"),
+            "special_requirements": kwargs.get("special_requirements", "لا توجد")
+        }
+        
+        # تنسيق القالب
+        user_prompt = self.format_template(user_template, variables)
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
     async def expand_goal_to_tasks(self, goal_text: str, **kwargs) -> Dict[str, Any]:
         """تحويل الهدف إلى مشروع مع مهام مفصلة"""
         try:
-            # جلب الـ prompts المرنة
-            system_prompt = await self.get_prompt_template("system")
-            user_template = await self.get_prompt_template("user_template")
+            messages = await self._build_messages(goal_text, **kwargs)
             
-            # إعداد المتغيرات
-            variables = {
-                "goal_text": goal_text,
-                "timeline": kwargs.get("timeline", "غير محدد"),
-                "available_departments": "مبيعات، تسويق، تقنية، سندس",
-                "budget": kwargs.get("budget", "غير محدد"),
-                "special_requirements": kwargs.get("special_requirements", "لا توجد")
-            }
+            # استدعاء OpenAI
+            ai_response = await self._complete(
+                messages,
+                max_tokens=1000,
+                priority=kwargs.get("priority", "interactive"),
+                latency_budget=kwargs.get("latency_budget")
+            )
             
-            # تنسيق القالب
-            user_prompt = self.format_template(user_template, variables)
+            return self._parse_project(ai_response, goal_text)
             
-            # استدعاء OpenAI
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
+        except Exception as e:
+            logger.error(f"Error expanding goal to tasks: {e}")
+            return self._get_template_based_response(goal_text)
+    
+    async def stream_goal_to_tasks(self, goal_text: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """تفكيك الهدف بوضع البث - يرجع كل مهمة فور اكتمالها
+
+        الأحداث: {"event": "task", "data": {...}} لكل مهمة صالحة (نفس تحقق الخطة النهائية)،
+        ثم {"event": "project", "data": {...}} بالخطة الكاملة.
+        """
+        start_time = time.perf_counter()
+        time_to_first_task = None
+        parser = TaskStreamParser()
+        streamed_tasks = 0
+        
+        try:
+            messages = await self._build_messages(goal_text, **kwargs)
             
-            ai_response = await self.call_openai(messages, max_tokens=1000)
+            async for chunk in self.stream_openai(
+                messages,
+                max_tokens=1000,
+                priority=kwargs.get("priority", "interactive")
+            ):
+                for raw_task in parser.feed(chunk):
+                    task = self._validate_task(raw_task, streamed_tasks + 1)
+                    if task is None:
+                        continue
+                    if time_to_first_task is None:
+                        time_to_first_task = time.perf_counter() - start_time
+                    streamed_tasks += 1
+                    yield {"event": "task", "data": task}
             
-            # محاولة تحليل JSON
-            try:
-                result = json.loads(ai_response)
-                return result
-            except json.JSONDecodeError:
-                # إذا فشل التحليل، استخدم القوالب الجاهزة
-                return self._get_template_based_response(goal_text)
+            project = self._parse_project(parser.text, goal_text)
             
         except Exception as e:
-            logger.error(f"Error expanding goal to tasks: {e}")
-            return self._get_fallback_response()
+            logger.error(f"Error streaming goal expansion: {e}")
+            project = self._get_template_based_response(goal_text)
+        
+        # إذا لم تُبث أي مهمة (فشل أو رد غير قابل للتحليل) أرسل مهام الخطة النهائية
+        if streamed_tasks == 0:
+            for task in project.get("tasks", []):
+                if time_to_first_task is None:
+                    time_to_first_task = time.perf_counter() - start_time
+                yield {"event": "task", "data": task}
+        
+        total_time = time.perf_counter() - start_time
+        self._record_stream(time_to_first_task, total_time)
+        
+        yield {
+            "event": "project",
+            "data": project,
+            "time_to_first_task": round(time_to_first_task, 3) if time_to_first_task is not None else None,
+            "total_time": round(total_time, 3)
+        }
+    
+    def _parse_project(self, ai_response: Optional[str], goal_text: str) -> Dict[str, Any]:
+        """تحليل رد OpenAI مع إصلاحه، والرجوع للقوالب فقط عند تعذر الاسترجاع"""
+        if not ai_response:
+            self.parse_stats["no_response"] += 1
+            return self._get_template_based_response(goal_text)
+        
+        data, status = parse_project_json(ai_response)
+        project = self._validate_project(data, goal_text) if data else None
+        
+        if project is None:
+            status = "failed"
+            logger.warning("Orchestrator response could not be recovered, using templates")
+            project = self._get_template_based_response(goal_text)
+        
+        self.parse_stats[status] += 1
+        return project
+    
+    def _validate_project(self, data: Dict[str, Any], goal_text: str) -> Optional[Dict[str, Any]]:
+        """التحقق من المشروع مقابل ProjectResponse وإكمال الحقول الناقصة من القوالب"""
+        tasks = [
+            task for task in (
+                self._validate_task(raw_task, index)
+                for index, raw_task in enumerate(data.get("tasks") or [], 1)
+            )
+            if task
+        ]
+        if not tasks:
+            return None
+        
+        template = self._get_template_based_response(goal_text)
+        project = {
+            field: data.get(field) if data.get(field) is not None else template[field]
+            for field in ProjectResponse.model_fields
+            if field != "tasks"
+        }
+        project["tasks"] = tasks
+        
+        try:
+            return ProjectResponse(**project).dict()
+        except ValidationError as e:
+            # استبدال الحقول غير الصالحة فقط بقيم القالب
+            for error in e.errors():
+                field = error["loc"][0]
+                if field != "tasks":
+                    project[field] = template[field]
+        
+        try:
+            return ProjectResponse(**project).dict()
+        except ValidationError:
+            return None
+    
+    def _validate_task(self, raw_task: Any, index: int) -> Optional[Dict[str, Any]]:
+        """التحقق من مهمة مقابل TaskBreakdown مع قيم افتراضية للحقول الناقصة"""
+        if not isinstance(raw_task, dict) or not raw_task.get("title"):
+            return None
+        
+        title = str(raw_task["title"])
+        defaults = {
+            "id": index,
+            "title": title,
+            "description": f"تنفيذ {title}",
+            "department": "general",
+            "suggested_assignee": None,
+            "priority": "medium",
+            "estimated_days": 1,
+            "depends_on": None,
+            "deliverables": [f"إنجاز {title}"]
+        }
+        task = dict(defaults)
+        task.update({
+            field: value for field, value in raw_task.items()
+            if field in defaults and value is not None
+        })
+        
+        try:
+            return TaskBreakdown(**task).dict()
+        except ValidationError as e:
+            for error in e.errors():
+                field = error["loc"][0]
+                task[field] = defaults.get(field)
+        
+        try:
+            return TaskBreakdown(**task).dict()
+        except ValidationError:
+            return None
+    
+    def get_parse_stats(self) -> Dict[str, Any]:
+        """نسبة الردود التي تم استرجاعها بدلاً من رميها"""
+        stats = self.parse_stats
+        received = stats["parsed"] + stats["repaired"] + stats["failed"]
+        not_clean = stats["repaired"] + stats["failed"]
+        return {
+            **stats,
+            "recovery_rate": round(stats["repaired"] / not_clean * 100, 2) if not_clean else None,
+            "discard_rate": round(stats["failed"] / received * 100, 2) if received else 0.0
+        }
+    
+    def _record_stream(self, time_to_first_task: Optional[float], total_time: float):
+        """تسجيل زمن أول مهمة لعمليات البث"""
+        stats = self.stream_stats
+        stats["streams"] += 1
+        stats["total_time"] += total_time
+        if time_to_first_task is not None:
+            stats["with_tasks"] += 1
+            stats["total_time_to_first_task"] += time_to_first_task
+            stats["last_time_to_first_task"] = time_to_first_task
+    
+    def get_stream_stats(self) -> Dict[str, Any]:
+        """متوسط زمن أول مهمة وزمن البث الكامل"""
+        stats = self.stream_stats
+        return {
+            "streams": stats["streams"],
+            "average_time_to_first_task": round(stats["total_time_to_first_task"] / stats["with_tasks"], 3) if stats["with_tasks"] else None,
+            "last_time_to_first_task": round(stats["last_time_to_first_task"], 3) if stats["last_time_to_first_task"] is not None else None,
+            "average_total_time": round(stats["total_time"] / stats["streams"], 3) if stats["streams"] else None
+        }
     
     def _get_template_based_response(self, goal_text: str) -> Dict[str, Any]:
         """استخدام القوالب الجاهزة بناءً على نوع الهدف"""
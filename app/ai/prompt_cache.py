@@ -0,0 +1,81 @@
+"""كاش الـ prompts داخل العملية مع ختم إصدار ومدة صلاحية محدودة"""
+from typing import Optional, Dict, Any, Tuple
+import time
+from app.config import settings
+import structlog
+
+logger = structlog.get_logger()
+
+class PromptCache:
+    """كاش للـ prompts مفتاحه (agent_type, prompt_name)
+
+    - الإبطال فوري عند التعديل من نفس العملية
+    - التعديلات من workers أخرى تظهر خلال ttl_seconds كحد أقصى
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # يزيد مع كل إبطال لمنع تخزين قراءة قديمة بدأت قبل التعديل
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, agent_type: str, prompt_name: str) -> Optional[Dict[str, Any]]:
+        """جلب الـ prompt من الكاش إذا كان صالحاً"""
+        entry = self._entries.get((agent_type, prompt_name))
+        if entry and time.monotonic() - entry["fetched_at"] < self.ttl_seconds:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    def set(self, agent_type: str, prompt_name: str, template: str, version: int, generation: int):
+        """تخزين الـ prompt مع رقم إصداره"""
+        if generation != self._generation:
+            # تم إبطال الكاش أثناء القراءة من قاعدة البيانات
+            return
+
+        self._entries[(agent_type, prompt_name)] = {
+            "template": template,
+            "version": version,
+            "fetched_at": time.monotonic()
+        }
+
+    def invalidate(self, agent_type: str, prompt_name: Optional[str] = None):
+        """إبطال prompt معين أو جميع prompts الـ agent"""
+        self._generation += 1
+        self.invalidations += 1
+
+        if prompt_name:
+            self._entries.pop((agent_type, prompt_name), None)
+        else:
+            for key in [key for key in self._entries if key[0] == agent_type]:
+                del self._entries[key]
+
+        logger.info(f"Prompt cache invalidated for {agent_type}/{prompt_name or '*'}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات الكاش"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total * 100, 2) if total else 0.0,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+            "versions": {
+                f"{agent_type}/{prompt_name}": entry["version"]
+                for (agent_type, prompt_name), entry in self._entries.items()
+            }
+        }
+
+# كاش مشترك بين جميع الـ agents
+prompt_cache = PromptCache(settings.prompt_cache_ttl)
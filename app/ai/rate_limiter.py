@@ -0,0 +1,174 @@
+"""محدد معدل عام لاستدعاءات الـ LLM مع طوابير أولوية"""
+from typing import Dict, Any, Optional
+from collections import deque
+import asyncio
+import time
+from app.config import settings
+import structlog
+
+logger = structlog.get_logger()
+
+# الأولويات مرتبة من الأعلى للأدنى
+PRIORITIES = ["interactive", "scheduled", "background"]
+
+class TokenBucket:
+    """Token bucket بسيط يمتلئ بمعدل ثابت"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._last_refill = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def time_until(self, amount: float) -> float:
+        """الوقت اللازم حتى يتوفر amount (بالثواني)"""
+        if self.unlimited:
+            return 0.0
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        if not self.unlimited:
+            self.tokens -= min(amount, self.capacity)
+
+class LLMRateLimiter:
+    """محدد معدل للطلبات والـ tokens مشترك بين جميع الـ agents
+
+    الطلبات التفاعلية (Slack، /coach/ping) تُخدم قبل المجدولة والخلفية.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._queues: Dict[str, deque] = {priority: deque() for priority in PRIORITIES}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats: Dict[str, Dict[str, Any]] = {
+            priority: {
+                "acquired": 0,
+                "total_wait_time": 0.0,
+                "max_wait_time": 0.0,
+                "max_queue_depth": 0
+            }
+            for priority in PRIORITIES
+        }
+
+    @staticmethod
+    def estimate_tokens(messages: list, max_tokens: int) -> int:
+        """تقدير تقريبي لعدد الـ tokens (4 أحرف لكل token)"""
+        prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        return prompt_chars // 4 + max_tokens
+
+    async def acquire(self, priority: str = "interactive", tokens: int = 0):
+        """انتظار دور الطلب حسب أولويته ثم حجز الحصة"""
+        if priority not in self._queues:
+            priority = "background"
+
+        enqueued_at = time.monotonic()
+
+        # مسار سريع: لا يوجد طابور والحصة متوفرة
+        if not self._has_waiters() and self._wait_time(tokens) == 0:
+            self._consume(tokens)
+            self._record(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority]
+        queue.append((future, tokens, enqueued_at))
+        stats = self._stats[priority]
+        stats["max_queue_depth"] = max(stats["max_queue_depth"], len(queue))
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        await future
+
+    def adjust(self, estimated_tokens: int, actual_tokens: int):
+        """تصحيح رصيد الـ tokens بعد معرفة الاستهلاك الفعلي"""
+        if not self.token_bucket.unlimited:
+            bucket = self.token_bucket
+            # الاستهلاك الأقل من التقدير يُعاد للرصيد لكن لا يتجاوز السعة
+            bucket.tokens = min(bucket.tokens + estimated_tokens - actual_tokens, bucket.capacity)
+
+    async def _dispatch(self):
+        """تمرير الطلبات المنتظرة بالترتيب: الأولوية الأعلى أولاً"""
+        while self._has_waiters():
+            priority, queue = self._next_queue()
+            future, tokens, enqueued_at = queue[0]
+
+            if future.done():
+                # الطلب أُلغي أثناء الانتظار
+                queue.popleft()
+                continue
+
+            wait_time = self._wait_time(tokens)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+                continue
+
+            queue.popleft()
+            self._consume(tokens)
+            self._record(priority, time.monotonic() - enqueued_at)
+            future.set_result(None)
+
+    def _has_waiters(self) -> bool:
+        return any(self._queues[priority] for priority in PRIORITIES)
+
+    def _next_queue(self):
+        for priority in PRIORITIES:
+            if self._queues[priority]:
+                return priority, self._queues[priority]
+        return None, None
+
+    def _wait_time(self, tokens: int) -> float:
+        return max(self.request_bucket.time_until(1), self.token_bucket.time_until(tokens))
+
+    def _consume(self, tokens: int):
+        self.request_bucket.consume(1)
+        self.token_bucket.consume(tokens)
+
+    def _record(self, priority: str, wait_time: float):
+        stats = self._stats[priority]
+        stats["acquired"] += 1
+        stats["total_wait_time"] += wait_time
+        stats["max_wait_time"] = max(stats["max_wait_time"], wait_time)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """عمق الطوابير وأوقات الانتظار لكل أولوية"""
+        priorities = {}
+        for priority in PRIORITIES:
+            stats = self._stats[priority]
+            priorities[priority] = {
+                "queue_depth": len(self._queues[priority]),
+                "max_queue_depth": stats["max_queue_depth"],
+                "acquired": stats["acquired"],
+                "average_wait_time": round(stats["total_wait_time"] / stats["acquired"], 4) if stats["acquired"] else 0.0,
+                "max_wait_time": round(stats["max_wait_time"], 4)
+            }
+
+        self.request_bucket.refill()
+        self.token_bucket.refill()
+        return {
+            "requests_per_minute": int(self.request_bucket.capacity),
+            "tokens_per_minute": int(self.token_bucket.capacity),
+            "available_requests": None if self.request_bucket.unlimited else round(self.request_bucket.tokens, 2),
+            "available_tokens": None if self.token_bucket.unlimited else round(self.token_bucket.tokens, 2),
+            "priorities": priorities
+        }
+
+# محدد مشترك لكل العملية
+llm_rate_limiter = LLMRateLimiter(
+    requests_per_minute=settings.llm_requests_per_minute,
+    tokens_per_minute=settings.llm_tokens_per_minute
+)
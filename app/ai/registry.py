@@ -0,0 +1,108 @@
+"""سجل الـ Agents المشترك - كل الـ routers والتكاملات تأخذ الـ Agents منه"""
+from typing import Dict, Any, Callable, Optional, List, AsyncIterator
+from app.ai.base_agent import BaseAgent
+from app.ai.coach import CoachAI
+from app.ai.orchestrator import OrchestratorAI
+import structlog
+
+logger = structlog.get_logger()
+
+# handler مهمة: (agent, **kwargs) -> نتيجة
+TaskHandler = Callable[..., Any]
+
+class AgentRegistry:
+    """سجل واحد للـ Agents مع إنشاء كسول عند أول استخدام
+
+    كل Agent يُنشأ مرة واحدة ويُشارك بين جميع المستخدمين، ومعه
+    عميل OpenAI والكاشات المشتركة.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], BaseAgent]] = {}
+        self._agents: Dict[str, BaseAgent] = {}
+        self._tasks: Dict[str, Dict[str, TaskHandler]] = {}
+        self._stream_tasks: Dict[str, Dict[str, TaskHandler]] = {}
+
+    def register(self, agent_type: str, factory: Callable[[], BaseAgent],
+                 tasks: Dict[str, TaskHandler], stream_tasks: Optional[Dict[str, TaskHandler]] = None):
+        """تسجيل نوع Agent مع المهام التي يدعمها"""
+        self._factories[agent_type] = factory
+        self._tasks[agent_type] = dict(tasks)
+        self._stream_tasks[agent_type] = dict(stream_tasks or {})
+
+    def get(self, agent_type: str) -> Optional[BaseAgent]:
+        """جلب Agent وإنشاؤه عند أول طلب"""
+        if agent_type not in self._factories:
+            return None
+
+        if agent_type not in self._agents:
+            self._agents[agent_type] = self._factories[agent_type]()
+            logger.info(f"Agent {agent_type} created on first use")
+
+        return self._agents[agent_type]
+
+    def reset(self, agent_type: str) -> bool:
+        """حذف نسخة الـ Agent ليُعاد إنشاؤها عند الطلب القادم"""
+        if agent_type not in self._factories:
+            return False
+        self._agents.pop(agent_type, None)
+        return True
+
+    def get_task_handler(self, agent_type: str, task_name: str) -> Optional[TaskHandler]:
+        return self._tasks.get(agent_type, {}).get(task_name)
+
+    def get_stream_handler(self, agent_type: str, task_name: str) -> Optional[TaskHandler]:
+        return self._stream_tasks.get(agent_type, {}).get(task_name)
+
+    def is_registered(self, agent_type: str) -> bool:
+        return agent_type in self._factories
+
+    def is_loaded(self, agent_type: str) -> bool:
+        return agent_type in self._agents
+
+    def loaded_agents(self) -> Dict[str, BaseAgent]:
+        """الـ Agents التي أُنشئت فعلاً"""
+        return dict(self._agents)
+
+    def agent_types(self) -> List[str]:
+        return list(self._factories)
+
+    def list_tasks(self, agent_type: str) -> List[str]:
+        return list(self._tasks.get(agent_type, {}))
+
+    def describe(self, agent_type: str) -> Dict[str, Any]:
+        """وصف الـ Agent بدون إنشائه"""
+        factory = self._factories[agent_type]
+        return {
+            "agent_type": agent_type,
+            "class_name": factory.__name__,
+            "description": factory.__doc__ or f"Agent of type {agent_type}",
+            "available_tasks": self.list_tasks(agent_type),
+            "streaming_tasks": list(self._stream_tasks.get(agent_type, {})),
+            "loaded": self.is_loaded(agent_type)
+        }
+
+# معاملات إضافية تمررها المهام إلى الـ Agent
+COACH_OPTIONS = ("bypass_cache", "priority", "latency_budget", "check_schedule")
+
+async def _generate_message(agent: CoachAI, **kwargs) -> Dict[str, Any]:
+    options = {key: kwargs[key] for key in COACH_OPTIONS if key in kwargs}
+    return await agent.generate_coach_message(kwargs.get("user_data", {}), **options)
+
+async def _expand_goal(agent: OrchestratorAI, **kwargs) -> Dict[str, Any]:
+    options = {key: value for key, value in kwargs.items() if key != "goal_text"}
+    return await agent.expand_goal_to_tasks(kwargs.get("goal_text", ""), **options)
+
+def _stream_goal(agent: OrchestratorAI, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+    options = {key: value for key, value in kwargs.items() if key != "goal_text"}
+    return agent.stream_goal_to_tasks(kwargs.get("goal_text", ""), **options)
+
+# السجل المشترك
+agent_registry = AgentRegistry()
+agent_registry.register("coach", CoachAI, {"generate_message": _generate_message})
+agent_registry.register(
+    "orchestrator",
+    OrchestratorAI,
+    {"expand_goal": _expand_goal},
+    stream_tasks={"expand_goal": _stream_goal}
+)
@@ -0,0 +1,135 @@
+"""كاش ردود الـ LLM (LRU + TTL) مع تخزين اختياري في MongoDB"""
+from typing import Optional, Dict, Any, List
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import hashlib
+import json
+import time
+from app.config import settings
+import structlog
+
+logger = structlog.get_logger()
+
+class ResponseCache:
+    """كاش ردود مفتاحه hash الرسائل المرسلة مع معاملات النموذج"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, use_mongo: bool = False):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.use_mongo = use_mongo
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], **params) -> str:
+        """حساب مفتاح الكاش من الرسائل ومعاملات النموذج"""
+        payload = json.dumps(
+            {"messages": messages, "params": params},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """جلب رد من الذاكرة ثم من MongoDB"""
+        entry = self._entries.get(key)
+        if entry:
+            if entry["expires_at"] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["value"]
+
+            del self._entries[key]
+            self.expirations += 1
+
+        if self.use_mongo:
+            value = await self._get_from_mongo(key)
+            if value is not None:
+                self.mongo_hits += 1
+                self._store(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        """تخزين رد في الذاكرة و MongoDB"""
+        self._store(key, value)
+
+        if self.use_mongo:
+            await self._set_in_mongo(key, value)
+
+    def _store(self, key: str, value: str):
+        """تخزين في الذاكرة مع إخراج الأقدم عند امتلاء الكاش"""
+        self._entries[key] = {
+            "value": value,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _get_from_mongo(self, key: str) -> Optional[str]:
+        try:
+            from app.db import get_db
+
+            db = await get_db()
+            doc = await db.ai_response_cache.find_one({
+                "_id": key,
+                "expires_at": {"$gt": datetime.utcnow()}
+            })
+            return doc["response"] if doc else None
+        except Exception as e:
+            logger.warning(f"Response cache read from MongoDB failed: {e}")
+            return None
+
+    async def _set_in_mongo(self, key: str, value: str):
+        try:
+            from app.db import get_db
+
+            db = await get_db()
+            await db.ai_response_cache.update_one(
+                {"_id": key},
+                {
+                    "$set": {
+                        "response": value,
+                        "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+                    }
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Response cache write to MongoDB failed: {e}")
+
+    def clear(self):
+        """مسح الكاش من الذاكرة"""
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات الكاش"""
+        lookups = self.hits + self.mongo_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "mongo_backed": self.use_mongo,
+            "hits": self.hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.mongo_hits) / lookups * 100, 2) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+# كاش ردود الكوتش
+coach_response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl,
+    use_mongo=settings.response_cache_mongo
+)
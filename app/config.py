@@ -11,6 +11,85 @@ class Settings:
     
     # OpenAI
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
+    openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    # خادم متوافق مع OpenAI بدلاً من api.openai.com (مثل fake_openai_server.py لاختبار الحمل)
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")
+    openai_timeout: float = float(os.getenv("OPENAI_TIMEOUT", "30"))
+    openai_connect_timeout: float = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+    openai_max_retries: int = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+    
+    # Pool اتصالات OpenAI المشترك بين الـ agents
+    openai_max_connections: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+    openai_max_keepalive: int = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+    openai_keepalive_expiry: float = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+    
+    # حدود معدل الـ LLM لكل العملية (0 = بدون حد)
+    llm_requests_per_minute: int = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+    llm_tokens_per_minute: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+    
+    # Circuit breaker لكل agent ونموذج
+    llm_breaker_failure_threshold: int = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+    llm_breaker_slow_call_seconds: float = float(os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "15"))
+    llm_breaker_open_seconds: float = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+    llm_breaker_half_open_calls: int = int(os.getenv("LLM_BREAKER_HALF_OPEN_CALLS", "1"))
+    
+    # أقصى زمن انتظار لرد الكوتش قبل استخدام القوالب (0 = بدون حد)
+    coach_latency_budget: float = float(os.getenv("COACH_LATENCY_BUDGET", "0"))
+    
+    # حد p99 (بالثواني) الذي يعتبر تراجعاً في /agents/health
+    agent_p99_alert_seconds: float = float(os.getenv("AGENT_P99_ALERT_SECONDS", "10"))
+    
+    # مهلة كل خطوة في /agents/coordinate
+    coordination_step_timeout: float = float(os.getenv("COORDINATION_STEP_TIMEOUT", "60"))
+    
+    # طابور مهام الـ Agents غير المتزامن
+    agent_job_workers: int = int(os.getenv("AGENT_JOB_WORKERS", "4"))
+    agent_job_queue_size: int = int(os.getenv("AGENT_JOB_QUEUE_SIZE", "1000"))
+    agent_job_ttl_hours: float = float(os.getenv("AGENT_JOB_TTL_HOURS", "24"))
+    agent_job_callback_timeout: float = float(os.getenv("AGENT_JOB_CALLBACK_TIMEOUT", "10"))
+    # الـ hosts المسموح إرسال النتائج إليها (https فقط، فارغ = بدون callbacks)
+    agent_job_callback_allowed_hosts: list = [
+        host.strip().lower()
+        for host in os.getenv("AGENT_JOB_CALLBACK_ALLOWED_HOSTS", "").split(",")
+        if host.strip()
+    ]
+    
+    # كاش الـ prompts (أقصى مدة لظهور تعديلات workers أخرى)
+    prompt_cache_ttl: float = float(os.getenv("PROMPT_CACHE_TTL", "60"))
+    
+    # كاش ردود الكوتش
+    response_cache_enabled: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    response_cache_max_entries: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    response_cache_ttl: float = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    response_cache_mongo: bool = os.getenv("RESPONSE_CACHE_MONGO", "false").lower() == "true"
+    
+    # التوازي في /coach/batch
+    coach_batch_concurrency: int = int(os.getenv("COACH_BATCH_CONCURRENCY", "10"))
+    coach_batch_max_concurrency: int = int(os.getenv("COACH_BATCH_MAX_CONCURRENCY", "50"))
+    
+    # توليد رسائل الكوتش مسبقاً خلال Quiet Mode
+    scheduler_enabled: bool = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    coach_pregen_hour: int = int(os.getenv("COACH_PREGEN_HOUR", "2"))
+    coach_pregen_concurrency: int = int(os.getenv("COACH_PREGEN_CONCURRENCY", "5"))
+    coach_message_max_age_hours: float = float(os.getenv("COACH_MESSAGE_MAX_AGE_HOURS", "30"))
+    
+    # إرسال الرسائل المؤجلة بسبب Quiet Mode
+    deferred_release_per_minute: int = int(os.getenv("DEFERRED_RELEASE_PER_MINUTE", "30"))
+    deferred_load_horizon_minutes: float = float(os.getenv("DEFERRED_LOAD_HORIZON_MINUTES", "10"))
+    deferred_claim_timeout_minutes: float = float(os.getenv("DEFERRED_CLAIM_TIMEOUT_MINUTES", "10"))
+    
+    # قفل المهام المجدولة بين الـ workers
+    lease_ttl_seconds: float = float(os.getenv("LEASE_TTL_SECONDS", "30"))
+    lease_takeover_window_minutes: float = float(os.getenv("LEASE_TAKEOVER_WINDOW_MINUTES", "30"))
+    
+    # إرسال التقارير المجدولة
+    digest_manager_hour: int = int(os.getenv("DIGEST_MANAGER_HOUR", "8"))
+    digest_executive_day: str = os.getenv("DIGEST_EXECUTIVE_DAY", "sun")
+    digest_executive_hour: int = int(os.getenv("DIGEST_EXECUTIVE_HOUR", "9"))
+    digest_concurrency: int = int(os.getenv("DIGEST_CONCURRENCY", "10"))
+    
+    # تحميل KPIs بالجملة في /kpis/bulk
+    kpi_bulk_batch_size: int = int(os.getenv("KPI_BULK_BATCH_SIZE", "1000"))
     
     # Slack
     slack_bot_token: str = os.getenv("SLACK_BOT_TOKEN", "")
@@ -1,5 +1,13 @@
 """اتصال قاعدة البيانات MongoDB"""
+from typing import Optional
+from datetime import datetime, timedelta
+import asyncio
+import os
+import time
+import uuid
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, DuplicateKeyError
 from app.config import settings
 import structlog
 
@@ -16,6 +24,19 @@ async def get_db():
         await init_db()
     return database
 
+async def _ensure_unique_kpi_index(db):
+    """فهرس فريد على (user_id, month) - يستبدل الفهرس القديم غير الفريد بنفس المفاتيح"""
+    keys = [("user_id", 1), ("month", 1)]
+    try:
+        await db.kpis.create_index(keys, unique=True)
+    except OperationFailure as e:
+        # IndexOptionsConflict / IndexKeySpecsConflict
+        if e.code not in (85, 86):
+            raise
+        logger.info("Replacing non-unique kpis (user_id, month) index with a unique one")
+        await db.kpis.drop_index("user_id_1_month_1")
+        await db.kpis.create_index(keys, unique=True)
+
 async def init_db():
     """تهيئة قاعدة البيانات والفهارس"""
     global client, database
@@ -34,9 +55,26 @@ async def init_db():
         # إنشاء فهارس أساسية
         try:
             await database.users.create_index("email", unique=True)
+            await database.users.create_index("manager_id")
             await database.tasks.create_index("assignee_user_id")
-            await database.kpis.create_index([("user_id", 1), ("month", 1)])
+            await _ensure_unique_kpi_index(database)
             await database.ai_prompts.create_index([("agent_type", 1), ("prompt_name", 1)])
+            await database.ai_response_cache.create_index("expires_at", expireAfterSeconds=0)
+            await database.coach_messages.create_index("user_email", unique=True)
+            await database.user_performance.create_index("user_email", unique=True)
+            await database.user_performance.create_index("department")
+            await database.agent_jobs.create_index("expires_at", expireAfterSeconds=0)
+            await database.digest_runs.create_index([("kind", 1), ("started_at", -1)])
+            await database.leases.create_index("expires_at", expireAfterSeconds=0)
+            await database.job_runs.create_index("expires_at", expireAfterSeconds=0)
+            await database.digest_deliveries.create_index("expires_at", expireAfterSeconds=0)
+            await database.messages.create_index([("user_email", 1), ("type", 1), ("created_at", -1)])
+            await database.deferred_messages.create_index([("status", 1), ("deliver_at", 1)])
+            await database.deferred_messages.create_index(
+                "user_email",
+                unique=True,
+                partialFilterExpression={"status": "pending"}
+            )
             logger.info("✅ Database indexes created successfully")
         except Exception as index_error:
             logger.warning(f"⚠️ Some indexes creation failed: {index_error}")
@@ -49,3 +87,165 @@ async def init_db():
         client = None
         database = None
         raise
+
+# مدة الاحتفاظ بعلامات اكتمال المهام المجدولة
+JOB_RUN_RETENTION_DAYS = 30
+
+class MongoLease:
+    """قفل موزع بمدة صلاحية على مستند في leases
+
+    - المستند يحمل owner و expires_at (فهرس TTL يحذف الأقفال المنتهية)
+    - fencing token يزيد مع كل حيازة ويُحفظ في lease_tokens بلا TTL حتى لا يعود للصفر
+    - heartbeat يمدد الصلاحية، وإذا توقف الحائز يأخذ غيره القفل بعد ttl ثانية
+    """
+    
+    def __init__(self, name: str, ttl_seconds: float):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.token: Optional[int] = None
+        self.lost = False
+        # آخر لحظة (monotonic) نضمن فيها أن القفل ما زال لنا
+        self._valid_until = 0.0
+    
+    async def acquire(self) -> bool:
+        """محاولة الحيازة مرة واحدة - False إذا كان القفل بيد worker آخر صالح"""
+        db = await get_db()
+        now = datetime.utcnow()
+        started = time.monotonic()
+        try:
+            await db.leases.find_one_and_update(
+                {"_id": self.name, "$or": [{"expires_at": {"$lte": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "acquired_at": now, "expires_at": now + self.ttl}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        
+        # التوكن يُحجز بعد الحيازة ويُثبت فقط إن بقي القفل لنا،
+        # فالتوكنات التي يستخدمها الحائزون متزايدة دائماً
+        counter = await db.lease_tokens.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"token": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        result = await db.leases.update_one(
+            {"_id": self.name, "owner": self.owner, "expires_at": {"$gt": datetime.utcnow()}},
+            {"$set": {"token": counter["token"]}}
+        )
+        if not result.matched_count:
+            return False
+        
+        self.token = counter["token"]
+        self.lost = False
+        self._valid_until = started + self.ttl.total_seconds()
+        return True
+    
+    async def renew(self) -> bool:
+        """تمديد الصلاحية - False إذا انتهت وأخذها غيرنا"""
+        if self.token is None:
+            return False
+        db = await get_db()
+        now = datetime.utcnow()
+        started = time.monotonic()
+        result = await db.leases.update_one(
+            {"_id": self.name, "owner": self.owner, "token": self.token, "expires_at": {"$gt": now}},
+            {"$set": {"expires_at": now + self.ttl}}
+        )
+        if result.matched_count:
+            self._valid_until = started + self.ttl.total_seconds()
+        else:
+            self.lost = True
+        return not self.lost
+    
+    def is_held(self) -> bool:
+        """هل ما زال القفل لنا حسب آخر تمديد ناجح (بدون قاعدة بيانات) - يُفحص قبل كل أثر خارجي"""
+        return self.token is not None and not self.lost and time.monotonic() < self._valid_until
+    
+    async def release(self):
+        if self.token is None:
+            return
+        db = await get_db()
+        await db.leases.delete_one({"_id": self.name, "owner": self.owner, "token": self.token})
+        self.token = None
+    
+    async def heartbeat(self, task: asyncio.Task):
+        """تمديد كل ثلث المدة - إلغاء task إذا فُقد القفل حتى لا يعمل workerان معاً"""
+        interval = self.ttl.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await self.renew()
+            except Exception as e:
+                logger.warning(f"Lease renew failed for {self.name}: {e}")
+                renewed = False
+            if not renewed:
+                # بدون تمديد مؤكد لا نضمن أن القفل لنا - نتوقف قبل أي أثر آخر
+                self.lost = True
+                logger.error("Lease lost, cancelling holder task", lease=self.name)
+                task.cancel()
+                return
+
+async def run_exclusive(name: str, run_key: str, job, ttl_seconds: float, takeover_window_seconds: float) -> Optional[str]:
+    """تشغيل job مرة واحدة لكل run_key عبر كل الـ workers
+
+    الـ worker الذي لا يحصل على القفل ينتظر: إذا انتهى التشغيل يتوقف، وإذا مات الحائز
+    (انتهت صلاحية القفل دون علامة اكتمال) يأخذ القفل ويعيد التشغيل خلال نافذة الاستلام.
+    job يُستدعى بالقفل (job(lease)) ليفحص lease.is_held() قبل كل أثر خارجي.
+    يرجع completed أو skipped أو None إذا انتهت النافذة أو فُقد القفل أثناء التشغيل.
+    """
+    db = await get_db()
+    marker_id = f"{name}:{run_key}"
+    lease = MongoLease(name, ttl_seconds)
+    deadline = time.monotonic() + takeover_window_seconds
+    
+    while True:
+        if await db.job_runs.find_one({"_id": marker_id}, {"_id": 1}):
+            return "skipped"
+        
+        if await lease.acquire():
+            break
+        
+        if time.monotonic() >= deadline:
+            logger.warning("Gave up waiting for lease", lease=name, run_key=run_key)
+            return None
+        await asyncio.sleep(ttl_seconds / 2)
+    
+    try:
+        # التحقق مرة أخرى بعد الحيازة - قد يكون الحائز السابق أنهى التشغيل للتو
+        if await db.job_runs.find_one({"_id": marker_id}, {"_id": 1}):
+            return "skipped"
+        
+        logger.info("Running exclusive job", lease=name, run_key=run_key, token=lease.token)
+        task = asyncio.create_task(job(lease))
+        heartbeat = asyncio.create_task(lease.heartbeat(task))
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not lease.lost:
+                raise
+            # worker آخر استلم التشغيل وسيكمله
+            return None
+        finally:
+            heartbeat.cancel()
+        
+        now = datetime.utcnow()
+        try:
+            # fencing: علامة كتبها حائز بتوكن أحدث لا تُستبدل (التكرار على _id = توكن أحدث)
+            await db.job_runs.update_one(
+                {"_id": marker_id, "$or": [{"token": {"$lte": lease.token}}, {"token": {"$exists": False}}]},
+                {"$set": {
+                    "completed_at": now,
+                    "owner": lease.owner,
+                    "token": lease.token,
+                    "expires_at": now + timedelta(days=JOB_RUN_RETENTION_DAYS)
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            logger.warning("Run already completed by a newer lease holder", lease=name, run_key=run_key)
+            return None
+        return "completed"
+    finally:
+        await lease.release()
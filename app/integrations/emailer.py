@@ -1,4 +1,5 @@
 """خدمة الإيميل"""
+import asyncio
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -28,11 +29,8 @@ class EmailService:
             # إضافة المحتوى
             msg.attach(MIMEText(body, 'html', 'utf-8'))
             
-            # إرسال الإيميل
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_user, self.smtp_pass)
-                server.send_message(msg)
+            # SMTP متزامن - يعمل في thread حتى لا يوقف الـ event loop أثناء إرسال التقارير بالتوازي
+            await asyncio.to_thread(self._send_smtp, msg)
             
             logger.info(f"Email sent successfully to {to}")
             return {"sent": True, "recipient": to}
@@ -47,6 +45,12 @@ class EmailService:
                 "error": str(e)
             }
     
+    def _send_smtp(self, msg: MIMEMultipart):
+        with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
+            server.starttls()
+            server.login(self.smtp_user, self.smtp_pass)
+            server.send_message(msg)
+    
     def create_html_template(self, title: str, content: str) -> str:
         """إنشاء قالب HTML للإيميل"""
         return f"""
@@ -3,11 +3,12 @@ from slack_bolt import App
 from slack_bolt.adapter.fastapi import SlackRequestHandler
 from app.db import get_db
 from app.models import Task, User
-from app.ai.orchestrator import OrchestratorAI
+from app.ai.agent_manager import agent_manager
 from app.config import settings
 from datetime import datetime
 import structlog
 import json
+import time
 
 logger = structlog.get_logger()
 
@@ -29,7 +30,9 @@ except Exception as e:
     # إنشاء تطبيق وهمي للاختبار
     app = None
 
-orchestrator_ai = OrchestratorAI()
+
+# أقل فترة (بالثواني) بين تعديلات رسالة التقدم في Slack
+SLACK_UPDATE_INTERVAL = 1.0
 
 def register_slack_events():
     """تسجيل أحداث Slack فقط إذا كان التطبيق متاحاً"""
@@ -38,7 +41,7 @@ def register_slack_events():
         return
     
     @app.event("app_mention")
-    async def handle_mention(event, say):
+    async def handle_mention(event, say, client):
         """معالجة ذكر البوت"""
         try:
             text = event.get("text", "")
@@ -49,7 +52,7 @@ def register_slack_events():
             if text.startswith("مهمة:"):
                 await handle_task_creation(text, user_id, say)
             elif text.startswith("هدف:"):
-                await handle_goal_expansion(text, user_id, say)
+                await handle_goal_expansion(text, user_id, say, client)
             else:
                 await say("مرحباً! يمكنني مساعدتك في:\n- إنشاء مهام: اكتب 'مهمة: عنوان المهمة'\n- تفكيك الأهداف: اكتب 'هدف: وصف الهدف'")
                 
@@ -108,8 +111,8 @@ async def handle_task_creation(text: str, user_id: str, say):
         logger.error(f"Error creating task from Slack: {e}")
         await say("عذراً، حدث خطأ في إنشاء المهمة")
 
-async def handle_goal_expansion(text: str, user_id: str, say):
-    """معالجة تفكيك الهدف إلى مهام"""
+async def handle_goal_expansion(text: str, user_id: str, say, client=None):
+    """معالجة تفكيك الهدف إلى مهام - تحديث رسالة واحدة مع وصول كل مهمة"""
     try:
         # استخراج نص الهدف
         goal_text = text.replace("هدف:", "").strip()
@@ -118,35 +121,78 @@ async def handle_goal_expansion(text: str, user_id: str, say):
             await say("يرجى كتابة وصف الهدف بعد 'هدف:'")
             return
         
-        await say("🤔 جاري تحليل الهدف وإنشاء خطة العمل...")
+        progress = await say("🤔 جاري تحليل الهدف وإنشاء خطة العمل...")
+        
+        # الرسالة التي سيتم تعديلها تدريجياً
+        channel = progress.get("channel") if progress else None
+        message_ts = progress.get("ts") if progress else None
+        can_update = client is not None and channel and message_ts
+        
+        tasks = []
+        project_data = None
+        last_update = 0.0
         
-        # استخدام OrchestratorAI لتفكيك الهدف مع معالجة الأخطاء
+        # استخدام المنسق المشترك لتفكيك الهدف مع معالجة الأخطاء
         try:
-            project_data = await orchestrator_ai.expand_goal_to_tasks(goal_text)
+            async for event in agent_manager.stream_agent_task("orchestrator", "expand_goal", goal_text=goal_text):
+                if event["event"] == "task":
+                    tasks.append(event["data"])
+                    
+                    # حد أدنى بين التعديلات لتجنب rate limit في Slack
+                    now = time.monotonic()
+                    if can_update and now - last_update >= SLACK_UPDATE_INTERVAL:
+                        await client.chat_update(
+                            channel=channel,
+                            ts=message_ts,
+                            text=_format_partial_plan(tasks)
+                        )
+                        last_update = now
+                elif event["event"] == "project":
+                    project_data = event["data"]
         except Exception as ai_error:
             logger.error(f"AI error in goal expansion: {ai_error}")
             await say("عذراً، حدث خطأ في تحليل الهدف بواسطة الذكاء الاصطناعي")
             return
         
-        # إرسال النتيجة
-        response = f"🎯 *{project_data['project_title']}*\n\n"
-        response += f"📝 *الوصف:* {project_data['project_description']}\n"
-        response += f"⏱️ *المدة المتوقعة:* {project_data['estimated_duration']}\n\n"
-        response += "📋 *المهام المطلوبة:*\n"
-        
-        for task in project_data['tasks']:
-            response += f"• {task['title']} ({task['department']}) - {task['estimated_days']} أيام\n"
-        
-        response += f"\n🎯 *معايير النجاح:*\n"
-        for criterion in project_data['success_criteria']:
-            response += f"• {criterion}\n"
-        
-        await say(response)
+        # إرسال النتيجة النهائية
+        response = _format_project_plan(project_data)
+        if can_update:
+            await client.chat_update(channel=channel, ts=message_ts, text=response)
+        else:
+            await say(response)
         
     except Exception as e:
         logger.error(f"Error expanding goal from Slack: {e}")
         await say("عذراً، حدث خطأ في تحليل الهدف")
 
+def _format_task_line(task: dict) -> str:
+    """سطر واحد لمهمة في رسالة Slack"""
+    return f"• {task.get('title', 'مهمة')} ({task.get('department', 'general')}) - {task.get('estimated_days', '?')} أيام\n"
+
+def _format_partial_plan(tasks: list) -> str:
+    """رسالة مؤقتة بالمهام التي وصلت حتى الآن"""
+    response = "🤔 جاري تحليل الهدف وإنشاء خطة العمل...\n\n"
+    response += "📋 *المهام حتى الآن:*\n"
+    for task in tasks:
+        response += _format_task_line(task)
+    return response
+
+def _format_project_plan(project_data: dict) -> str:
+    """الرسالة النهائية بخطة المشروع كاملة"""
+    response = f"🎯 *{project_data['project_title']}*\n\n"
+    response += f"📝 *الوصف:* {project_data['project_description']}\n"
+    response += f"⏱️ *المدة المتوقعة:* {project_data['estimated_duration']}\n\n"
+    response += "📋 *المهام المطلوبة:*\n"
+    
+    for task in project_data['tasks']:
+        response += _format_task_line(task)
+    
+    response += f"\n🎯 *معايير النجاح:*\n"
+    for criterion in project_data['success_criteria']:
+        response += f"• {criterion}\n"
+    
+    return response
+
 # معالج الطلبات مع معالجة الأخطاء
 handler = None
 if app is not None:
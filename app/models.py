@@ -39,6 +39,7 @@ class User(BaseModel):
     role: str  # employee, manager, executive
     department: str  # sales, marketing, tech, sondos
     manager_id: Optional[PyObjectId] = None
+    timezone: Optional[str] = None  # مثل Asia/Dubai - الافتراضي TIMEZONE
     
     class Config:
         populate_by_name = True
@@ -81,8 +82,10 @@ class KPI(BaseModel):
 class Message(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     user_id: Optional[PyObjectId] = None
+    user_email: Optional[str] = None
     type: str  # coach_reply, daily_digest, executive_digest, alert
     body: str
+    performance_level: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
@@ -98,6 +101,7 @@ class AIPrompt(BaseModel):
     template: str
     variables: Dict[str, Any] = {}
     is_active: bool = True
+    version: int = 1  # يزيد مع كل تعديل
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -1,7 +1,14 @@
 """Agent Management Router"""
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse
 from typing import Dict, Any, Optional
+from app.schemas import GoalToProject
 from app.ai.agent_manager import agent_manager
+from app.ai.rate_limiter import llm_rate_limiter
+from app.ai.circuit_breaker import get_circuit_breaker_stats
+from app.ai.metrics import agent_metrics
+from app.ai.job_queue import agent_job_queue, QueueFullError, CallbackURLError
+import json
 import structlog
 
 logger = structlog.get_logger()
@@ -73,8 +80,18 @@ async def restart_agent(agent_type: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/execute/{agent_type}/{task_name}")
-async def execute_agent_task(agent_type: str, task_name: str, data: Dict[str, Any]):
-    """تنفيذ مهمة على Agent معين"""
+async def execute_agent_task(agent_type: str, task_name: str, data: Dict[str, Any],
+                             mode: str = "sync", callback_url: Optional[str] = None):
+    """تنفيذ مهمة على Agent معين
+
+    mode=job يضيف المهمة للطابور ويرجع معرفها فوراً (202)، والنتيجة
+    من GET /agents/jobs/{job_id} أو تُرسل إلى callback_url.
+    """
+    if mode == "job":
+        return await _submit_job(agent_type, task_name, data, callback_url)
+    if mode != "sync":
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}")
+    
     try:
         result = await agent_manager.execute_agent_task(agent_type, task_name, **data)
         
@@ -94,6 +111,74 @@ async def execute_agent_task(agent_type: str, task_name: str, data: Dict[str, An
         logger.error(f"Error executing task {task_name} on agent {agent_type}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _submit_job(agent_type: str, task_name: str, data: Dict[str, Any], callback_url: Optional[str]):
+    """إضافة مهمة لطابور الـ Agents"""
+    if not agent_manager.registry.get_task_handler(agent_type, task_name):
+        raise HTTPException(status_code=400, detail=f"Unknown task {task_name} for agent {agent_type}")
+    
+    try:
+        job = await agent_job_queue.submit(agent_type, task_name, data, callback_url=callback_url)
+    except CallbackURLError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error queueing task {task_name} on agent {agent_type}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return JSONResponse(
+        status_code=202,
+        content={
+            "success": True,
+            "job_id": job["_id"],
+            "status": job["status"],
+            "status_url": f"/agents/jobs/{job['_id']}",
+            "agent_type": agent_type,
+            "task": task_name
+        }
+    )
+
+@router.get("/jobs/stats")
+async def get_job_queue_stats():
+    """عمق الطابور واستخدام الـ workers وزمن المهام"""
+    return {
+        "success": True,
+        "job_queue": agent_job_queue.get_stats()
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """حالة ونتيجة مهمة في الطابور"""
+    try:
+        job = await agent_job_queue.get_job(job_id)
+    except Exception as e:
+        logger.error(f"Error getting job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    
+    return {
+        "success": True,
+        "job": job
+    }
+
+@router.post("/orchestrator/expand_goal/stream")
+async def stream_goal_expansion(goal: GoalToProject):
+    """تفكيك هدف مع بث المهام كـ Server-Sent Events فور جهوزها"""
+    options = goal.dict(exclude_none=True)
+    
+    async def event_stream():
+        async for event in agent_manager.stream_agent_task("orchestrator", "expand_goal", **options):
+            payload = {key: value for key, value in event.items() if key != "event"}
+            yield f"event: {event['event']}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/coordinate/{coordination_type}")
 async def coordinate_agents(coordination_type: str, data: Dict[str, Any]):
     """تنسيق بين الـ Agents لمهمة معقدة"""
@@ -131,14 +216,23 @@ async def get_agents_stats():
                 "total_requests": agent_stats["total_requests"],
                 "successful_requests": agent_stats["successful_requests"],
                 "failed_requests": agent_stats["failed_requests"],
+                "coalesced_requests": agent_stats["coalesced_requests"],
                 "success_rate": round(success_rate, 2),
                 "average_response_time": round(agent_stats["average_response_time"], 3),
-                "last_activity": agent_stats["last_activity"].isoformat() if agent_stats["last_activity"] else None
+                "last_activity": agent_stats["last_activity"].isoformat() if agent_stats["last_activity"] else None,
+                "latency": agent_metrics.get_agent_summary(agent_type)
             }
         
+        orchestrator = agent_manager.agents.get("orchestrator")
+        
         return {
             "success": True,
             "agents_stats": stats,
+            "rate_limiter": llm_rate_limiter.get_stats(),
+            "circuit_breakers": get_circuit_breaker_stats(),
+            "job_queue": agent_job_queue.get_stats(),
+            "orchestrator_streaming": orchestrator.get_stream_stats() if orchestrator else None,
+            "orchestrator_parsing": orchestrator.get_parse_stats() if orchestrator else None,
             "summary": {
                 "total_agents": len(stats),
                 "total_requests": sum(s["total_requests"] for s in stats.values()),
@@ -156,13 +250,9 @@ async def list_available_agents():
     """قائمة الـ Agents المتاحة"""
     try:
         agents_list = []
-        for agent_type, agent in agent_manager.agents.items():
-            agents_list.append({
-                "agent_type": agent_type,
-                "class_name": agent.__class__.__name__,
-                "description": agent.__doc__ or f"Agent of type {agent_type}",
-                "available_tasks": _get_available_tasks(agent_type)
-            })
+        # الوصف من السجل بدون إنشاء الـ Agents
+        for agent_type in agent_manager.registry.agent_types():
+            agents_list.append(agent_manager.registry.describe(agent_type))
         
         return {
             "success": True,
@@ -175,8 +265,4 @@ async def list_available_agents():
 
 def _get_available_tasks(agent_type: str) -> list:
     """جلب المهام المتاحة لـ Agent معين"""
-    tasks_map = {
-        "coach": ["generate_message"],
-        "orchestrator": ["expand_goal"]
-    }
-    return tasks_map.get(agent_type, [])
+    return agent_manager.registry.list_tasks(agent_type)
@@ -1,37 +1,83 @@
 """Coach AI endpoints"""
 from fastapi import APIRouter, HTTPException
-from app.schemas import CoachPing, CoachResponse
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from app.schemas import CoachPing, CoachResponse, CoachBatchRequest
 from app.services.kpi_service import KPIService
-from app.ai.coach import CoachAI
+from app.ai.agent_manager import agent_manager
+from app.services.coach_message_service import coach_message_service, default_summary
+from app.services.coach_throttle import coach_throttle
+from app.services.deferred_delivery import deferred_delivery
+from app.utils.quiet_mode import QuietMode
+from app.ai.response_cache import coach_response_cache
+from app.ai.metrics import agent_metrics
+from app.config import settings
+import asyncio
+import json
+import time
 import structlog
 
 logger = structlog.get_logger()
 router = APIRouter(prefix="/coach", tags=["Coach AI"])
 
 kpi_service = KPIService()
-coach_ai = CoachAI()
 
 @router.post("/ping", response_model=CoachResponse)
 async def coach_ping(ping_data: CoachPing):
     """الحصول على رسالة تحفيز من الكوتش الذكي"""
     try:
+        # موظف وصلته رسالة مؤخراً: رد فوري من الذاكرة بدون قاعدة بيانات أو LLM
+        last_message = coach_throttle.check(ping_data.user_email)
+        if last_message:
+            return CoachResponse(
+                message="",
+                performance_level=last_message["performance_level"] or "good",
+                should_send=False
+            )
+        
+        # الرسالة المولدة مسبقاً تكفي إن لم يتغير الـ KPI أو الـ prompt
+        use_stored = not ping_data.bypass_cache and not ping_data.summary
+        if use_stored:
+            with agent_metrics.phase_timer("coach", "db"):
+                stored = await coach_message_service.get_current_message(ping_data.user_email)
+            if stored:
+                return await _serve_stored_message(ping_data.user_email, stored)
+        
         # جلب أداء المستخدم
-        performance_data = await kpi_service.get_user_performance(ping_data.user_email)
+        with agent_metrics.phase_timer("coach", "db"):
+            performance_data = await kpi_service.get_user_performance(ping_data.user_email)
         
         if "error" in performance_data:
             raise HTTPException(status_code=404, detail=performance_data["error"])
         
         # إعداد بيانات المستخدم للكوتش
         user_data = {
+            "user_email": ping_data.user_email,
+            "timezone": performance_data.get("timezone"),
             "name": ping_data.user_email.split("@")[0],
             "department": ping_data.department,
             "role": "employee",
             "drift": performance_data.get("drift", 0.0),
-            "summary": ping_data.summary or f"أداء في قسم {ping_data.department}"
+            "summary": ping_data.summary or default_summary(ping_data.department)
         }
         
-        # إنشاء رسالة الكوتش
-        coach_result = await coach_ai.generate_coach_message(user_data)
+        # إنشاء رسالة الكوتش عبر مدير الـ Agents المشترك
+        execution = await agent_manager.execute_agent_task(
+            "coach",
+            "generate_message",
+            user_data=user_data,
+            bypass_cache=ping_data.bypass_cache
+        )
+        if not execution["success"]:
+            raise RuntimeError(execution["error"])
+        coach_result = execution["result"]
+        
+        # التوليد في ساعات العمل يُحفظ أيضاً لطلبات اليوم القادمة
+        if use_stored:
+            await coach_message_service.store_message(
+                {**performance_data, "department": ping_data.department},
+                coach_result
+            )
         
         return CoachResponse(
             message=coach_result["message"],
@@ -42,3 +88,155 @@ async def coach_ping(ping_data: CoachPing):
     except Exception as e:
         logger.error(f"Error in coach ping: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate coach message")
+
+async def _serve_stored_message(user_email: str, stored: dict) -> CoachResponse:
+    """تقديم رسالة مولدة مسبقاً مع تطبيق Quiet Mode والتباعد وقت الإرسال"""
+    performance_level = stored["performance_level"]
+    if performance_level == "excellent":
+        return CoachResponse(message="", performance_level=performance_level, should_send=False)
+    
+    if QuietMode.is_quiet_time(stored.get("timezone")):
+        # تُرسل الرسالة المخزنة عند بداية فترة الموظف
+        await deferred_delivery.defer({
+            "user_email": user_email,
+            "department": stored.get("department"),
+            "timezone": stored.get("timezone")
+        })
+        return CoachResponse(message="", performance_level=performance_level, should_send=False)
+    
+    allowed, last_message = await coach_throttle.try_reserve(user_email)
+    if not allowed:
+        return CoachResponse(message="", performance_level=performance_level, should_send=False)
+    
+    await coach_throttle.record(user_email, stored["message"], performance_level)
+    return CoachResponse(message=stored["message"], performance_level=performance_level, should_send=True)
+
+@router.post("/batch")
+async def coach_batch(batch_data: CoachBatchRequest):
+    """رسائل تحفيز لمجموعة موظفين - النتائج تُبث كـ NDJSON فور جهوزها"""
+    if not batch_data.user_emails and not batch_data.department:
+        raise HTTPException(status_code=400, detail="user_emails or department is required")
+    
+    try:
+        # جلب أداء جميع المستخدمين في استعلام واحد
+        with agent_metrics.phase_timer("coach", "db"):
+            performances = await kpi_service.get_users_performance(
+                user_emails=batch_data.user_emails,
+                department=batch_data.department
+            )
+    except Exception as e:
+        logger.error(f"Error loading batch performance data: {e}")
+        raise HTTPException(status_code=500, detail="Failed to load performance data")
+    
+    concurrency = min(
+        batch_data.concurrency or settings.coach_batch_concurrency,
+        settings.coach_batch_max_concurrency
+    )
+    concurrency = max(concurrency, 1)
+    
+    found_emails = {performance["user_email"] for performance in performances}
+    missing_emails = [
+        email for email in (batch_data.user_emails or [])
+        if email not in found_emails
+    ]
+    
+    return StreamingResponse(
+        _stream_batch(performances, missing_emails, batch_data, concurrency),
+        media_type="application/x-ndjson"
+    )
+
+async def _stream_batch(performances: list, missing_emails: list, batch_data: CoachBatchRequest, concurrency: int):
+    """تنفيذ رسائل الكوتش بتوازي محدود وبث كل نتيجة عند انتهائها"""
+    semaphore = asyncio.Semaphore(concurrency)
+    start_time = time.perf_counter()
+    
+    async def generate(performance: dict) -> dict:
+        async with semaphore:
+            item_start = time.perf_counter()
+            try:
+                user_data = {
+                    "user_email": performance["user_email"],
+                    "timezone": performance.get("timezone"),
+                    "name": performance["name"],
+                    "department": performance["department"],
+                    "role": "employee",
+                    "drift": performance.get("drift", 0.0),
+                    "summary": batch_data.summary or f"أداء في قسم {performance['department']}"
+                }
+                execution = await agent_manager.execute_agent_task(
+                    "coach",
+                    "generate_message",
+                    user_data=user_data,
+                    bypass_cache=batch_data.bypass_cache,
+                    priority="scheduled"
+                )
+                if not execution["success"]:
+                    raise RuntimeError(execution["error"])
+                coach_result = execution["result"]
+                return {
+                    "user_email": performance["user_email"],
+                    "success": True,
+                    "message": coach_result["message"],
+                    "performance_level": coach_result["performance_level"],
+                    "should_send": coach_result["should_send"],
+                    "execution_time": round(time.perf_counter() - item_start, 3)
+                }
+            except Exception as e:
+                logger.error(f"Error in coach batch for {performance['user_email']}: {e}")
+                return {
+                    "user_email": performance["user_email"],
+                    "success": False,
+                    "error": str(e)
+                }
+    
+    succeeded = 0
+    failed = len(missing_emails)
+    
+    for email in missing_emails:
+        yield json.dumps({"user_email": email, "success": False, "error": "User not found"}, ensure_ascii=False) + "\n"
+    
+    tasks = [asyncio.create_task(generate(performance)) for performance in performances]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            if item["success"]:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    finally:
+        # إلغاء المتبقي إذا قطع العميل الاتصال
+        for task in tasks:
+            task.cancel()
+    
+    yield json.dumps({
+        "summary": True,
+        "total": len(performances) + len(missing_emails),
+        "succeeded": succeeded,
+        "failed": failed,
+        "concurrency": concurrency,
+        "wall_time": round(time.perf_counter() - start_time, 3)
+    }, ensure_ascii=False) + "\n"
+
+@router.post("/pregenerate")
+async def pregenerate_coach_messages(department: Optional[str] = None):
+    """تشغيل التوليد المسبق يدوياً (يعمل تلقائياً كل ليلة خلال Quiet Mode)"""
+    try:
+        summary = await coach_message_service.pregenerate_all(department=department)
+        return {
+            "success": True,
+            "summary": summary
+        }
+    except Exception as e:
+        logger.error(f"Error pre-generating coach messages: {e}")
+        raise HTTPException(status_code=500, detail="Failed to pre-generate coach messages")
+
+@router.get("/cache/stats")
+async def coach_cache_stats():
+    """إحصائيات كاش ردود الكوتش"""
+    return {
+        "success": True,
+        "cache_stats": coach_response_cache.get_stats(),
+        "throttle": coach_throttle.get_stats(),
+        "deferred_delivery": deferred_delivery.get_stats()
+    }
@@ -3,7 +3,10 @@ from fastapi import APIRouter, HTTPException
 from app.schemas import ManagerDigestRequest, ExecutiveDigestRequest, DigestResponse
 from app.services.digest_service import DigestService
 from app.integrations.emailer import EmailService
+from app.services.digest_fanout import digest_fanout
+from app.scheduler import run_digest_now
 from app.config import settings
+from typing import Optional
 import structlog
 
 logger = structlog.get_logger()
@@ -71,3 +74,43 @@ async def send_executive_digest(request: ExecutiveDigestRequest):
     except Exception as e:
         logger.error(f"Error sending executive digest: {e}")
         raise HTTPException(status_code=500, detail="Failed to send executive digest")
+
+@router.post("/run/{kind}")
+async def run_digests(kind: str):
+    """تشغيل إرسال التقارير يدوياً (manager أو executive) - يعمل تلقائياً حسب الجدول
+
+    يمر بنفس قفل التشغيل المجدول: إذا اكتمل تشغيل اليوم (أو الأسبوع) لا يُعاد الإرسال.
+    """
+    if kind not in ("manager", "executive"):
+        raise HTTPException(status_code=400, detail="kind must be manager or executive")
+    
+    try:
+        outcome, run = await run_digest_now(kind)
+    except Exception as e:
+        logger.error(f"Error running {kind} digests: {e}")
+        raise HTTPException(status_code=500, detail="Failed to run digests")
+    
+    if outcome is None:
+        raise HTTPException(status_code=409, detail="A digest run is already in progress")
+    if run:
+        run.pop("digests", None)
+    return {"success": True, "outcome": outcome, "run": run}
+
+@router.get("/runs")
+async def list_digest_runs(kind: Optional[str] = None, limit: int = 20):
+    """آخر تشغيلات التقارير المجدولة"""
+    try:
+        runs = await digest_fanout.list_runs(kind=kind, limit=max(1, min(limit, 100)))
+        return {"runs": runs}
+        
+    except Exception as e:
+        logger.error(f"Error listing digest runs: {e}")
+        raise HTTPException(status_code=500, detail="Failed to list digest runs")
+
+@router.get("/runs/{run_id}")
+async def get_digest_run(run_id: str):
+    """تفاصيل تشغيل واحد مع زمن كل تقرير"""
+    run = await digest_fanout.get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Digest run not found")
+    return run
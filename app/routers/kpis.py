@@ -1,7 +1,15 @@
 """KPIs management endpoints"""
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional, AsyncIterator
+from pydantic import ValidationError
 from app.schemas import KPIUpsert, KPIResponse
 from app.services.kpi_service import KPIService
+from app.config import settings
+import codecs
+import csv
+import json
+import tempfile
 import structlog
 
 logger = structlog.get_logger()
@@ -9,6 +17,9 @@ router = APIRouter(prefix="/kpis", tags=["KPIs"])
 
 kpi_service = KPIService()
 
+RESULTS_SPOOL_BYTES = 1024 * 1024
+MAX_TREND_MONTHS = 36
+
 @router.post("/upsert", response_model=KPIResponse)
 async def upsert_kpi(kpi_data: KPIUpsert):
     """تحديث أو إنشاء KPI جديد"""
@@ -26,6 +37,109 @@ async def upsert_kpi(kpi_data: KPIUpsert):
         logger.error(f"Error upserting KPI: {e}")
         raise HTTPException(status_code=500, detail="Failed to upsert KPI")
 
+@router.post("/bulk")
+async def bulk_upsert_kpis(request: Request, format: Optional[str] = None):
+    """تحميل KPIs بالجملة من CSV أو NDJSON - نتيجة لكل صف ثم ملخص كـ NDJSON
+
+    أعمدة CSV: user_email,month,target,actual (سطر العناوين إلزامي).
+    """
+    body_format = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if body_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    
+    # يُقرأ الجسم كاملاً قبل بدء الرد: StreamingResponse يستهلك receive() لمراقبة الانقطاع.
+    # النتائج تُكتب لملف مؤقت ينتقل للقرص بعد حد معين فتبقى الذاكرة ثابتة
+    results = tempfile.SpooledTemporaryFile(max_size=RESULTS_SPOOL_BYTES, mode="w+b")
+    try:
+        async for result in kpi_service.bulk_upsert_kpis(
+            _parse_rows(_read_lines(request), body_format),
+            batch_size=settings.kpi_bulk_batch_size
+        ):
+            results.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+    except Exception as e:
+        # الدفعات السابقة كُتبت فعلاً - نبلغ العميل بمكان التوقف
+        logger.error(f"Error in bulk KPI upsert: {e}")
+        results.write((json.dumps({"summary": True, "error": "Failed to upsert KPIs"}) + "\n").encode("utf-8"))
+    
+    results.seek(0)
+    return StreamingResponse(_stream_file(results), media_type="application/x-ndjson")
+
+def _stream_file(results):
+    try:
+        for line in results:
+            yield line
+    finally:
+        results.close()
+
+async def _read_lines(request: Request) -> AsyncIterator[str]:
+    """قراءة جسم الطلب سطراً بسطر دون تحميله كاملاً في الذاكرة"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def _parse_rows(lines: AsyncIterator[str], body_format: str) -> AsyncIterator[dict]:
+    """تحويل الأسطر لصفوف KPI - الصف غير الصالح يحمل error بدل إيقاف التحميل"""
+    header = None
+    row_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        
+        if body_format == "csv" and header is None:
+            header = [column.strip() for column in next(csv.reader([line]))]
+            continue
+        
+        row_number += 1
+        raw = None
+        try:
+            if body_format == "csv":
+                raw = dict(zip(header, next(csv.reader([line]))))
+            else:
+                raw = json.loads(line)
+                if not isinstance(raw, dict):
+                    raise ValueError("row must be a JSON object")
+            kpi_data = KPIUpsert(**raw)
+            yield {"row": row_number, **kpi_data.dict()}
+        except ValidationError as e:
+            first_error = e.errors()[0]
+            field = ".".join(str(part) for part in first_error["loc"])
+            yield {"row": row_number, "user_email": raw.get("user_email"), "error": f"{field}: {first_error['msg']}"}
+        except ValueError as e:
+            yield {"row": row_number, "user_email": raw.get("user_email") if isinstance(raw, dict) else None, "error": str(e)}
+
+@router.get("/trends")
+async def get_drift_trends(department: Optional[str] = None, months: int = 12, window: int = 3):
+    """اتجاه الـ drift لقسم أو للشركة: drift وفرق شهري ومتوسط متحرك وميل لكل موظف"""
+    if not 1 <= months <= MAX_TREND_MONTHS:
+        raise HTTPException(status_code=400, detail=f"months must be between 1 and {MAX_TREND_MONTHS}")
+    if not 1 <= window <= months:
+        raise HTTPException(status_code=400, detail="window must be between 1 and months")
+    
+    try:
+        return await kpi_service.get_drift_trends(department=department, months=months, window=window)
+        
+    except Exception as e:
+        logger.error(f"Error getting drift trends: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get drift trends")
+
+@router.get("/departments")
+async def get_department_rollups(department: Optional[str] = None):
+    """عدد الموظفين في كل مستوى أداء ومتوسط الـ drift لكل قسم"""
+    try:
+        departments = await kpi_service.get_department_rollups(department=department)
+        return {"departments": departments}
+        
+    except Exception as e:
+        logger.error(f"Error getting department rollups: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get department rollups")
+
 @router.get("/performance/{user_email}")
 async def get_user_performance(user_email: str):
     """جلب أداء المستخدم"""
@@ -6,6 +6,7 @@ from datetime import datetime
 from app.schemas import PromptUpdate, PromptResponse
 from app.db import get_db
 from app.models import AIPrompt
+from app.ai.prompt_cache import prompt_cache
 from app.ai.prompts.coach_prompts import AVAILABLE_VARIABLES as COACH_VARS
 from app.ai.prompts.orchestrator_prompts import AVAILABLE_VARIABLES as ORCHESTRATOR_VARS
 import structlog
@@ -13,6 +14,14 @@ import structlog
 logger = structlog.get_logger()
 router = APIRouter(prefix="/prompts", tags=["AI Prompts Management"])
 
+@router.get("/cache/stats")
+async def get_prompt_cache_stats():
+    """إحصائيات كاش الـ prompts (hits/misses)"""
+    return {
+        "success": True,
+        "cache_stats": prompt_cache.get_stats()
+    }
+
 @router.get("/{agent_type}", response_model=List[PromptResponse])
 async def get_agent_prompts(agent_type: str):
     """عرض جميع prompts للـ agent مع إمكانية التعديل"""
@@ -56,16 +65,15 @@ async def update_prompt(agent_type: str, prompt_name: str, prompt_data: PromptUp
         })
         
         if existing_prompt:
-            # تحديث موجود
+            # تحديث موجود - المستند القديم بدون version يُعامل كنسخة 1 (كما يقرؤه BaseAgent)
             await db.ai_prompts.update_one(
                 {"_id": existing_prompt["_id"]},
-                {
-                    "$set": {
-                        "template": prompt_data.template,
-                        "variables": prompt_data.variables or {},
-                        "updated_at": datetime.utcnow()
-                    }
-                }
+                [{"$set": {
+                    "template": {"$literal": prompt_data.template},
+                    "variables": {"$literal": prompt_data.variables or {}},
+                    "updated_at": datetime.utcnow(),
+                    "version": {"$add": [{"$ifNull": ["$version", 1]}, 1]}
+                }}]
             )
         else:
             # إنشاء جديد
@@ -77,6 +85,9 @@ async def update_prompt(agent_type: str, prompt_name: str, prompt_data: PromptUp
             )
             await db.ai_prompts.insert_one(new_prompt.dict(by_alias=True))
         
+        # إبطال الكاش فوراً في هذا الـ worker
+        prompt_cache.invalidate(agent_type, prompt_name)
+        
         # إرجاع النسخة المحدثة
         updated_prompt = await db.ai_prompts.find_one({
             "agent_type": agent_type,
@@ -260,6 +271,7 @@ async def _initialize_default_prompts(agent_type: str):
                 "template": COACH_AI_SYSTEM_PROMPT,
                 "variables": {},
                 "is_active": True,
+                "version": 1,
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             },
@@ -269,6 +281,7 @@ async def _initialize_default_prompts(agent_type: str):
                 "template": COACH_USER_TEMPLATE,
                 "variables": {},
                 "is_active": True,
+                "version": 1,
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             }
@@ -283,6 +296,7 @@ async def _initialize_default_prompts(agent_type: str):
                 "template": ORCHESTRATOR_SYSTEM_PROMPT,
                 "variables": {},
                 "is_active": True,
+                "version": 1,
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             },
@@ -292,6 +306,7 @@ async def _initialize_default_prompts(agent_type: str):
                 "template": ORCHESTRATOR_USER_TEMPLATE,
                 "variables": {},
                 "is_active": True,
+                "version": 1,
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             }
@@ -301,6 +316,7 @@ async def _initialize_default_prompts(agent_type: str):
     
     # إدراج الـ prompts
     await db.ai_prompts.insert_many(prompts)
+    prompt_cache.invalidate(agent_type)
 
 def _get_available_variables(agent_type: str) -> Dict[str, str]:
     """جلب المتغيرات المتاحة للـ agent"""
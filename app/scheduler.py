@@ -0,0 +1,134 @@
+"""المهام المجدولة - تعمل داخل event loop التطبيق"""
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from typing import Any, Dict, Optional, Tuple
+from app.config import settings
+from app.db import run_exclusive
+from app.utils.quiet_mode import QuietMode
+import structlog
+
+logger = structlog.get_logger()
+
+scheduler = AsyncIOScheduler(timezone=settings.timezone)
+
+def _daily_key() -> str:
+    return QuietMode.local_now().strftime("%Y-%m-%d")
+
+def _weekly_key() -> str:
+    return QuietMode.local_now().strftime("%G-W%V")
+
+# اسم القفل ومفتاح التشغيل لكل نوع تقرير - مشترك بين الـ cron والتشغيل اليدوي
+DIGEST_JOBS = {
+    "manager": ("send_manager_digests", _daily_key),
+    "executive": ("send_executive_digest", _weekly_key),
+}
+
+async def _run_once(name: str, run_key: str, job):
+    """كل worker يشغّل الـ cron، والقفل في MongoDB يضمن تنفيذاً واحداً لكل run_key"""
+    try:
+        outcome = await run_exclusive(
+            name,
+            run_key,
+            job,
+            ttl_seconds=settings.lease_ttl_seconds,
+            takeover_window_seconds=settings.lease_takeover_window_minutes * 60
+        )
+        logger.info("Scheduled job finished", job=name, run_key=run_key, outcome=outcome)
+    except Exception as e:
+        logger.error(f"Scheduled job {name} failed: {e}")
+
+def _digest_job(kind: str, run_key: str, result: Dict[str, Any]):
+    """job لـ run_exclusive يرسل تقارير kind ويحفظ ملخص التشغيل في result"""
+    from app.services.digest_fanout import digest_fanout
+
+    async def job(lease):
+        if kind == "manager":
+            run = await digest_fanout.run_manager_digests(lease=lease, run_key=run_key)
+        else:
+            run = await digest_fanout.run_executive_digest(lease=lease, run_key=run_key)
+        result.update(run)
+
+    return job
+
+async def run_digest_now(kind: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """تشغيل يدوي عبر نفس القفل وعلامة التشغيل المجدول - لا ينتظر إذا كان التشغيل جارياً
+
+    يرجع (outcome, run): outcome كما في run_exclusive، و run ملخص التشغيل إذا أُرسلت التقارير.
+    """
+    name, key = DIGEST_JOBS[kind]
+    run_key = key()
+    result: Dict[str, Any] = {}
+    outcome = await run_exclusive(
+        name,
+        run_key,
+        _digest_job(kind, run_key, result),
+        ttl_seconds=settings.lease_ttl_seconds,
+        takeover_window_seconds=0
+    )
+    return outcome, result or None
+
+async def pregenerate_coach_messages():
+    """توليد رسائل الكوتش لليوم التالي خلال Quiet Mode فقط"""
+    from app.services.coach_message_service import coach_message_service
+
+    async def job(lease):
+        if not QuietMode.is_quiet_time():
+            logger.warning("Skipping coach pre-generation outside quiet time")
+            return
+        await coach_message_service.pregenerate_all(lease=lease)
+
+    await _run_once("pregenerate_coach_messages", _daily_key(), job)
+
+async def send_manager_digests():
+    """التقرير اليومي لكل المدراء"""
+    name, key = DIGEST_JOBS["manager"]
+    run_key = key()
+    await _run_once(name, run_key, _digest_job("manager", run_key, {}))
+
+async def send_executive_digest():
+    """التقرير الأسبوعي للإدارة التنفيذية"""
+    name, key = DIGEST_JOBS["executive"]
+    run_key = key()
+    await _run_once(name, run_key, _digest_job("executive", run_key, {}))
+
+def start_scheduler():
+    """تسجيل المهام وتشغيل الـ scheduler"""
+    if not settings.scheduler_enabled:
+        logger.info("⚠️ Scheduler disabled by SCHEDULER_ENABLED flag")
+        return
+
+    scheduler.add_job(
+        pregenerate_coach_messages,
+        CronTrigger(hour=settings.coach_pregen_hour, minute=0, timezone=settings.timezone),
+        id="pregenerate_coach_messages",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+    scheduler.add_job(
+        send_manager_digests,
+        CronTrigger(hour=settings.digest_manager_hour, minute=0, timezone=settings.timezone),
+        id="send_manager_digests",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+    scheduler.add_job(
+        send_executive_digest,
+        CronTrigger(
+            day_of_week=settings.digest_executive_day,
+            hour=settings.digest_executive_hour,
+            minute=0,
+            timezone=settings.timezone
+        ),
+        id="send_executive_digest",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+    scheduler.start()
+    logger.info("✅ Scheduler started", jobs=[job.id for job in scheduler.get_jobs()])
+
+def shutdown_scheduler():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
@@ -1,7 +1,11 @@
 """Schemas للـ API requests/responses"""
 from datetime import datetime
 from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, field_validator
+import re
+
+# صيغة الشهر في KPIs - المقارنة والترتيب في قاعدة البيانات نصية
+MONTH_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
 
 # Schemas إنشاء المهام
 class TaskCreate(BaseModel):
@@ -26,6 +30,13 @@ class KPIUpsert(BaseModel):
     target: int
     actual: int
 
+    @field_validator("month")
+    @classmethod
+    def validate_month(cls, value: str) -> str:
+        if not MONTH_PATTERN.match(value):
+            raise ValueError("month must be YYYY-MM")
+        return value
+
 class KPIResponse(BaseModel):
     id: str
     user_email: str
@@ -40,12 +51,20 @@ class CoachPing(BaseModel):
     user_email: EmailStr
     department: str
     summary: Optional[str] = None
+    bypass_cache: bool = False
 
 class CoachResponse(BaseModel):
     message: str
     performance_level: str
     should_send: bool
 
+class CoachBatchRequest(BaseModel):
+    user_emails: Optional[List[EmailStr]] = None
+    department: Optional[str] = None
+    summary: Optional[str] = None
+    bypass_cache: bool = False
+    concurrency: Optional[int] = None
+
 # Schemas الـ Prompts
 class PromptUpdate(BaseModel):
     template: str
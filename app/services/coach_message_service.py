@@ -0,0 +1,170 @@
+"""خدمة رسائل الكوتش المولدة مسبقاً خلال Quiet Mode"""
+from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+import asyncio
+import time
+from app.db import get_db
+from app.config import settings
+from app.services.kpi_service import KPIService
+from app.ai.agent_manager import agent_manager
+import structlog
+
+logger = structlog.get_logger()
+
+# رسائل تُعاد استخدامها بدون استدعاء الـ LLM (القوالب تُعاد محاولتها)
+REUSABLE_SOURCES = ("ai", "skipped")
+
+def kpi_fingerprint(performance: Dict[str, Any]) -> str:
+    """بصمة أحدث KPI - تتغير عند أي تعديل في الأرقام"""
+    return "|".join(
+        str(performance.get(field, ""))
+        for field in ("month", "target", "actual", "drift")
+    )
+
+def default_summary(department: str) -> str:
+    return f"أداء في قسم {department}"
+
+class CoachMessageService:
+    """تخزين وتقديم رسائل الكوتش الجاهزة من مجموعة coach_messages"""
+
+    def __init__(self):
+        self.kpi_service = KPIService()
+
+    async def get_current_message(self, user_email: str) -> Optional[Dict[str, Any]]:
+        """الرسالة المخزنة إن كانت ما زالت صالحة - قراءة واحدة بالفهرس"""
+        db = await get_db()
+        doc = await db.coach_messages.find_one({"user_email": user_email})
+        if not doc or doc.get("stale"):
+            return None
+
+        max_age = timedelta(hours=settings.coach_message_max_age_hours)
+        if datetime.utcnow() - doc["generated_at"] > max_age:
+            return None
+
+        # الرسائل المتخطاة لا تعتمد على الـ prompt
+        if doc.get("prompt_versions") is not None:
+            coach = await agent_manager.get_agent("coach")
+            if doc["prompt_versions"] != await coach.get_prompt_versions():
+                return None
+
+        return doc
+
+    async def store_message(self, performance: Dict[str, Any], coach_result: Dict[str, Any]) -> bool:
+        """حفظ رسالة مولدة مع إصدار الـ prompt وبصمة الـ KPI"""
+        if coach_result.get("source") not in REUSABLE_SOURCES:
+            return False
+        
+        # التخطي بسبب Quiet Mode (وليس الأداء الممتاز) لا يصلح للتخزين
+        if coach_result["source"] == "skipped" and coach_result["performance_level"] != "excellent":
+            return False
+
+        db = await get_db()
+        await db.coach_messages.update_one(
+            {"user_email": performance["user_email"]},
+            {"$set": {
+                "user_email": performance["user_email"],
+                "department": performance.get("department", "general"),
+                "timezone": performance.get("timezone"),
+                "message": coach_result["message"],
+                "performance_level": coach_result["performance_level"],
+                "source": coach_result["source"],
+                "prompt_versions": coach_result.get("prompt_versions"),
+                "kpi_fingerprint": kpi_fingerprint(performance),
+                "generated_at": datetime.utcnow(),
+                "stale": False
+            }},
+            upsert=True
+        )
+        return True
+
+    async def pregenerate_all(self, department: Optional[str] = None,
+                              concurrency: Optional[int] = None, lease=None) -> Dict[str, Any]:
+        """توليد رسائل الغد لجميع الموظفين على دفعات محدودة التوازي
+
+        الموظفون الذين لم تتغير أرقامهم ولا الـ prompt منذ آخر توليد يُتخطون.
+        lease (من run_exclusive): بعد فقدان القفل لا يُولَّد ولا يُحفظ شيء.
+        """
+        start_time = time.perf_counter()
+        db = await get_db()
+
+        performances = await self.kpi_service.get_users_performance(department=department)
+
+        coach = await agent_manager.get_agent("coach")
+        prompt_versions = await coach.get_prompt_versions()
+
+        # الرسائل الحالية في استعلام واحد
+        existing = {}
+        emails = [performance["user_email"] for performance in performances]
+        async for doc in db.coach_messages.find(
+            {"user_email": {"$in": emails}},
+            {"user_email": 1, "kpi_fingerprint": 1, "prompt_versions": 1, "stale": 1, "source": 1}
+        ):
+            existing[doc["user_email"]] = doc
+
+        pending: List[Dict[str, Any]] = []
+        for performance in performances:
+            doc = existing.get(performance["user_email"])
+            unchanged = (
+                doc is not None
+                and not doc.get("stale")
+                and doc.get("kpi_fingerprint") == kpi_fingerprint(performance)
+                and doc.get("prompt_versions") in (None, prompt_versions)
+            )
+            if not unchanged:
+                pending.append(performance)
+
+        semaphore = asyncio.Semaphore(max(1, concurrency or settings.coach_pregen_concurrency))
+        counts = {"generated": 0, "stored": 0, "failed": 0, "skipped": 0}
+
+        def lease_lost() -> bool:
+            if lease and not lease.is_held():
+                counts["skipped"] += 1
+                return True
+            return False
+
+        async def generate(performance: Dict[str, Any]):
+            async with semaphore:
+                if lease_lost():
+                    return
+                user_data = {
+                    "user_email": performance["user_email"],
+                    "timezone": performance.get("timezone"),
+                    "name": performance["name"],
+                    "department": performance["department"],
+                    "role": "employee",
+                    "drift": performance.get("drift", 0.0),
+                    "summary": default_summary(performance["department"])
+                }
+                execution = await agent_manager.execute_agent_task(
+                    "coach",
+                    "generate_message",
+                    user_data=user_data,
+                    bypass_cache=True,
+                    priority="background",
+                    check_schedule=False
+                )
+                if not execution["success"]:
+                    counts["failed"] += 1
+                    logger.error(f"Pre-generation failed for {performance['user_email']}: {execution['error']}")
+                    return
+
+                counts["generated"] += 1
+                if lease_lost():
+                    return
+                if await self.store_message(performance, execution["result"]):
+                    counts["stored"] += 1
+
+        await asyncio.gather(*(generate(performance) for performance in pending))
+
+        summary = {
+            "total_users": len(performances),
+            "unchanged": len(performances) - len(pending),
+            **counts,
+            "prompt_versions": prompt_versions,
+            "wall_time": round(time.perf_counter() - start_time, 3)
+        }
+        logger.info("Coach messages pre-generated", **summary)
+        return summary
+
+# خدمة مشتركة للـ router والـ scheduler
+coach_message_service = CoachMessageService()
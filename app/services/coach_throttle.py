@@ -0,0 +1,139 @@
+"""سجل آخر رسالة كوتش لكل موظف - يمنع تكرار الرسائل قبل أي عمل على الـ LLM"""
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import time
+from app.db import get_db
+from app.models import Message
+from app.utils.quiet_mode import QuietMode
+import structlog
+
+logger = structlog.get_logger()
+
+COACH_MESSAGE_TYPE = "coach_reply"
+
+# أقصى عدد موظفين في الذاكرة
+LEDGER_MAX_ENTRIES = 10000
+# "لم تُرسل له رسالة" يُعاد التحقق منه من القاعدة بعد هذه المدة (workers أخرى)
+EMPTY_ENTRY_TTL = 60
+
+class CoachThrottleLedger:
+    """ذاكرة فوق مجموعة messages لقاعدة التباعد بين رسائل الكوتش
+
+    الفحص والحجز يتمان بدون await بينهما فلا يمر طلبان متزامنان لنفس
+    الموظف داخل العملية، والموظف المعروف في الذاكرة لا يحتاج قاعدة البيانات.
+    """
+
+    def __init__(self, max_entries: int = LEDGER_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # user_email -> {"last_sent", "performance_level", "loaded_at"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # الحجوزات التي لم تُثبت بعد: user_email -> (الحجز، السجل قبله)
+        self._pending: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        self.stats = {"suppressed": 0, "reserved": 0, "released": 0, "db_lookups": 0}
+
+    @property
+    def interval(self) -> timedelta:
+        return timedelta(hours=QuietMode.MESSAGE_INTERVAL_HOURS)
+
+    def _is_throttled(self, entry: Optional[Dict[str, Any]]) -> bool:
+        return bool(entry and entry["last_sent"] and datetime.utcnow() - entry["last_sent"] < self.interval)
+
+    def _remember(self, user_email: str, entry: Dict[str, Any]):
+        self._entries[user_email] = entry
+        self._entries.move_to_end(user_email)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def check(self, user_email: str) -> Optional[Dict[str, Any]]:
+        """فحص من الذاكرة فقط - يرجع آخر رسالة إن كان الموظف ممنوعاً الآن"""
+        entry = self._entries.get(user_email)
+        if self._is_throttled(entry):
+            self.stats["suppressed"] += 1
+            return entry
+        return None
+
+    async def _load(self, user_email: str) -> Dict[str, Any]:
+        """آخر رسالة من الذاكرة أو بقراءة واحدة بالفهرس"""
+        entry = self._entries.get(user_email)
+        if entry and (entry["last_sent"] or time.monotonic() - entry["loaded_at"] < EMPTY_ENTRY_TTL):
+            return entry
+
+        self.stats["db_lookups"] += 1
+        db = await get_db()
+        doc = await db.messages.find_one(
+            {"user_email": user_email, "type": COACH_MESSAGE_TYPE},
+            {"created_at": 1, "performance_level": 1},
+            sort=[("created_at", -1)]
+        )
+
+        # طلب آخر ربما حجز أثناء القراءة
+        current = self._entries.get(user_email)
+        if current and current["last_sent"] and (not doc or current["last_sent"] >= doc["created_at"]):
+            return current
+
+        entry = {
+            "last_sent": doc["created_at"] if doc else None,
+            "performance_level": doc.get("performance_level") if doc else None,
+            "loaded_at": time.monotonic()
+        }
+        self._remember(user_email, entry)
+        return entry
+
+    async def try_reserve(self, user_email: str) -> Tuple[bool, Dict[str, Any]]:
+        """حجز إرسال رسالة الآن - (False, آخر رسالة) إن لم يمض التباعد المطلوب"""
+        entry = await self._load(user_email)
+
+        # لا await من هنا حتى الحجز
+        if self._is_throttled(entry):
+            self.stats["suppressed"] += 1
+            return False, entry
+
+        reservation = {
+            "last_sent": datetime.utcnow(),
+            "performance_level": None,
+            "loaded_at": time.monotonic()
+        }
+        self._remember(user_email, reservation)
+        self._pending[user_email] = (reservation, entry)
+        self.stats["reserved"] += 1
+        return True, entry
+
+    def release(self, user_email: str):
+        """إلغاء حجز لم تُرسل رسالته (فشل أو إلغاء قبل record) حتى لا يُمنع الموظف بلا رسالة"""
+        pending = self._pending.pop(user_email, None)
+        if not pending:
+            return
+        reservation, previous = pending
+        # حجز أحدث أو رسالة مثبتة حلت محله - لا نلمسها
+        if self._entries.get(user_email) is reservation:
+            self._remember(user_email, previous)
+            self.stats["released"] += 1
+
+    async def record(self, user_email: str, body: str, performance_level: str):
+        """تثبيت الحجز وحفظ الرسالة في مجموعة messages"""
+        self._pending.pop(user_email, None)
+        message = Message(
+            user_email=user_email,
+            type=COACH_MESSAGE_TYPE,
+            body=body,
+            performance_level=performance_level
+        )
+        self._remember(user_email, {
+            "last_sent": message.created_at,
+            "performance_level": performance_level,
+            "loaded_at": time.monotonic()
+        })
+
+        try:
+            db = await get_db()
+            await db.messages.insert_one(message.dict(by_alias=True))
+        except Exception as e:
+            # الذاكرة تبقى تمنع التكرار في هذه العملية
+            logger.error(f"Failed to record coach message for {user_email}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "cached_users": len(self._entries)}
+
+# سجل مشترك لكل العملية
+coach_throttle = CoachThrottleLedger()
@@ -0,0 +1,272 @@
+"""تأجيل رسائل الكوتش الممنوعة بسبب Quiet Mode وإرسالها عند بداية فترة كل موظف"""
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import heapq
+import os
+import time
+import uuid
+from pymongo import ReturnDocument
+from app.db import get_db
+from app.config import settings
+from app.ai.rate_limiter import TokenBucket
+from app.utils.quiet_mode import QuietMode
+import structlog
+
+logger = structlog.get_logger()
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DELIVERED = "delivered"
+FAILED = "failed"
+DROPPED = "dropped"
+
+# بيانات الموظف المحفوظة لتوليد الرسالة عند الإرسال
+USER_DATA_FIELDS = ("user_email", "name", "department", "role", "drift", "summary", "timezone")
+
+class DeferredDeliveryScheduler:
+    """طابور دائم في deferred_messages مع heap في الذاكرة للمواعيد القريبة
+
+    كل worker يحمّل المواعيد القريبة ويحجز الرسالة ذرياً قبل إرسالها،
+    والإرسال محدود المعدل حتى لا تخرج كل الرسائل عند 09:00 دفعة واحدة.
+    """
+
+    def __init__(self, release_per_minute: int, horizon_minutes: float, claim_timeout_minutes: float):
+        self.release_bucket = TokenBucket(release_per_minute)
+        self.horizon = timedelta(minutes=horizon_minutes)
+        self.claim_timeout = timedelta(minutes=claim_timeout_minutes)
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # (deliver_at, _id) - المدخل الذي لا يطابق _scheduled قديم ويُتجاهل عند إخراجه
+        self._heap: List[Tuple[datetime, Any]] = []
+        # _id -> deliver_at الحالي في الـ heap
+        self._scheduled: Dict[Any, datetime] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._loaded_until: Optional[datetime] = None
+        self._releasing = set()
+        self.stats = {"deferred": 0, "delivered": 0, "failed": 0, "dropped": 0, "claim_conflicts": 0}
+
+    async def defer(self, user_data: Dict[str, Any]) -> Optional[datetime]:
+        """تأجيل رسالة موظف حتى بداية فترته (رسالة معلقة واحدة لكل موظف)"""
+        user_email = user_data.get("user_email")
+        if not user_email:
+            return None
+
+        deliver_at = QuietMode.next_window_start(user_data.get("timezone"))
+        db = await get_db()
+        doc = await db.deferred_messages.find_one_and_update(
+            {"user_email": user_email, "status": PENDING},
+            {
+                "$set": {
+                    "user_data": {key: user_data[key] for key in USER_DATA_FIELDS if key in user_data},
+                    "deliver_at": deliver_at
+                },
+                "$setOnInsert": {"created_at": datetime.utcnow(), "attempts": 0}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            projection={"_id": 1}
+        )
+        self.stats["deferred"] += 1
+        self._schedule(deliver_at, doc["_id"])
+        return deliver_at
+
+    def _schedule(self, deliver_at: datetime, message_id: Any):
+        if self._scheduled.get(message_id) == deliver_at:
+            return
+        if self._loaded_until is not None and deliver_at > self._loaded_until:
+            # خارج الأفق - يُحمّل في التحديث القادم، والموعد القديم إن وجد يصبح قديماً
+            self._scheduled.pop(message_id, None)
+            return
+        heapq.heappush(self._heap, (deliver_at, message_id))
+        self._scheduled[message_id] = deliver_at
+        if self._wakeup:
+            self._wakeup.set()
+
+    def start(self):
+        if self._loop_task is None:
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+            logger.info("Deferred delivery scheduler started", worker_id=self.worker_id)
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+    async def _load_due_soon(self):
+        """تحميل الرسائل المعلقة خلال الأفق والمحجوزة من workers توقفت"""
+        now = datetime.utcnow()
+        until = now + self.horizon
+        db = await get_db()
+        cursor = db.deferred_messages.find(
+            {"$or": [
+                {"status": PENDING, "deliver_at": {"$lte": until}},
+                {"status": CLAIMED, "claimed_at": {"$lt": now - self.claim_timeout}}
+            ]},
+            {"deliver_at": 1}
+        )
+        self._loaded_until = until
+        async for doc in cursor:
+            self._schedule(doc["deliver_at"], doc["_id"])
+
+    async def _run(self):
+        refresh_every = self.horizon.total_seconds() / 2
+        next_refresh = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_refresh:
+                    await self._load_due_soon()
+                    next_refresh = time.monotonic() + refresh_every
+
+                now = datetime.utcnow()
+                if self._heap and self._heap[0][0] <= now:
+                    deliver_at, message_id = heapq.heappop(self._heap)
+                    if self._scheduled.get(message_id) != deliver_at:
+                        # أُعيدت جدولتها لموعد آخر
+                        continue
+                    del self._scheduled[message_id]
+
+                    # إرسال محدود المعدل
+                    wait = self.release_bucket.time_until(1)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    self.release_bucket.consume(1)
+
+                    # التوليد والإرسال لا يوقفان الجدولة - المعدل يحدده الـ bucket
+                    task = asyncio.create_task(self._release(message_id))
+                    self._releasing.add(task)
+                    task.add_done_callback(self._releasing.discard)
+                    continue
+
+                timeout = refresh_every
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0.0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Deferred delivery loop error: {e}")
+                await asyncio.sleep(5)
+
+    async def _claim(self, message_id: Any) -> Optional[Dict[str, Any]]:
+        """حجز ذري - worker واحد فقط يرسل كل رسالة"""
+        now = datetime.utcnow()
+        db = await get_db()
+        return await db.deferred_messages.find_one_and_update(
+            {
+                "_id": message_id,
+                "deliver_at": {"$lte": now},
+                "$or": [
+                    {"status": PENDING},
+                    {"status": CLAIMED, "claimed_at": {"$lt": now - self.claim_timeout}}
+                ]
+            },
+            {"$set": {"status": CLAIMED, "claimed_at": now, "claimed_by": self.worker_id}, "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _release(self, message_id: Any):
+        doc = await self._claim(message_id)
+        if not doc:
+            # أُرسلت من worker آخر أو تغير موعدها
+            self.stats["claim_conflicts"] += 1
+            return
+
+        try:
+            outcome = await deliver_coach_message(doc["user_data"])
+            status = outcome["status"]
+            update = {"status": status, "finished_at": datetime.utcnow(), "detail": outcome.get("detail")}
+        except Exception as e:
+            logger.error(f"Deferred delivery failed for {doc['user_data'].get('user_email')}: {e}")
+            status = FAILED
+            update = {"status": FAILED, "finished_at": datetime.utcnow(), "detail": str(e)}
+
+        self.stats[status] += 1
+        db = await get_db()
+        await db.deferred_messages.update_one({"_id": message_id, "claimed_by": self.worker_id}, {"$set": update})
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "scheduled_in_memory": len(self._scheduled),
+            "releasing": len(self._releasing),
+            "next_delivery_at": min(self._scheduled.values()).isoformat() if self._scheduled else None,
+            "running": self._loop_task is not None
+        }
+
+async def deliver_coach_message(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """توليد الرسالة (أو استخدام المولدة مسبقاً) وإرسالها للموظف في Slack"""
+    from app.ai.agent_manager import agent_manager
+    from app.services.coach_message_service import coach_message_service, default_summary
+    from app.services.kpi_service import KPIService
+    from app.services.coach_throttle import coach_throttle
+
+    user_email = user_data["user_email"]
+    if QuietMode.is_quiet_time(user_data.get("timezone")):
+        # تغيرت منطقة الموظف أو بدأت إجازة - أعد الجدولة
+        await deferred_delivery.defer(user_data)
+        return {"status": DROPPED, "detail": "rescheduled"}
+
+    stored = await coach_message_service.get_current_message(user_email)
+    if not stored and "drift" not in user_data:
+        # أُجلت من رسالة مخزنة لم تعد صالحة - نحتاج أحدث KPI للتوليد
+        performance = await KPIService().get_user_performance(user_email)
+        if "error" in performance:
+            return {"status": FAILED, "detail": performance["error"]}
+        user_data = {
+            **user_data,
+            "name": user_data.get("name") or user_email.split("@")[0],
+            "department": performance.get("department", "general"),
+            "drift": performance.get("drift", 0.0),
+            "summary": user_data.get("summary") or default_summary(performance.get("department", "general"))
+        }
+    
+    if stored and stored["performance_level"] != "excellent":
+        allowed, _ = await coach_throttle.try_reserve(user_email)
+        if not allowed:
+            return {"status": DROPPED, "detail": "throttled"}
+        message = stored["message"]
+        try:
+            await coach_throttle.record(user_email, message, stored["performance_level"])
+        except BaseException:
+            coach_throttle.release(user_email)
+            raise
+    else:
+        execution = await agent_manager.execute_agent_task(
+            "coach",
+            "generate_message",
+            user_data=user_data,
+            priority="scheduled"
+        )
+        if not execution["success"]:
+            return {"status": FAILED, "detail": execution["error"]}
+        result = execution["result"]
+        if not result["should_send"]:
+            return {"status": DROPPED, "detail": result.get("source")}
+        message = result["message"]
+
+    return await _send_slack_dm(user_email, message)
+
+async def _send_slack_dm(user_email: str, message: str) -> Dict[str, Any]:
+    if not settings.slack_bot_token:
+        return {"status": FAILED, "detail": "SLACK_BOT_TOKEN not configured"}
+
+    from slack_sdk.web.async_client import AsyncWebClient
+
+    client = AsyncWebClient(token=settings.slack_bot_token)
+    user = await client.users_lookupByEmail(email=user_email)
+    await client.chat_postMessage(channel=user["user"]["id"], text=message)
+    return {"status": DELIVERED}
+
+# مجدول مشترك لكل العملية
+deferred_delivery = DeferredDeliveryScheduler(
+    release_per_minute=settings.deferred_release_per_minute,
+    horizon_minutes=settings.deferred_load_horizon_minutes,
+    claim_timeout_minutes=settings.deferred_claim_timeout_minutes
+)
@@ -0,0 +1,203 @@
+"""إرسال تقارير المدراء والتقرير التنفيذي المجدولة وتسجيل كل تشغيل في digest_runs"""
+from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+import asyncio
+import time
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.db import get_db, JOB_RUN_RETENTION_DAYS
+from app.config import settings
+from app.services.digest_service import DigestService
+from app.integrations.emailer import EmailService
+from app.ai.metrics import LatencyHistogram
+import structlog
+
+logger = structlog.get_logger()
+
+MANAGER = "manager"
+EXECUTIVE = "executive"
+
+class DigestFanout:
+    """بناء التقارير بتوازي محدود وتسليمها للإيميل"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self.digest_service = DigestService()
+        self.email_service = EmailService()
+
+    async def run_manager_digests(self, concurrency: Optional[int] = None, lease=None,
+                                  run_key: Optional[str] = None) -> Dict[str, Any]:
+        """تقرير يومي لكل مدير لديه فريق
+
+        lease و run_key (من run_exclusive): لا يُرسل أي تقرير بعد فقدان القفل،
+        وكل مستلم يُحجز في digest_deliveries قبل الإرسال فلا يتكرر عند استلام worker آخر.
+        """
+        db = await get_db()
+        manager_ids = [manager_id for manager_id in await db.users.distinct("manager_id") if manager_id]
+        recipients = [
+            manager["email"]
+            async for manager in db.users.find({"_id": {"$in": manager_ids}}, {"email": 1})
+        ]
+
+        async def send(manager_email: str) -> Dict[str, Any]:
+            manager = await self.digest_service.load_manager_team(manager_email)
+            content = self.digest_service.render_manager_digest(manager)
+            return await self._send(
+                manager_email,
+                f"تقرير يومي - {manager_email}",
+                "تقرير يومي - فريقك",
+                content
+            )
+
+        return await self._run(MANAGER, recipients, send, concurrency, lease, run_key)
+
+    async def run_executive_digest(self, lease=None, run_key: Optional[str] = None) -> Dict[str, Any]:
+        """التقرير الأسبوعي للإدارة التنفيذية"""
+        async def send(executive_email: str) -> Dict[str, Any]:
+            rollups = await self.digest_service.kpi_service.get_department_rollups()
+            content = self.digest_service.render_executive_digest(rollups)
+            return await self._send(
+                executive_email,
+                "تقرير أسبوعي تنفيذي - سيادة الذكي",
+                "تقرير أسبوعي تنفيذي",
+                content
+            )
+
+        return await self._run(EXECUTIVE, [settings.executive_email], send, 1, lease, run_key)
+
+    async def _send(self, to: str, subject: str, title: str, content: str) -> Dict[str, Any]:
+        html_content = self.email_service.create_html_template(title, content)
+        return await self.email_service.send_email(to=to, subject=subject, body=html_content)
+
+    async def _claim(self, db, delivery_id: str, token: int) -> bool:
+        """حجز مستلم قبل الإرسال - False إذا أُرسل له في هذا التشغيل أو حجزه حائز بتوكن أحدث
+
+        الحجز الذي تركه حائز مات (sending بتوكن أقدم) يُستلم ويُعاد إرساله.
+        """
+        now = datetime.utcnow()
+        try:
+            await db.digest_deliveries.update_one(
+                {
+                    "_id": delivery_id,
+                    "status": {"$ne": "sent"},
+                    "$or": [{"token": {"$lte": token}}, {"token": {"$exists": False}}]
+                },
+                {"$set": {
+                    "status": "sending",
+                    "token": token,
+                    "claimed_at": now,
+                    "expires_at": now + timedelta(days=JOB_RUN_RETENTION_DAYS)
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _run(self, kind: str, recipients: List[str], send, concurrency: Optional[int], lease=None,
+                   run_key: Optional[str] = None) -> Dict[str, Any]:
+        db = await get_db()
+        started_at = datetime.utcnow()
+        run = await db.digest_runs.insert_one({
+            "kind": kind,
+            "status": "running",
+            "started_at": started_at,
+            "recipients": len(recipients),
+            "run_key": run_key,
+            "lease_token": lease.token if lease else None
+        })
+        # سجل التسليم لكل مستلم يحتاج توكن القفل ومفتاح التشغيل معاً
+        fenced = lease is not None and run_key is not None
+
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        latency = LatencyHistogram()
+        # تقرير لكل مستلم: الزمن والنتيجة
+        digests: List[Dict[str, Any]] = []
+        counts = {"sent": 0, "failed": 0, "skipped": 0, "already_delivered": 0}
+        start_time = time.perf_counter()
+        status = "failed"
+
+        async def deliver(recipient: str):
+            async with semaphore:
+                if lease and not lease.is_held():
+                    # worker آخر قد يكون استلم التشغيل - لا نرسل تقريراً مكرراً
+                    counts["skipped"] += 1
+                    return
+                delivery_id = f"{kind}:{run_key}:{recipient}"
+                if fenced and not await self._claim(db, delivery_id, lease.token):
+                    counts["already_delivered"] += 1
+                    return
+                digest_start = time.perf_counter()
+                try:
+                    result = await send(recipient)
+                    error = None if result["sent"] else result.get("error", "not sent")
+                except Exception as e:
+                    logger.error(f"Digest failed for {recipient}: {e}")
+                    error = str(e)
+                elapsed = time.perf_counter() - digest_start
+                latency.record(elapsed)
+                if fenced:
+                    await db.digest_deliveries.update_one(
+                        {"_id": delivery_id, "token": lease.token},
+                        {"$set": {"status": "failed" if error else "sent", "finished_at": datetime.utcnow()}}
+                    )
+
+                digest = {"recipient": recipient, "latency": round(elapsed, 3), "sent": error is None}
+                if error:
+                    counts["failed"] += 1
+                    digest["error"] = error
+                else:
+                    counts["sent"] += 1
+                digests.append(digest)
+
+        try:
+            await asyncio.gather(*(deliver(recipient) for recipient in recipients))
+            if counts["skipped"]:
+                status = "lease_lost"
+            else:
+                status = "completed" if not counts["failed"] else "completed_with_failures"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            summary = {
+                "status": status,
+                "finished_at": datetime.utcnow(),
+                "duration": round(time.perf_counter() - start_time, 3),
+                **counts,
+                "latency": latency.summary(),
+                "digests": digests
+            }
+            await db.digest_runs.update_one({"_id": run.inserted_id}, {"$set": summary})
+
+        logger.info(
+            "Digest run finished",
+            kind=kind,
+            recipients=len(recipients),
+            sent=counts["sent"],
+            failed=counts["failed"],
+            duration=summary["duration"]
+        )
+        return {"run_id": str(run.inserted_id), "kind": kind, "recipients": len(recipients), **summary}
+
+    async def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """تشغيل واحد مع زمن ونتيجة كل تقرير"""
+        if not ObjectId.is_valid(run_id):
+            return None
+        db = await get_db()
+        run = await db.digest_runs.find_one({"_id": ObjectId(run_id)})
+        if run:
+            run["_id"] = str(run["_id"])
+        return run
+
+    async def list_runs(self, kind: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """آخر التشغيلات مع مدتها وعدد الأخطاء (بدون تفاصيل كل تقرير)"""
+        db = await get_db()
+        query = {"kind": kind} if kind else {}
+        runs = await db.digest_runs.find(query, {"digests": 0}).sort("started_at", -1).limit(limit).to_list(limit)
+        for run in runs:
+            run["_id"] = str(run["_id"])
+        return runs
+
+# مشترك لكل العملية
+digest_fanout = DigestFanout(concurrency=settings.digest_concurrency)
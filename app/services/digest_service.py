@@ -1,5 +1,5 @@
 """خدمة إنشاء التقارير اليومية والأسبوعية"""
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 from app.db import get_db
 from app.services.kpi_service import KPIService
@@ -7,6 +7,9 @@ import structlog
 
 logger = structlog.get_logger()
 
+# حالات المهمة التي لم تُنجز بعد
+OPEN_TASK_STATUSES = ["open", "in_progress", "overdue"]
+
 class DigestService:
     """خدمة إنشاء التقارير"""
     
@@ -16,151 +19,163 @@ class DigestService:
     async def build_manager_digest(self, manager_email: str) -> str:
         """إنشاء تقرير يومي للمدير"""
         try:
-            db = await get_db()
-            
-            # جلب بيانات المدير
-            manager = await db.users.find_one({"email": manager_email})
-            if not manager:
-                return "المدير غير موجود"
-            
-            # جلب فريق المدير
-            team_members = []
-            async for member in db.users.find({"manager_id": manager["_id"]}):
-                team_members.append(member)
-            
-            if not team_members:
-                return f"مرحباً {manager.get('name', 'المدير')}، لا يوجد أعضاء في فريقك حالياً."
-            
-            # بناء التقرير
-            content = f"""
-            <h2>تقرير يومي - {datetime.now().strftime('%Y-%m-%d')}</h2>
-            <p>مرحباً {manager.get('name', 'المدير')}،</p>
-            <p>إليك ملخص أداء فريقك اليوم:</p>
-            
-            <h3>📊 ملخص الأداء</h3>
-            <ul>
-            """
-            
-            # إضافة بيانات كل عضو في الفريق
-            for member in team_members:
-                performance = await self.kpi_service.get_user_performance(member["email"])
-                
-                if "error" not in performance:
-                    drift = performance.get("drift", 0.0)
-                    performance_level = performance.get("performance_level", "no_data")
-                    
-                    # تحديد الرمز حسب الأداء
-                    emoji = "🟢" if performance_level == "excellent" else \
-                           "🟡" if performance_level == "good" else \
-                           "🟠" if performance_level == "needs_improvement" else "🔴"
-                    
-                    content += f"""
-                    <li>{emoji} <strong>{member.get('name', member['email'])}</strong> 
-                        - قسم {member.get('department', 'غير محدد')}
-                        - الأداء: {performance_level}
-                        - الهدف: {performance.get('target', 0)} | المحقق: {performance.get('actual', 0)}
-                    </li>
-                    """
-            
-            content += """
-            </ul>
-            
-            <h3>📋 المهام المعلقة</h3>
-            <p>راجع المهام المعلقة لفريقك في النظام.</p>
-            
-            <h3>💡 توصيات</h3>
-            <p>ركز على الأعضاء الذين يحتاجون دعم إضافي.</p>
-            """
-            
-            return content
+            # المدير وفريقه مع أحدث KPI وعدد المهام المفتوحة في استعلام واحد
+            manager = await self.load_manager_team(manager_email)
+            return self.render_manager_digest(manager)
             
         except Exception as e:
             logger.error(f"Error building manager digest: {e}")
             return f"خطأ في إنشاء التقرير: {str(e)}"
     
-    async def build_executive_digest(self) -> str:
-        """إنشاء تقرير أسبوعي للإدارة التنفيذية"""
-        try:
-            db = await get_db()
-            
-            # جلب جميع المستخدمين
-            users = []
-            async for user in db.users.find():
-                users.append(user)
-            
-            if not users:
-                return "لا يوجد مستخدمين في النظام"
-            
-            # تحليل الأداء العام
-            total_users = len(users)
-            excellent_count = 0
-            good_count = 0
-            needs_improvement_count = 0
-            critical_count = 0
-            
-            department_performance = {}
-            
-            for user in users:
-                performance = await self.kpi_service.get_user_performance(user["email"])
-                
-                if "error" not in performance:
-                    performance_level = performance.get("performance_level", "no_data")
-                    
-                    if performance_level == "excellent":
-                        excellent_count += 1
-                    elif performance_level == "good":
-                        good_count += 1
-                    elif performance_level == "needs_improvement":
-                        needs_improvement_count += 1
-                    else:
-                        critical_count += 1
-                    
-                    # تجميع حسب القسم
-                    dept = user.get("department", "غير محدد")
-                    if dept not in department_performance:
-                        department_performance[dept] = {"total": 0, "excellent": 0, "good": 0, "needs_improvement": 0, "critical": 0}
-                    
-                    department_performance[dept]["total"] += 1
-                    department_performance[dept][performance_level] += 1
-            
-            # بناء التقرير التنفيذي
-            content = f"""
-            <h2>تقرير أسبوعي تنفيذي - {datetime.now().strftime('%Y-%m-%d')}</h2>
-            
-            <h3>📈 نظرة عامة على الأداء</h3>
-            <div style="background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 10px 0;">
-                <p><strong>إجمالي الموظفين:</strong> {total_users}</p>
-                <p><strong>الأداء الممتاز:</strong> {excellent_count} ({excellent_count/total_users*100:.1f}%)</p>
-                <p><strong>الأداء الجيد:</strong> {good_count} ({good_count/total_users*100:.1f}%)</p>
-                <p><strong>يحتاج تحسين:</strong> {needs_improvement_count} ({needs_improvement_count/total_users*100:.1f}%)</p>
-                <p><strong>حرج:</strong> {critical_count} ({critical_count/total_users*100:.1f}%)</p>
-            </div>
-            
-            <h3>🏢 أداء الأقسام</h3>
+    def render_manager_digest(self, manager: Optional[Dict[str, Any]]) -> str:
+        """محتوى تقرير المدير من نتيجة load_manager_team"""
+        if not manager:
+            return "المدير غير موجود"
+        
+        team_members = manager["team"]
+        if not team_members:
+            return f"مرحباً {manager.get('name', 'المدير')}، لا يوجد أعضاء في فريقك حالياً."
+        
+        # بناء التقرير
+        content = f"""
+        <h2>تقرير يومي - {datetime.now().strftime('%Y-%m-%d')}</h2>
+        <p>مرحباً {manager.get('name', 'المدير')}،</p>
+        <p>إليك ملخص أداء فريقك اليوم:</p>
+        
+        <h3>📊 ملخص الأداء</h3>
+        <ul>
+        """
+        
+        # إضافة بيانات كل عضو في الفريق
+        for member in team_members:
+            performance_level = member["performance_level"]
+            latest_kpi = member.get("latest_kpi") or {}
+            
+            # تحديد الرمز حسب الأداء
+            emoji = "🟢" if performance_level == "excellent" else \
+                   "🟡" if performance_level == "good" else \
+                   "🟠" if performance_level == "needs_improvement" else "🔴"
+            
+            content += f"""
+            <li>{emoji} <strong>{member.get('name', member['email'])}</strong> 
+                - قسم {member.get('department', 'غير محدد')}
+                - الأداء: {performance_level}
+                - الهدف: {latest_kpi.get('target', 0)} | المحقق: {latest_kpi.get('actual', 0)}
+                - المهام المفتوحة: {member['open_tasks']}
+            </li>
             """
-            
-            for dept, stats in department_performance.items():
-                content += f"""
-                <h4>{dept}</h4>
-                <ul>
-                    <li>إجمالي الموظفين: {stats['total']}</li>
-                    <li>ممتاز: {stats['excellent']}</li>
-                    <li>جيد: {stats['good']}</li>
-                    <li>يحتاج تحسين: {stats['needs_improvement']}</li>
-                    <li>حرج: {stats['critical']}</li>
-                </ul>
-                """
-            
-            content += """
-            <h3>🎯 توصيات إستراتيجية</h3>
+        
+        open_tasks = sum(member["open_tasks"] for member in team_members)
+        content += f"""
+        </ul>
+        
+        <h3>📋 المهام المعلقة</h3>
+        <p>لدى فريقك {open_tasks} مهمة مفتوحة - راجعها في النظام.</p>
+        
+        <h3>💡 توصيات</h3>
+        <p>ركز على الأعضاء الذين يحتاجون دعم إضافي.</p>
+        """
+        
+        return content
+    
+    def render_executive_digest(self, rollups: List[Dict[str, Any]]) -> str:
+        """محتوى التقرير التنفيذي من نتيجة get_department_rollups"""
+        if not rollups:
+            return "لا يوجد مستخدمين في النظام"
+        
+        # بدون بيانات يُحسب ضمن الحرج
+        department_performance = {
+            rollup["department"]: {**rollup, "critical": rollup["critical"] + rollup["no_data"]}
+            for rollup in rollups
+        }
+        
+        # تحليل الأداء العام
+        total_users = sum(stats["total"] for stats in department_performance.values())
+        excellent_count = sum(stats["excellent"] for stats in department_performance.values())
+        good_count = sum(stats["good"] for stats in department_performance.values())
+        needs_improvement_count = sum(stats["needs_improvement"] for stats in department_performance.values())
+        critical_count = sum(stats["critical"] for stats in department_performance.values())
+        
+        # بناء التقرير التنفيذي
+        content = f"""
+        <h2>تقرير أسبوعي تنفيذي - {datetime.now().strftime('%Y-%m-%d')}</h2>
+        
+        <h3>📈 نظرة عامة على الأداء</h3>
+        <div style="background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 10px 0;">
+            <p><strong>إجمالي الموظفين:</strong> {total_users}</p>
+            <p><strong>الأداء الممتاز:</strong> {excellent_count} ({excellent_count/total_users*100:.1f}%)</p>
+            <p><strong>الأداء الجيد:</strong> {good_count} ({good_count/total_users*100:.1f}%)</p>
+            <p><strong>يحتاج تحسين:</strong> {needs_improvement_count} ({needs_improvement_count/total_users*100:.1f}%)</p>
+            <p><strong>حرج:</strong> {critical_count} ({critical_count/total_users*100:.1f}%)</p>
+        </div>
+        
+        <h3>🏢 أداء الأقسام</h3>
+        """
+        
+        for dept, stats in department_performance.items():
+            content += f"""
+            <h4>{dept}</h4>
             <ul>
-                <li>ركز على الأقسام ذات الأداء الضعيف</li>
-                <li>استثمر في تطوير الموظفين المتميزين</li>
-                <li>ضع خطط تحسين للأقسام الحرجة</li>
+                <li>إجمالي الموظفين: {stats['total']}</li>
+                <li>ممتاز: {stats['excellent']}</li>
+                <li>جيد: {stats['good']}</li>
+                <li>يحتاج تحسين: {stats['needs_improvement']}</li>
+                <li>حرج: {stats['critical']}</li>
             </ul>
             """
-            
-            return content
+        
+        content += """
+        <h3>🎯 توصيات إستراتيجية</h3>
+        <ul>
+            <li>ركز على الأقسام ذات الأداء الضعيف</li>
+            <li>استثمر في تطوير الموظفين المتميزين</li>
+            <li>ضع خطط تحسين للأقسام الحرجة</li>
+        </ul>
+        """
+        
+        return content
+    
+    async def load_manager_team(self, manager_email: str) -> Optional[Dict[str, Any]]:
+        """المدير مع team: أحدث KPI (من لقطة الأداء) ومستوى الأداء وعدد المهام المفتوحة لكل عضو"""
+        db = await get_db()
+        
+        pipeline = [
+            {"$match": {"email": manager_email}},
+            {"$limit": 1},
+            {"$project": {"name": 1, "email": 1}},
+            {"$lookup": {
+                "from": "users",
+                "localField": "_id",
+                "foreignField": "manager_id",
+                "pipeline": [
+                    {"$project": {"name": 1, "email": 1, "department": 1}},
+                    *self.kpi_service.snapshot_kpi_stages(),
+                    {"$lookup": {
+                        "from": "tasks",
+                        "localField": "_id",
+                        "foreignField": "assignee_user_id",
+                        "pipeline": [
+                            {"$match": {"status": {"$in": OPEN_TASK_STATUSES}}},
+                            {"$count": "count"}
+                        ],
+                        "as": "open_tasks"
+                    }},
+                    {"$set": {"open_tasks": {"$ifNull": [{"$first": "$open_tasks.count"}, 0]}}}
+                ],
+                "as": "team"
+            }}
+        ]
+        
+        async for manager in db.users.aggregate(pipeline):
+            return manager
+        return None
+    
+    async def build_executive_digest(self) -> str:
+        """إنشاء تقرير أسبوعي للإدارة التنفيذية"""
+        try:
+            # أداء الأقسام محسوباً في قاعدة البيانات في طلب واحد
+            rollups = await self.kpi_service.get_department_rollups()
+            return self.render_executive_digest(rollups)
             
         except Exception as e:
             logger.error(f"Error building executive digest: {e}")
@@ -1,11 +1,94 @@
 """خدمة إدارة KPIs وحساب الـ drift"""
-from typing import Optional
+from typing import Optional, List, Dict, Tuple, AsyncIterator
+from datetime import datetime
+import asyncio
+import numpy as np
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from app.db import get_db
-from app.models import KPI, User
+from app.schemas import MONTH_PATTERN
 import structlog
 
 logger = structlog.get_logger()
 
+# حدود مستويات الأداء حسب الـ drift (الأعلى = حرج)
+PERFORMANCE_LEVELS = (
+    (0.15, "excellent"),
+    (0.25, "good"),
+    (0.35, "needs_improvement")
+)
+
+def performance_level_expr(drift_expr) -> dict:
+    """نفس _get_performance_level كتعبير aggregation"""
+    return {"$switch": {
+        "branches": [{"case": {"$lt": [drift_expr, limit]}, "then": level} for limit, level in PERFORMANCE_LEVELS],
+        "default": "critical"
+    }}
+
+def _month_label(month_index: int) -> str:
+    """رقم الشهر (year * 12 + month - 1) إلى YYYY-MM"""
+    return f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+
+def _to_json(values: np.ndarray) -> list:
+    """NaN (شهر بدون KPI) يصبح null"""
+    return np.where(np.isnan(values), None, np.round(values, 4)).tolist()
+
+def compute_drift_trends(user_positions: np.ndarray, month_positions: np.ndarray, targets: np.ndarray,
+                         actuals: np.ndarray, n_users: int, n_months: int, window: int) -> Dict[str, np.ndarray]:
+    """drift الشهري والفرق بين الأشهر والمتوسط المتحرك والميل لكل موظف - بدون حلقات Python
+
+    كل المصفوفات بشكل (n_users, n_months) والشهر بدون KPI قيمته NaN.
+    """
+    drift_values = np.where(
+        targets > 0,
+        np.maximum(0.0, (targets - actuals) / np.where(targets > 0, targets, 1.0)),
+        0.0
+    )
+    drift = np.full((n_users, n_months), np.nan)
+    drift[user_positions, month_positions] = drift_values
+    
+    present = ~np.isnan(drift)
+    filled = np.where(present, drift, 0.0)
+    
+    # الفرق عن الشهر السابق (NaN إذا غاب أحدهما)
+    delta = np.full_like(drift, np.nan)
+    delta[:, 1:] = drift[:, 1:] - drift[:, :-1]
+    
+    # متوسط متحرك على آخر window أشهر تقويمية (الأشهر بدون KPI لا تدخل في المتوسط) عبر المجاميع التراكمية
+    padded_sum = np.concatenate([np.zeros((n_users, 1)), np.cumsum(filled, axis=1)], axis=1)
+    padded_count = np.concatenate([np.zeros((n_users, 1)), np.cumsum(present, axis=1)], axis=1)
+    starts = np.maximum(np.arange(1, n_months + 1) - window, 0)
+    window_sum = padded_sum[:, 1:] - padded_sum[:, starts]
+    window_count = padded_count[:, 1:] - padded_count[:, starts]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rolling_avg = np.where(window_count > 0, window_sum / window_count, np.nan)
+    
+    # ميل الانحدار الخطي (drift لكل شهر) على الأشهر الموجودة فقط
+    x = np.arange(n_months, dtype=np.float64)
+    n = present.sum(axis=1)
+    sum_x = (present * x).sum(axis=1)
+    sum_y = filled.sum(axis=1)
+    sum_xy = (filled * x).sum(axis=1)
+    sum_xx = (present * x * x).sum(axis=1)
+    denominator = n * sum_xx - sum_x ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where((n >= 2) & (denominator > 0), (n * sum_xy - sum_x * sum_y) / denominator, np.nan)
+    
+    month_count = present.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        company_drift = np.where(month_count > 0, filled.sum(axis=0) / month_count, np.nan)
+    
+    return {
+        "drift": drift,
+        "delta": delta,
+        "rolling_avg": rolling_avg,
+        "slope": slope,
+        "company_drift": company_drift
+    }
+
+# حقول الموظف المنسوخة في لقطة الأداء
+SNAPSHOT_USER_FIELDS = {"email": 1, "name": 1, "department": 1, "timezone": 1}
+
 class KPIService:
     """خدمة إدارة KPIs"""
     
@@ -45,118 +128,561 @@ class KPIService:
             return 0.0
     
     async def upsert_kpi(self, user_email: str, month: str, target: int, actual: int) -> dict:
-        """تحديث أو إنشاء KPI جديد"""
+        """تحديث أو إنشاء KPI جديد - عمليتان ذريتان على قاعدة البيانات"""
         try:
             db = await get_db()
             
-            # البحث عن المستخدم
-            user = await db.users.find_one({"email": user_email})
-            if not user:
-                # إنشاء مستخدم جديد إذا لم يوجد
-                user = User(
-                    email=user_email,
-                    name=user_email.split("@")[0],
-                    role="employee",
-                    department="general"
-                )
-                await db.users.insert_one(user.dict(by_alias=True))
-            
-            # البحث عن KPI موجود
-            existing_kpi = await db.kpis.find_one({
-                "user_id": user["_id"],
-                "month": month
-            })
+            # جلب المستخدم أو إنشاؤه في نفس العملية
+            user = await db.users.find_one_and_update(
+                {"email": user_email},
+                {"$setOnInsert": {
+                    "email": user_email,
+                    "name": user_email.split("@")[0],
+                    "role": "employee",
+                    "department": "general",
+                    "manager_id": None
+                }},
+                projection=SNAPSHOT_USER_FIELDS,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            department = user.get("department", "general")
             
-            # حساب الـ drift
+            # تحديث أو إنشاء الـ KPI مع حساب الـ drift داخل قاعدة البيانات
+            kpi_update = self._upsert_kpi_doc(db, user["_id"], department, month, target, actual)
+            # الرسالة المولدة مسبقاً لم تعد تعكس الأرقام الحالية
+            stale_update = db.coach_messages.update_one(
+                {"user_email": user_email},
+                {"$set": {"stale": True}}
+            )
             drift = max(0.0, (target - actual) / target) if target > 0 else 0.0
-            
-            if existing_kpi:
-                # تحديث موجود
-                await db.kpis.update_one(
-                    {"_id": existing_kpi["_id"]},
-                    {
-                        "$set": {
-                            "target": target,
-                            "actual": actual,
-                            "drift": drift
-                        }
-                    }
-                )
-                kpi_id = existing_kpi["_id"]
-            else:
-                # إنشاء جديد
-                kpi = KPI(
-                    user_id=user["_id"],
-                    department=user.get("department", "general"),
-                    month=month,
-                    target=target,
-                    actual=actual,
-                    drift=drift
-                )
-                result = await db.kpis.insert_one(kpi.dict(by_alias=True))
-                kpi_id = result.inserted_id
+            snapshot_update = self._update_snapshot(db, user, month, target, actual, drift)
+            kpi_doc, _, _ = await asyncio.gather(kpi_update, stale_update, snapshot_update)
             
             return {
-                "id": str(kpi_id),
+                "id": str(kpi_doc["_id"]),
                 "user_email": user_email,
-                "department": user.get("department", "general"),
+                "department": kpi_doc.get("department", department),
                 "month": month,
                 "target": target,
                 "actual": actual,
-                "drift": drift
+                "drift": kpi_doc["drift"]
             }
             
         except Exception as e:
             logger.error(f"Error upserting KPI: {e}")
             raise
     
-    async def get_user_performance(self, user_email: str) -> dict:
-        """جلب أداء المستخدم"""
+    @staticmethod
+    async def _upsert_kpi_doc(db, user_id, department: str, month: str, target: int, actual: int) -> dict:
+        """upsert ذري على (user_id, month) - الفهرس الفريد يمنع التكرار مع الكتابة المتزامنة"""
+        update_pipeline = [
+            {"$set": {
+                "department": {"$ifNull": ["$department", {"$literal": department}]},
+                "target": {"$literal": target},
+                "actual": {"$literal": actual}
+            }},
+            # drift = max(0, (target - actual) / target)
+            {"$set": {
+                "drift": {"$cond": [
+                    {"$gt": ["$target", 0]},
+                    {"$max": [0.0, {"$divide": [{"$subtract": ["$target", "$actual"]}, "$target"]}]},
+                    0.0
+                ]}
+            }}
+        ]
+        
         try:
-            db = await get_db()
-            
-            user = await db.users.find_one({"email": user_email})
-            if not user:
-                return {"error": "User not found"}
-            
-            # جلب أحدث KPI
-            kpi_doc = await db.kpis.find_one(
-                {"user_id": user["_id"]},
-                sort=[("month", -1)]
+            return await db.kpis.find_one_and_update(
+                {"user_id": user_id, "month": month},
+                update_pipeline,
+                projection={"_id": 1, "department": 1, "drift": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
             )
-            
-            if not kpi_doc:
-                return {
-                    "user_email": user_email,
-                    "department": user.get("department", "general"),
-                    "drift": 0.0,
-                    "performance_level": "no_data"
-                }
-            
-            drift = kpi_doc.get("drift", 0.0)
-            performance_level = self._get_performance_level(drift)
-            
-            return {
-                "user_email": user_email,
+        except DuplicateKeyError:
+            # كاتب متزامن أنشأ المستند أولاً - التحديث الآن يجده
+            return await db.kpis.find_one_and_update(
+                {"user_id": user_id, "month": month},
+                update_pipeline,
+                projection={"_id": 1, "department": 1, "drift": 1},
+                return_document=ReturnDocument.AFTER
+            )
+    
+    def _snapshot_update(self, user: dict, month: str, target: int, actual: int, drift: float) -> Tuple[dict, dict]:
+        """تحديث لقطة الأداء فقط إذا كان الشهر أحدث من المخزن أو مساوياً له
+
+        إذا كانت اللقطة لشهر أحدث يفشل الـ upsert بـ DuplicateKeyError ويُتجاهل.
+        """
+        return (
+            {"user_email": user["email"], "month": {"$not": {"$gt": month}}},
+            {"$set": {
+                "user_id": user["_id"],
+                "name": user.get("name", user["email"].split("@")[0]),
                 "department": user.get("department", "general"),
+                "timezone": user.get("timezone"),
+                "month": month,
+                "target": target,
+                "actual": actual,
                 "drift": drift,
-                "performance_level": performance_level,
-                "target": kpi_doc.get("target", 0),
-                "actual": kpi_doc.get("actual", 0),
-                "month": kpi_doc.get("month", "")
-            }
+                "performance_level": self._get_performance_level(drift),
+                "updated_at": datetime.utcnow()
+            }}
+        )
+    
+    async def _update_snapshot(self, db, user: dict, month: str, target: int, actual: int, drift: float):
+        try:
+            await db.user_performance.update_one(
+                *self._snapshot_update(user, month, target, actual, drift),
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+    
+    async def bulk_upsert_kpis(self, rows: AsyncIterator[dict], batch_size: int) -> AsyncIterator[dict]:
+        """تحميل KPIs على دفعات - يرجع نتيجة كل صف ثم ملخصاً
+
+        الذاكرة محدودة بحجم الدفعة (وخريطة الموظفين) مهما كان حجم الملف.
+        """
+        db = await get_db()
+        users: Dict[str, dict] = {}
+        totals = {"rows": 0, "inserted": 0, "updated": 0, "failed": 0}
+        
+        batch = []
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                async for result in self._write_kpi_batch(db, batch, users, totals):
+                    yield result
+                batch = []
+        
+        if batch:
+            async for result in self._write_kpi_batch(db, batch, users, totals):
+                yield result
+        
+        yield {"summary": True, **totals}
+    
+    async def _write_kpi_batch(self, db, batch: List[dict], users: Dict[str, dict], totals: dict) -> AsyncIterator[dict]:
+        """كتابة دفعة واحدة وتحديث الإجماليات"""
+        totals["rows"] += len(batch)
+        results = []
+        valid = []
+        for row in batch:
+            if "error" in row:
+                results.append({"row": row["row"], "user_email": row.get("user_email"), "status": "error", "error": row["error"]})
+            else:
+                valid.append(row)
+        
+        if valid:
+            results.extend(await self._write_valid_rows(db, valid, users))
+        
+        # النتائج بنفس ترتيب صفوف الملف
+        results.sort(key=lambda result: result["row"])
+        for result in results:
+            totals["failed" if result["status"] == "error" else result["status"]] += 1
+            yield result
+    
+    async def _write_valid_rows(self, db, valid: List[dict], users: Dict[str, dict]) -> List[dict]:
+        """استعلام $in للموظفين، drift متجه، ثم bulk_write غير مرتب"""
+        await self._resolve_users(db, {row["user_email"] for row in valid}, users)
+        
+        # drift = max(0, (target - actual) / target) لكل الدفعة مرة واحدة
+        targets = np.fromiter((row["target"] for row in valid), dtype=np.float64, count=len(valid))
+        actuals = np.fromiter((row["actual"] for row in valid), dtype=np.float64, count=len(valid))
+        safe_targets = np.where(targets > 0, targets, 1.0)
+        drifts = np.where(targets > 0, np.maximum(0.0, (targets - actuals) / safe_targets), 0.0)
+        
+        operations = []
+        for row, drift in zip(valid, drifts.tolist()):
+            row["drift"] = drift
+            user = users[row["user_email"]]
+            operations.append(UpdateOne(
+                {"user_id": user["_id"], "month": row["month"]},
+                {
+                    "$set": {"target": row["target"], "actual": row["actual"], "drift": drift},
+                    "$setOnInsert": {"department": user.get("department", "general")}
+                },
+                upsert=True
+            ))
+        
+        errors = {}
+        upserted = set()
+        try:
+            result = await db.kpis.bulk_write(operations, ordered=False)
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            details = e.details
+            upserted = {item["index"] for item in details.get("upserted", [])}
+            errors = {item["index"]: item.get("errmsg", "write failed") for item in details.get("writeErrors", [])}
+        
+        snapshot_operations = [
+            UpdateOne(
+                *self._snapshot_update(users[row["user_email"]], row["month"], row["target"], row["actual"], row["drift"]),
+                upsert=True
+            )
+            for index, row in enumerate(valid)
+            if index not in errors
+        ]
+        # الرسائل المولدة مسبقاً لم تعد تعكس الأرقام الحالية
+        stale_update = db.coach_messages.update_many(
+            {"user_email": {"$in": list({row["user_email"] for row in valid})}},
+            {"$set": {"stale": True}}
+        )
+        await asyncio.gather(stale_update, self._write_snapshots(db, snapshot_operations))
+        
+        results = []
+        for index, row in enumerate(valid):
+            if index in errors:
+                results.append({"row": row["row"], "user_email": row["user_email"], "status": "error", "error": errors[index]})
+                continue
+            
+            results.append({
+                "row": row["row"],
+                "user_email": row["user_email"],
+                "month": row["month"],
+                "status": "inserted" if index in upserted else "updated",
+                "drift": round(row["drift"], 4)
+            })
+        
+        return results
+    
+    @staticmethod
+    async def _write_snapshots(db, operations: List[UpdateOne]):
+        if not operations:
+            return
+        try:
+            await db.user_performance.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # تكرار المفتاح = اللقطة لشهر أحدث، غير ذلك خطأ حقيقي
+            write_errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            if write_errors:
+                logger.error(f"Error updating performance snapshots: {write_errors[0].get('errmsg')}")
+    
+    @staticmethod
+    async def _resolve_users(db, emails: set, users: Dict[str, dict]):
+        """جلب الموظفين غير المعروفين باستعلام $in وإنشاء الناقصين دفعة واحدة"""
+        missing = [email for email in emails if email not in users]
+        if not missing:
+            return
+        
+        async for user in db.users.find({"email": {"$in": missing}}, SNAPSHOT_USER_FIELDS):
+            users[user["email"]] = user
+        
+        to_create = [email for email in missing if email not in users]
+        if not to_create:
+            return
+        
+        await db.users.bulk_write([
+            UpdateOne(
+                {"email": email},
+                {"$setOnInsert": {
+                    "email": email,
+                    "name": email.split("@")[0],
+                    "role": "employee",
+                    "department": "general",
+                    "manager_id": None
+                }},
+                upsert=True
+            )
+            for email in to_create
+        ], ordered=False)
+        
+        async for user in db.users.find({"email": {"$in": to_create}}, SNAPSHOT_USER_FIELDS):
+            users[user["email"]] = user
+    
+    async def get_user_performance(self, user_email: str) -> dict:
+        """جلب أداء المستخدم من لقطة الأداء"""
+        try:
+            db = await get_db()
+            performances = await self._load_performances(db, {"email": user_email})
+            if not performances:
+                return {"error": "User not found"}
+            return performances[0]
             
         except Exception as e:
             logger.error(f"Error getting user performance: {e}")
             return {"error": str(e)}
     
+    async def get_users_performance(self, user_emails: Optional[List[str]] = None, department: Optional[str] = None) -> List[dict]:
+        """جلب أداء مجموعة مستخدمين من لقطات الأداء في استعلام واحد"""
+        db = await get_db()
+        
+        match = {}
+        if user_emails:
+            match["email"] = {"$in": user_emails}
+        if department:
+            match["department"] = department
+        return await self._load_performances(db, match)
+    
+    async def _load_performances(self, db, match: dict) -> List[dict]:
+        """الموظفون المطابقون مع لقطاتهم ($lookup بالفهرس الفريد)
+
+        الاسم والقسم والمنطقة الزمنية من users دائماً (قد تتغير بعد كتابة اللقطة)،
+        والأرقام من اللقطة. الموظف بدون لقطة تُبنى له مرة واحدة.
+        """
+        pipeline = [
+            {"$match": match},
+            {"$project": SNAPSHOT_USER_FIELDS},
+            {"$lookup": {
+                "from": "user_performance",
+                "localField": "email",
+                "foreignField": "user_email",
+                "as": "snapshot"
+            }}
+        ]
+        users = await db.users.aggregate(pipeline).to_list(None)
+        
+        snapshots = {user["email"]: user["snapshot"][0] for user in users if user["snapshot"]}
+        missing = [user for user in users if user["email"] not in snapshots]
+        if missing:
+            # موظفون بدون لقطة (أُنشئوا خارج مسار الـ KPIs)
+            await self.rebuild_performance_snapshots({"_id": {"$in": [user["_id"] for user in missing]}})
+            async for snapshot in db.user_performance.find({"user_email": {"$in": [user["email"] for user in missing]}}):
+                snapshots[snapshot["user_email"]] = snapshot
+        
+        return [
+            self._performance_from_snapshot({
+                **snapshots.get(user["email"], {}),
+                "user_email": user["email"],
+                "name": user.get("name"),
+                "department": user.get("department") or "general",
+                "timezone": user.get("timezone")
+            })
+            for user in users
+        ]
+    
+    async def ensure_performance_snapshots(self):
+        """بناء اللقطات لكل الموظفين عند أول تشغيل بعد إضافة user_performance"""
+        db = await get_db()
+        if await db.user_performance.estimated_document_count() > 0:
+            return
+        logger.info("Building user_performance snapshots from kpis")
+        await self.rebuild_performance_snapshots({})
+    
+    @staticmethod
+    def latest_kpi_stages() -> List[dict]:
+        """مراحل aggregation على users: أحدث KPI لكل موظف مع drift و performance_level
+
+        تضيف latest_kpi (أو null) و drift و performance_level (no_data بدون KPI).
+        """
+        return [
+            {"$lookup": {
+                "from": "kpis",
+                "localField": "_id",
+                "foreignField": "user_id",
+                "pipeline": [
+                    {"$sort": {"month": -1}},
+                    {"$limit": 1},
+                    {"$project": {"_id": 0, "month": 1, "target": 1, "actual": 1, "drift": 1}}
+                ],
+                "as": "latest_kpi"
+            }},
+            {"$set": {"latest_kpi": {"$arrayElemAt": ["$latest_kpi", 0]}}},
+            {"$set": {"drift": {"$ifNull": ["$latest_kpi.drift", 0.0]}}},
+            {"$set": {"performance_level": {"$cond": [
+                {"$ifNull": ["$latest_kpi", False]},
+                performance_level_expr("$drift"),
+                "no_data"
+            ]}}}
+        ]
+    
+    @staticmethod
+    def snapshot_kpi_stages() -> List[dict]:
+        """نفس حقول latest_kpi_stages لكن من لقطة user_performance (بالفهرس الفريد على user_email)
+
+        تحتاج email في المستند. اللقطة تُكتب مع كل KPI وتُبنى لكل الموظفين عند بدء التشغيل،
+        فالموظف بدون لقطة أو بلقطة بلا شهر ليس لديه KPI (no_data).
+        """
+        return [
+            {"$lookup": {
+                "from": "user_performance",
+                "localField": "email",
+                "foreignField": "user_email",
+                "pipeline": [
+                    {"$match": {"month": {"$ne": None}}},
+                    {"$project": {"_id": 0, "month": 1, "target": 1, "actual": 1, "drift": 1}}
+                ],
+                "as": "latest_kpi"
+            }},
+            {"$set": {"latest_kpi": {"$arrayElemAt": ["$latest_kpi", 0]}}},
+            {"$set": {"drift": {"$ifNull": ["$latest_kpi.drift", 0.0]}}},
+            {"$set": {"performance_level": {"$cond": [
+                {"$ifNull": ["$latest_kpi", False]},
+                performance_level_expr("$drift"),
+                "no_data"
+            ]}}}
+        ]
+    
+    @staticmethod
+    def department_rollup_stages() -> List[dict]:
+        """تجميع الموظفين حسب القسم وعدّ كل مستوى أداء - بعد snapshot_kpi_stages"""
+        levels = [level for _, level in PERFORMANCE_LEVELS] + ["critical", "no_data"]
+        return [
+            {"$group": {
+                "_id": {"$ifNull": ["$department", "general"]},
+                "total": {"$sum": 1},
+                **{
+                    level: {"$sum": {"$cond": [{"$eq": ["$performance_level", level]}, 1, 0]}}
+                    for level in levels
+                },
+                # متوسط الـ drift لمن لديهم KPI فقط
+                "avg_drift": {"$avg": {"$cond": [{"$ifNull": ["$latest_kpi", False]}, "$drift", None]}}
+            }},
+            {"$project": {
+                "_id": 0,
+                "department": "$_id",
+                "total": 1,
+                **{level: 1 for level in levels},
+                "avg_drift": {"$round": [{"$ifNull": ["$avg_drift", 0.0]}, 4]}
+            }},
+            {"$sort": {"department": 1}}
+        ]
+    
+    async def get_department_rollups(self, department: Optional[str] = None) -> List[dict]:
+        """أداء الأقسام محسوباً في قاعدة البيانات في طلب واحد"""
+        db = await get_db()
+        
+        match = {"department": department} if department else {}
+        pipeline = [
+            {"$match": match},
+            {"$project": {"email": 1, "department": 1}},
+            *self.snapshot_kpi_stages(),
+            *self.department_rollup_stages()
+        ]
+        return await db.users.aggregate(pipeline).to_list(None)
+    
+    async def rebuild_performance_snapshots(self, match: dict):
+        """بناء لقطات الأداء من أحدث KPI داخل قاعدة البيانات ($merge) للموظفين المطابقين"""
+        db = await get_db()
+        
+        pipeline = [
+            {"$match": match},
+            *self.latest_kpi_stages(),
+            {"$project": {
+                "_id": 0,
+                "user_email": "$email",
+                "user_id": "$_id",
+                "name": 1,
+                "department": {"$ifNull": ["$department", "general"]},
+                "timezone": 1,
+                "month": "$latest_kpi.month",
+                "target": "$latest_kpi.target",
+                "actual": "$latest_kpi.actual",
+                "drift": 1,
+                "performance_level": 1,
+                "updated_at": "$$NOW"
+            }},
+            # كتابة KPI متزامنة أحدث من هذه القراءة تبقى كما هي
+            {"$merge": {
+                "into": "user_performance",
+                "on": "user_email",
+                "whenMatched": "keepExisting",
+                "whenNotMatched": "insert"
+            }}
+        ]
+        
+        async for _ in db.users.aggregate(pipeline):
+            pass
+    
+    async def get_drift_trends(self, department: Optional[str] = None, months: int = 12, window: int = 3) -> dict:
+        """اتجاه الـ drift لكل موظف عبر آخر months شهر - بيانات عمودية (عمود لكل مقياس)"""
+        db = await get_db()
+        
+        current = datetime.utcnow()
+        current_index = current.year * 12 + current.month - 1
+        first_index = current_index - months + 1
+        # صفوف قديمة بصيغة شهر غير صحيحة (قبل التحقق في KPIUpsert) تُستبعد
+        query = {"month": {
+            "$gte": _month_label(first_index),
+            "$lte": _month_label(current_index),
+            "$regex": MONTH_PATTERN.pattern
+        }}
+        if department:
+            query["department"] = department
+        
+        # استعلام واحد بالحقول اللازمة فقط - الترتيب والتجميع في NumPy
+        docs = await db.kpis.find(
+            query,
+            {"_id": 0, "user_id": 1, "month": 1, "target": 1, "actual": 1}
+        ).to_list(None)
+        
+        month_labels = [_month_label(index) for index in range(first_index, current_index + 1)]
+        month_positions = np.fromiter(
+            ((int(doc["month"][:4]) * 12 + int(doc["month"][5:7]) - 1) for doc in docs),
+            dtype=np.int64,
+            count=len(docs)
+        ) - first_index
+        # أشهر خارج النافذة تُستبعد قبل تحديد الموظفين حتى لا يظهر موظف بلا بيانات
+        in_range = (month_positions >= 0) & (month_positions < months)
+        docs = [doc for doc, keep in zip(docs, in_range.tolist()) if keep]
+        month_positions = month_positions[in_range]
+        if not docs:
+            return {
+                "months": month_labels,
+                "window": window,
+                "users": [],
+                "drift": [],
+                "delta": [],
+                "rolling_avg": [],
+                "slope": [],
+                "company": {"drift": [None] * months}
+            }
+        
+        count = len(docs)
+        user_ids, user_positions = np.unique(
+            np.array([str(doc["user_id"]) for doc in docs]),
+            return_inverse=True
+        )
+        targets = np.fromiter((doc.get("target", 0) for doc in docs), dtype=np.float64, count=count)
+        actuals = np.fromiter((doc.get("actual", 0) for doc in docs), dtype=np.float64, count=count)
+        
+        trends = compute_drift_trends(
+            user_positions,
+            month_positions,
+            targets,
+            actuals,
+            n_users=len(user_ids),
+            n_months=months,
+            window=window
+        )
+        
+        emails = {}
+        object_ids = list({doc["user_id"] for doc in docs})
+        async for user in db.users.find({"_id": {"$in": object_ids}}, {"email": 1}):
+            emails[str(user["_id"])] = user["email"]
+        
+        return {
+            "months": month_labels,
+            "window": window,
+            "users": [emails.get(user_id, user_id) for user_id in user_ids.tolist()],
+            "drift": _to_json(trends["drift"]),
+            "delta": _to_json(trends["delta"]),
+            "rolling_avg": _to_json(trends["rolling_avg"]),
+            "slope": _to_json(trends["slope"]),
+            "company": {"drift": _to_json(trends["company_drift"])}
+        }
+    
+    def _performance_from_snapshot(self, snapshot: dict) -> dict:
+        """تحويل لقطة الأداء لنفس شكل get_user_performance"""
+        performance = {
+            "user_email": snapshot["user_email"],
+            "name": snapshot.get("name") or snapshot["user_email"].split("@")[0],
+            "department": snapshot.get("department", "general"),
+            "timezone": snapshot.get("timezone"),
+            "drift": snapshot.get("drift", 0.0),
+            "performance_level": snapshot.get("performance_level", "no_data")
+        }
+        if performance["performance_level"] != "no_data":
+            performance.update({
+                "target": snapshot.get("target", 0),
+                "actual": snapshot.get("actual", 0),
+                "month": snapshot.get("month", "")
+            })
+        return performance
+    
     def _get_performance_level(self, drift: float) -> str:
         """تحديد مستوى الأداء بناءً على الـ drift"""
-        if drift < 0.15:
-            return "excellent"
-        elif drift < 0.25:
-            return "good"
-        elif drift < 0.35:
-            return "needs_improvement"
-        else:
-            return "critical"
+        for limit, level in PERFORMANCE_LEVELS:
+            if drift < limit:
+                return level
+        return "critical"
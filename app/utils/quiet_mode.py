@@ -1,56 +1,97 @@
 """نظام Quiet Mode - منع الإزعاج خارج ساعات العمل"""
-from datetime import datetime
+from typing import Optional
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from app.config import settings
 import structlog
 
 logger = structlog.get_logger()
 
 class QuietMode:
-    """إدارة الوضع الصامت"""
-    
+    """إدارة الوضع الصامت - الوقت يُقيّم بتوقيت الموظف (أو TIMEZONE الافتراضي)"""
+
+    # أقل مدة بين رسالتين لنفس الموظف
+    MESSAGE_INTERVAL_HOURS = 4
+
+    # ساعات العمل ونهاية الأسبوع (الخميس=3, الجمعة=4)
+    WORK_START_HOUR = 9
+    WORK_END_HOUR = 18
+    WEEKEND_DAYS = (3, 4)
+
     @staticmethod
-    def is_quiet_time() -> bool:
+    def get_zone(timezone: Optional[str] = None) -> ZoneInfo:
+        """المنطقة الزمنية للموظف مع الرجوع للإعداد العام عند عدم صحتها"""
+        try:
+            return ZoneInfo(timezone or settings.timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning(f"Unknown timezone {timezone}, using {settings.timezone}")
+            return ZoneInfo(settings.timezone)
+
+    @staticmethod
+    def local_now(timezone: Optional[str] = None) -> datetime:
+        return datetime.now(QuietMode.get_zone(timezone))
+
+    @staticmethod
+    def is_quiet_time(timezone: Optional[str] = None) -> bool:
         """التحقق من كون الوقت حالياً ضمن Quiet Mode"""
-        now = datetime.now()
-        
+        return QuietMode._is_quiet_at(QuietMode.local_now(timezone))
+
+    @staticmethod
+    def _is_quiet_at(now: datetime) -> bool:
         # نهاية الأسبوع (الخميس والجمعة)
-        if now.weekday() in [3, 4]:  # الخميس=3, الجمعة=4
+        if now.weekday() in QuietMode.WEEKEND_DAYS:
             return True
-        
-        # خارج ساعات العمل (9 صباحاً - 6 مساءً KSA)
-        if now.hour < 9 or now.hour > 18:
+
+        # خارج ساعات العمل (9 صباحاً - 6 مساءً بتوقيت الموظف)
+        if now.hour < QuietMode.WORK_START_HOUR or now.hour > QuietMode.WORK_END_HOUR:
             return True
-        
+
         return False
-    
+
+    @staticmethod
+    def next_window_start(timezone: Optional[str] = None) -> datetime:
+        """بداية أقرب فترة إرسال (UTC بدون tzinfo كما تُخزن في MongoDB)"""
+        now = QuietMode.local_now(timezone)
+        if not QuietMode._is_quiet_at(now):
+            start = now
+        else:
+            start = now.replace(hour=QuietMode.WORK_START_HOUR, minute=0, second=0, microsecond=0)
+            if now.hour >= QuietMode.WORK_START_HOUR:
+                start += timedelta(days=1)
+            while start.weekday() in QuietMode.WEEKEND_DAYS:
+                start += timedelta(days=1)
+
+        return start.astimezone(dt_timezone.utc).replace(tzinfo=None)
+
     @staticmethod
-    def get_quiet_reason() -> str:
+    def get_quiet_reason(timezone: Optional[str] = None) -> str:
         """الحصول على سبب تفعيل Quiet Mode"""
-        now = datetime.now()
-        
-        if now.weekday() in [3, 4]:
+        now = QuietMode.local_now(timezone)
+
+        if now.weekday() in QuietMode.WEEKEND_DAYS:
             return "نهاية الأسبوع"
-        
-        if now.hour < 9:
+
+        if now.hour < QuietMode.WORK_START_HOUR:
             return "قبل ساعات العمل"
-        
-        if now.hour > 18:
+
+        if now.hour > QuietMode.WORK_END_HOUR:
             return "بعد ساعات العمل"
-        
+
         return "غير مفعل"
-    
+
     @staticmethod
-    def should_send_message(last_message_time: datetime = None) -> bool:
+    def should_send_message(last_message_time: datetime = None, timezone: Optional[str] = None) -> bool:
         """التحقق من إمكانية إرسال رسالة"""
         # التحقق من Quiet Mode
-        if QuietMode.is_quiet_time():
-            logger.info(f"Quiet mode active: {QuietMode.get_quiet_reason()}")
+        if QuietMode.is_quiet_time(timezone):
+            logger.info(f"Quiet mode active: {QuietMode.get_quiet_reason(timezone)}")
             return False
-        
-        # التحقق من تكرار الرسائل (4 ساعات)
+
+        # التحقق من تكرار الرسائل (4 ساعات) - الوقت المخزن UTC
         if last_message_time:
-            time_diff = datetime.now() - last_message_time
-            if time_diff.total_seconds() < 4 * 3600:  # 4 ساعات
+            time_diff = datetime.utcnow() - last_message_time
+            if time_diff.total_seconds() < QuietMode.MESSAGE_INTERVAL_HOURS * 3600:
                 logger.info("Message too soon after last message")
                 return False
-        
+
         return True
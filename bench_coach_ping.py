@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+قياس إنتاجية /coach/ping مع عدد متزايد من الطلبات المتزامنة
+
+الاستخدام:
+    python bench_coach_ping.py [BASE_URL] [REQUESTS_PER_LEVEL]
+
+مثال:
+    python bench_coach_ping.py http://127.0.0.1:8000 50
+
+للقياس بدون استهلاك tokens شغّل fake_openai_server.py ووجّه التطبيق إليه:
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 python main.py
+
+كل طلب لموظف مختلف (bench-ping-N@d10.sa) حتى لا يرد التباعد بين الرسائل من الذاكرة،
+والموظفون وأرقامهم يُضافون لقاعدة التطبيق (MONGO_URI / DB_NAME) ويُحذفون في النهاية.
+"""
+import os
+import sys
+import time
+import asyncio
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import settings
+
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8000"
+REQUESTS_PER_LEVEL = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+CONCURRENCY_LEVELS = [1, 5, 10, 25, 50]
+EMAIL_PREFIX = "bench-ping-"
+MONTH = "2026-10"
+
+def bench_email(index: int) -> str:
+    return f"{EMAIL_PREFIX}{index}@d10.sa"
+
+async def seed(db, count: int):
+    """موظف برقم KPI لكل طلب في القياس"""
+    await cleanup(db)
+    users = await db.users.insert_many([
+        {"email": bench_email(index), "name": f"Bench {index}", "role": "employee", "department": "sales"}
+        for index in range(count)
+    ])
+    await db.kpis.insert_many([
+        {"user_id": user_id, "department": "sales", "month": MONTH, "target": 100,
+         "actual": (index * 7) % 100, "drift": max(0.0, (100 - (index * 7) % 100) / 100)}
+        for index, user_id in enumerate(users.inserted_ids)
+    ])
+
+async def cleanup(db):
+    bench_users = {"$regex": f"^{EMAIL_PREFIX}"}
+    user_ids = [user["_id"] async for user in db.users.find({"email": bench_users}, {"_id": 1})]
+    await db.kpis.delete_many({"user_id": {"$in": user_ids}})
+    await db.users.delete_many({"email": bench_users})
+    for collection in ("user_performance", "messages", "coach_messages"):
+        await db[collection].delete_many({"user_email": bench_users})
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, first_user: int) -> dict:
+    """تنفيذ REQUESTS_PER_LEVEL طلب مع عدد محدد من الطلبات الجارية"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one_request(index: int):
+        nonlocal errors
+        payload = {
+            "user_email": bench_email(first_user + index),
+            "department": "sales",
+            "summary": "أنجزت 6/10",
+            "bypass_cache": True
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{BASE_URL}/coach/ping", json=payload)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request(index) for index in range(REQUESTS_PER_LEVEL)))
+    wall_time = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "throughput": REQUESTS_PER_LEVEL / wall_time,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "errors": errors
+    }
+
+async def main():
+    """تشغيل القياس لكل مستوى تزامن"""
+    print(f"🚀 قياس {BASE_URL}/coach/ping - {REQUESTS_PER_LEVEL} طلب لكل مستوى")
+    print("⚠️ في وقت Quiet Mode لا يتم استدعاء OpenAI، شغّل القياس خلال ساعات العمل\n")
+
+    mongo = AsyncIOMotorClient(os.getenv("MONGO_URI", settings.mongo_uri))
+    db = mongo[settings.db_name]
+    await seed(db, REQUESTS_PER_LEVEL * len(CONCURRENCY_LEVELS))
+
+    limits = httpx.Limits(max_connections=max(CONCURRENCY_LEVELS))
+    try:
+        async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+            # طلب تمهيدي لتسخين الاتصالات
+            await client.get(f"{BASE_URL}/healthz")
+
+            print(f"{'in-flight':>10} {'req/s':>10} {'p50 (s)':>10} {'p99 (s)':>10} {'errors':>8}")
+            for level, concurrency in enumerate(CONCURRENCY_LEVELS):
+                result = await run_level(client, concurrency, level * REQUESTS_PER_LEVEL)
+                print(
+                    f"{result['concurrency']:>10} {result['throughput']:>10.2f} "
+                    f"{result['p50']:>10.3f} {result['p99']:>10.3f} {result['errors']:>8}"
+                )
+    finally:
+        await cleanup(db)
+        mongo.close()
+
+    print("\n✅ انتهى القياس - الإنتاجية يجب أن ترتفع مع عدد الطلبات الجارية")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+قياس عدد عمليات MongoDB وزمن KPIService.upsert_kpi مقارنة بالمسار القديم
+
+الاستخدام:
+    MONGO_URI=mongodb://localhost:27017 python bench_kpi_upsert.py [UPSERTS]
+
+يستخدم قاعدة بيانات مؤقتة (DB_NAME + "_bench") ويحذفها في النهاية.
+"""
+import os
+import sys
+import time
+import asyncio
+from pymongo import monitoring
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import settings
+import app.db as app_db
+from app.services.kpi_service import KPIService
+
+UPSERTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+BENCH_DB = f"{settings.db_name}_bench"
+USERS = 20
+
+class CommandCounter(monitoring.CommandListener):
+    """عدّاد الأوامر المرسلة للخادم (round-trips)"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def started(self, event):
+        self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        self.counts = {}
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+async def legacy_upsert(db, user_email: str, month: str, target: int, actual: int):
+    """المسار القديم: find user -> insert user -> find kpi -> update/insert -> stale"""
+    user = await db.users.find_one({"email": user_email})
+    if not user:
+        user = {"email": user_email, "name": user_email.split("@")[0], "role": "employee", "department": "general"}
+        result = await db.users.insert_one(user)
+        user["_id"] = result.inserted_id
+
+    existing_kpi = await db.kpis.find_one({"user_id": user["_id"], "month": month})
+    drift = max(0.0, (target - actual) / target) if target > 0 else 0.0
+    if existing_kpi:
+        await db.kpis.update_one(
+            {"_id": existing_kpi["_id"]},
+            {"$set": {"target": target, "actual": actual, "drift": drift}}
+        )
+    else:
+        await db.kpis.insert_one({
+            "user_id": user["_id"],
+            "department": user.get("department", "general"),
+            "month": month,
+            "target": target,
+            "actual": actual,
+            "drift": drift
+        })
+    await db.coach_messages.update_one({"user_email": user_email}, {"$set": {"stale": True}})
+
+def rows():
+    """أول شهرين لكل موظف إنشاء جديد والباقي تحديث لصفوف موجودة"""
+    for index in range(UPSERTS):
+        user_email = f"bench{index % USERS}@d10.sa"
+        month = f"2025-{(index // USERS) % 2 + 1:02d}"
+        yield user_email, month, 100, index % 100
+
+async def run(name: str, counter: CommandCounter, upsert) -> dict:
+    await app_db.database.users.delete_many({})
+    await app_db.database.kpis.delete_many({})
+    counter.reset()
+
+    latencies = []
+    start = time.perf_counter()
+    for row in rows():
+        call_start = time.perf_counter()
+        await upsert(*row)
+        latencies.append(time.perf_counter() - call_start)
+    wall_time = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "name": name,
+        "commands_per_upsert": counter.total / UPSERTS,
+        "breakdown": dict(counter.counts),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "upserts_per_second": UPSERTS / wall_time
+    }
+
+async def main():
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(os.getenv("MONGO_URI", settings.mongo_uri), event_listeners=[counter])
+    database = client[BENCH_DB]
+
+    # KPIService يستخدم نفس العميل المراقَب
+    app_db.client = client
+    app_db.database = database
+    await app_db._ensure_unique_kpi_index(database)
+    await database.users.create_index("email", unique=True)
+
+    kpi_service = KPIService()
+
+    print(f"🚀 قياس {UPSERTS} upsert على {BENCH_DB}\n")
+    results = [
+        await run("legacy", counter, lambda *row: legacy_upsert(database, *row)),
+        await run("upsert_kpi", counter, kpi_service.upsert_kpi)
+    ]
+
+    print(f"{'path':>12} {'cmds/upsert':>12} {'p50 (ms)':>10} {'p99 (ms)':>10} {'upserts/s':>10}")
+    for result in results:
+        print(
+            f"{result['name']:>12} {result['commands_per_upsert']:>12.2f} {result['p50_ms']:>10.2f} "
+            f"{result['p99_ms']:>10.2f} {result['upserts_per_second']:>10.1f}"
+        )
+    for result in results:
+        print(f"   {result['name']}: {result['breakdown']}")
+
+    await client.drop_database(BENCH_DB)
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+قياس عدد استعلامات MongoDB وزمن بناء تقرير المدير مقارنة بالمسار القديم (N+1)
+
+الاستخدام:
+    MONGO_URI=mongodb://localhost:27017 python bench_manager_digest.py [TEAM_SIZES...]
+
+الأحجام الافتراضية 10 و 100 و 1000. يستخدم قاعدة بيانات مؤقتة (DB_NAME + "_bench")
+ويحذفها في النهاية.
+"""
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta
+from pymongo import monitoring
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import settings
+import app.db as app_db
+from app.services.digest_service import DigestService
+
+TEAM_SIZES = [int(size) for size in sys.argv[1:]] or [10, 100, 1000]
+BENCH_DB = f"{settings.db_name}_bench"
+MONTHS = ["2025-01", "2025-02", "2025-03"]
+TASK_STATUSES = ["open", "in_progress", "done", "overdue"]
+RUNS = 5
+
+class CommandCounter(monitoring.CommandListener):
+    """عدّاد الأوامر المرسلة للخادم (round-trips)"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def started(self, event):
+        self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        self.counts = {}
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+async def legacy_digest(db, manager_email: str) -> int:
+    """المسار القديم: المدير ثم الفريق ثم find_one للموظف و find_one لأحدث KPI لكل عضو"""
+    manager = await db.users.find_one({"email": manager_email})
+    members = 0
+    async for member in db.users.find({"manager_id": manager["_id"]}):
+        user = await db.users.find_one({"email": member["email"]})
+        await db.kpis.find_one({"user_id": user["_id"]}, sort=[("month", -1)])
+        members += 1
+    return members
+
+async def seed(db, team_size: int) -> str:
+    """مدير واحد وفريق بثلاثة أشهر KPIs ومهمتين لكل عضو"""
+    for collection in ("users", "kpis", "tasks"):
+        await db[collection].delete_many({})
+
+    manager_email = f"manager{team_size}@d10.sa"
+    manager = await db.users.insert_one({"email": manager_email, "name": "Manager", "role": "manager", "department": "sales"})
+    members = await db.users.insert_many([
+        {
+            "email": f"member{index}@d10.sa",
+            "name": f"Member {index}",
+            "role": "employee",
+            "department": "sales",
+            "manager_id": manager.inserted_id
+        }
+        for index in range(team_size)
+    ])
+
+    kpis = []
+    tasks = []
+    due_date = datetime.utcnow() + timedelta(days=7)
+    for index, user_id in enumerate(members.inserted_ids):
+        for month in MONTHS:
+            actual = (index * 7) % 100
+            kpis.append({"user_id": user_id, "department": "sales", "month": month, "target": 100, "actual": actual,
+                         "drift": max(0.0, (100 - actual) / 100)})
+        for task_index in range(2):
+            tasks.append({"title": f"Task {task_index}", "assignee_user_id": user_id, "due_date": due_date,
+                          "status": TASK_STATUSES[(index + task_index) % len(TASK_STATUSES)],
+                          "created_by_user_id": manager.inserted_id})
+    await db.kpis.insert_many(kpis)
+    await db.tasks.insert_many(tasks)
+    return manager_email
+
+async def measure(counter: CommandCounter, build) -> dict:
+    latencies = []
+    counter.reset()
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await build()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {"queries": counter.total / RUNS, "p50_ms": latencies[len(latencies) // 2] * 1000}
+
+async def main():
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(os.getenv("MONGO_URI", settings.mongo_uri), event_listeners=[counter])
+    database = client[BENCH_DB]
+
+    # DigestService يستخدم نفس العميل المراقَب
+    app_db.client = client
+    app_db.database = database
+    await database.users.create_index("email", unique=True)
+    await database.users.create_index("manager_id")
+    await database.tasks.create_index("assignee_user_id")
+    await app_db._ensure_unique_kpi_index(database)
+
+    digest_service = DigestService()
+
+    print(f"🚀 قياس تقرير المدير على {BENCH_DB} ({RUNS} مرات لكل حجم)\n")
+    print(f"{'team':>6} {'path':>12} {'queries':>9} {'p50 (ms)':>10}")
+    for team_size in TEAM_SIZES:
+        manager_email = await seed(database, team_size)
+        results = [
+            ("legacy", await measure(counter, lambda: legacy_digest(database, manager_email))),
+            ("aggregation", await measure(counter, lambda: digest_service.build_manager_digest(manager_email)))
+        ]
+        for name, result in results:
+            print(f"{team_size:>6} {name:>12} {result['queries']:>9.0f} {result['p50_ms']:>10.2f}")
+
+    await client.drop_database(BENCH_DB)
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
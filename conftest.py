@@ -0,0 +1,163 @@
+"""إعدادات pytest المشتركة - قاعدة بيانات mongomock بواجهة Motor غير المتزامنة"""
+from datetime import datetime
+import pytest
+
+# سكربتات فحص يدوية تحتاج خدمات حقيقية (MongoDB Atlas و OpenAI و Slack)
+collect_ignore = ["test_atlas.py", "test_simple.py", "test_system.py", "test_webhook.py"]
+
+class AsyncCursor:
+    """غلاف Cursor من mongomock بواجهة Motor"""
+
+    def __init__(self, cursor):
+        self.cursor = iter(cursor)
+        self._source = cursor
+
+    def sort(self, *args, **kwargs):
+        self._source = self._source.sort(*args, **kwargs)
+        self.cursor = iter(self._source)
+        return self
+
+    def limit(self, count):
+        self._source = self._source.limit(count)
+        self.cursor = iter(self._source)
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return list(self.cursor)
+
+class AsyncCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        return AsyncCursor(list(self.collection.aggregate(pipeline)))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self.sync = database
+        # نفس الكائن لكل مجموعة حتى يعمل monkeypatch على دوالها
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = AsyncCollection(self.sync[name])
+        return self._collections[name]
+
+class RecordingCollection:
+    """يسجل كل عملية على المجموعة (collection.method) - بديل عدّاد الأوامر في سكربتات القياس"""
+
+    def __init__(self, collection, name, calls):
+        self.collection = collection
+        self.name = name
+        self.calls = calls
+
+    def __getattr__(self, method):
+        self.calls.append(f"{self.name}.{method}")
+        return getattr(self.collection, method)
+
+def _extend_aggregation(monkeypatch, aggregate):
+    """ما تستخدمه الخدمات ولا يدعمه mongomock: $lookup بـ pipeline و $merge و $round و $$NOW"""
+    plain_lookup = aggregate._PIPELINE_HANDLERS["$lookup"]
+
+    def lookup(in_collection, database, options):
+        if "pipeline" not in options:
+            return plain_lookup(in_collection, database, options)
+        foreign = database.get_collection(options["from"])
+        for doc in in_collection:
+            matches = list(foreign.find({options["foreignField"]: doc.get(options["localField"])}))
+            doc[options["as"]] = list(aggregate.process_pipeline(matches, database, options["pipeline"], None))
+        return in_collection
+
+    def merge(in_collection, database, options):
+        target = database.get_collection(options["into"])
+        key = options["on"]
+        for doc in in_collection:
+            exists = target.find_one({key: doc[key]})
+            if exists and options["whenMatched"] == "replace":
+                target.replace_one({key: doc[key]}, doc)
+            elif not exists and options["whenNotMatched"] == "insert":
+                target.insert_one(doc)
+        return []
+
+    plain_add_fields = aggregate._PIPELINE_HANDLERS["$set"]
+
+    def add_fields(in_collection, database, options):
+        out_collection = plain_add_fields(in_collection, database, options)
+        # تعبير نتيجته missing يحذف الحقل (mongomock يبقي القيمة القديمة)
+        for field, value in options.items():
+            for in_doc, out_doc in zip(in_collection, out_collection):
+                try:
+                    aggregate._parse_expression(value, in_doc, ignore_missing_keys=True)
+                except KeyError:
+                    if "." not in field:
+                        out_doc.pop(field, None)
+        return out_collection
+
+    parse = aggregate._Parser.parse
+    parse_basic = aggregate._Parser._parse_basic_expression
+
+    def parse_with_round(self, expression):
+        if isinstance(expression, dict) and list(expression) == ["$round"]:
+            value, places = self.parse_many(expression["$round"])
+            return None if value is None else round(value, places)
+        return parse(self, expression)
+
+    def parse_basic_with_now(self, expression):
+        if expression == "$$NOW":
+            return datetime.utcnow()
+        return parse_basic(self, expression)
+
+    monkeypatch.setitem(aggregate._PIPELINE_HANDLERS, "$lookup", lookup)
+    monkeypatch.setitem(aggregate._PIPELINE_HANDLERS, "$merge", merge)
+    monkeypatch.setitem(aggregate._PIPELINE_HANDLERS, "$set", add_fields)
+    monkeypatch.setitem(aggregate._PIPELINE_HANDLERS, "$addFields", add_fields)
+    monkeypatch.setattr(aggregate._Parser, "parse", parse_with_round)
+    monkeypatch.setattr(aggregate._Parser, "_parse_basic_expression", parse_basic_with_now)
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """قاعدة بيانات في الذاكرة يرجعها app.db.get_db"""
+    mongomock = pytest.importorskip("mongomock")
+    import mongomock.aggregate
+    import app.db as app_db
+
+    _extend_aggregation(monkeypatch, mongomock.aggregate)
+    database = AsyncDatabase(mongomock.MongoClient().db)
+    monkeypatch.setattr(app_db, "database", database)
+    return database
+
+@pytest.fixture
+def mongo_calls(mongo_db, monkeypatch):
+    """قائمة العمليات التي تصل لقاعدة البيانات بالترتيب (مثل kpis.find_one_and_update)"""
+    calls = []
+    get_collection = AsyncDatabase.__getitem__
+
+    def recording(self, name):
+        return RecordingCollection(get_collection(self, name), name, calls)
+
+    monkeypatch.setattr(AsyncDatabase, "__getitem__", recording)
+    return calls
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+خادم محلي متوافق مع OpenAI chat completions لاختبار الحمل بدون استهلاك tokens
+
+الاستخدام:
+    python fake_openai_server.py [PORT]
+
+ثم شغّل التطبيق مع:
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=fake python main.py
+
+إعدادات السلوك (متغيرات بيئة، ويمكن تغييرها أثناء التشغيل عبر POST /fake/config):
+    FAKE_LATENCY=lognormal      constant | uniform | normal | lognormal | pareto
+    FAKE_LATENCY_MEAN=0.8       متوسط زمن الرد بالثواني
+    FAKE_LATENCY_SPREAD=0.5     التشتت (sigma للـ lognormal، الانحراف للـ normal، المدى للـ uniform)
+    FAKE_ERROR_RATE=0.0         نسبة ردود 500
+    FAKE_RATE_LIMIT_RATE=0.0    نسبة ردود 429
+    FAKE_HANG_RATE=0.0          نسبة الطلبات التي لا ترد قبل FAKE_HANG_SECONDS (لاختبار المهلات)
+    FAKE_HANG_SECONDS=120
+    FAKE_ORCHESTRATOR_MODE=valid   valid | fenced | truncated | malformed | mixed
+    FAKE_STREAM_CHUNK_DELAY=0.02   الفاصل بين أجزاء البث
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+from typing import Dict, Any, List
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+PORT = int(sys.argv[1]) if len(sys.argv) > 1 else 9100
+
+CONFIG: Dict[str, Any] = {
+    "latency": os.getenv("FAKE_LATENCY", "lognormal"),
+    "latency_mean": float(os.getenv("FAKE_LATENCY_MEAN", "0.8")),
+    "latency_spread": float(os.getenv("FAKE_LATENCY_SPREAD", "0.5")),
+    "error_rate": float(os.getenv("FAKE_ERROR_RATE", "0.0")),
+    "rate_limit_rate": float(os.getenv("FAKE_RATE_LIMIT_RATE", "0.0")),
+    "hang_rate": float(os.getenv("FAKE_HANG_RATE", "0.0")),
+    "hang_seconds": float(os.getenv("FAKE_HANG_SECONDS", "120")),
+    "orchestrator_mode": os.getenv("FAKE_ORCHESTRATOR_MODE", "valid"),
+    "stream_chunk_delay": float(os.getenv("FAKE_STREAM_CHUNK_DELAY", "0.02"))
+}
+
+ORCHESTRATOR_MODES = ["valid", "fenced", "truncated", "malformed"]
+
+STATS = {"requests": 0, "streamed": 0, "errors": 0, "rate_limited": 0, "hung": 0}
+
+COACH_MESSAGES = [
+    "أداؤك هذا الشهر ممتاز، استمر على نفس الوتيرة 💪",
+    "أنت قريب من هدفك، خطوة إضافية هذا الأسبوع تصنع الفرق",
+    "لاحظنا تراجعاً بسيطاً، لنركز على أهم مهمتين اليوم",
+    "عمل رائع! تجاوزت المستهدف وألهمت فريقك 🌟"
+]
+
+# الكوتش يطلب كتابة هذا النص حرفياً مكان الاسم حتى يُعاد استخدام الرد لكل الموظفين
+NAME_PLACEHOLDER = "{name}"
+
+app = FastAPI(title="Fake OpenAI")
+
+def sample_latency() -> float:
+    """زمن رد عشوائي حسب التوزيع المختار"""
+    distribution = CONFIG["latency"]
+    mean = CONFIG["latency_mean"]
+    spread = CONFIG["latency_spread"]
+
+    if distribution == "constant":
+        return mean
+    if distribution == "uniform":
+        return max(0.0, random.uniform(mean - spread, mean + spread))
+    if distribution == "normal":
+        return max(0.0, random.gauss(mean, spread))
+    if distribution == "pareto":
+        # ذيل طويل: معظم الردود سريعة وبعضها بطيء جداً
+        alpha = 1 + 1 / max(spread, 0.01)
+        return mean * (alpha - 1) / alpha * random.paretovariate(alpha)
+    # lognormal بنفس المتوسط المطلوب
+    mu = -(spread ** 2) / 2
+    return mean * random.lognormvariate(mu, spread)
+
+def build_project(goal_text: str) -> Dict[str, Any]:
+    """مشروع نموذجي بصيغة ProjectResponse"""
+    departments = ["sales", "marketing", "tech", "sondos"]
+    task_count = random.randint(3, 6)
+    return {
+        "project_title": f"خطة: {goal_text[:60]}",
+        "project_description": "خطة تنفيذية مولدة من الخادم المحلي للاختبار",
+        "estimated_duration": f"{task_count} أسابيع",
+        "tasks": [
+            {
+                "id": task_id,
+                "title": f"المهمة {task_id}",
+                "description": f"تنفيذ الجزء {task_id} من الهدف",
+                "department": random.choice(departments),
+                "suggested_assignee": None,
+                "priority": random.choice(["high", "medium", "low"]),
+                "estimated_days": random.randint(1, 10),
+                "depends_on": [task_id - 1] if task_id > 1 else None,
+                "deliverables": [f"مخرج المهمة {task_id}"]
+            }
+            for task_id in range(1, task_count + 1)
+        ],
+        "success_criteria": ["تحقيق الهدف في الوقت المحدد"],
+        "potential_risks": ["نقص الموارد"],
+        "recommended_timeline": f"{task_count} أسابيع"
+    }
+
+def orchestrator_content(goal_text: str) -> str:
+    """رد المنسق حسب الوضع: صالح أو داخل code fence أو مقطوع أو تالف"""
+    mode = CONFIG["orchestrator_mode"]
+    if mode == "mixed":
+        mode = random.choice(ORCHESTRATOR_MODES)
+
+    text = json.dumps(build_project(goal_text), ensure_ascii=False, indent=2)
+    if mode == "fenced":
+        return f"إليك الخطة:\n```json\n{text}\n```"
+    if mode == "truncated":
+        # قطع داخل مصفوفة المهام كما يحدث عند بلوغ max_tokens
+        cut = text.find('"success_criteria"')
+        return text[:int(cut * 0.75)]
+    if mode == "malformed":
+        return "عذراً، هذه خطة مقترحة: المهمة الأولى تحليل السوق ثم { غير مكتمل"
+    return text
+
+def is_orchestrator_request(messages: List[Dict[str, Any]]) -> bool:
+    return any('"tasks"' in str(message.get("content", "")) for message in messages)
+
+def coach_content(messages: List[Dict[str, Any]]) -> str:
+    """رسالة كوتش تحافظ على الـ placeholder إذا طلبه الـ prompt (وإلا يولد الكوتش لكل موظف على حدة)"""
+    message = random.choice(COACH_MESSAGES)
+    if NAME_PLACEHOLDER in str(messages[-1].get("content", "")):
+        return f"{NAME_PLACEHOLDER}، {message}"
+    return message
+
+def completion_content(messages: List[Dict[str, Any]]) -> str:
+    if is_orchestrator_request(messages):
+        return orchestrator_content(str(messages[-1].get("content", "")))
+    return coach_content(messages)
+
+def usage_for(messages: List[Dict[str, Any]], content: str) -> Dict[str, int]:
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+def error_response(status_code: int, message: str, error_type: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "code": None}}
+    )
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """نفس شكل رد OpenAI مع زمن وأخطاء قابلة للضبط"""
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "fake-model")
+    STATS["requests"] += 1
+
+    roll = random.random()
+    if roll < CONFIG["hang_rate"]:
+        STATS["hung"] += 1
+        await asyncio.sleep(CONFIG["hang_seconds"])
+    elif roll < CONFIG["hang_rate"] + CONFIG["error_rate"]:
+        STATS["errors"] += 1
+        await asyncio.sleep(sample_latency() / 4)
+        return error_response(500, "Simulated server error", "server_error")
+    elif roll < CONFIG["hang_rate"] + CONFIG["error_rate"] + CONFIG["rate_limit_rate"]:
+        STATS["rate_limited"] += 1
+        return error_response(429, "Simulated rate limit", "rate_limit_exceeded")
+
+    content = completion_content(messages)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+
+    if body.get("stream"):
+        STATS["streamed"] += 1
+        return StreamingResponse(
+            stream_chunks(completion_id, created, model, content),
+            media_type="text/event-stream"
+        )
+
+    await asyncio.sleep(sample_latency())
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": usage_for(messages, content)
+    }
+
+async def stream_chunks(completion_id: str, created: int, model: str, content: str):
+    """بث الرد على أجزاء بصيغة SSE الخاصة بـ OpenAI"""
+    def chunk(delta: Dict[str, Any], finish_reason=None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    # زمن حتى أول token
+    await asyncio.sleep(sample_latency() / 3)
+    yield chunk({"role": "assistant", "content": ""})
+
+    piece_size = 12
+    for start in range(0, len(content), piece_size):
+        await asyncio.sleep(CONFIG["stream_chunk_delay"])
+        yield chunk({"content": content[start:start + piece_size]})
+
+    yield chunk({}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "local"}]}
+
+@app.get("/fake/config")
+async def get_config():
+    return {"config": CONFIG, "stats": STATS}
+
+@app.post("/fake/config")
+async def update_config(changes: Dict[str, Any]):
+    """تغيير سلوك الخادم بين مراحل القياس بدون إعادة تشغيل"""
+    unknown = [key for key in changes if key not in CONFIG]
+    if unknown:
+        return error_response(400, f"Unknown config keys: {unknown}", "invalid_request_error")
+    for key, value in changes.items():
+        CONFIG[key] = type(CONFIG[key])(value)
+    for key in STATS:
+        STATS[key] = 0
+    return {"config": CONFIG}
+
+if __name__ == "__main__":
+    print(f"🧪 Fake OpenAI server على http://127.0.0.1:{PORT}/v1")
+    print(f"⚙️ {json.dumps(CONFIG, ensure_ascii=False)}")
+    uvicorn.run(app, host="127.0.0.1", port=PORT, log_level="warning")
@@ -3,8 +3,13 @@ import os
 import structlog
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import health, tasks, prompts, kpis, coach, digests, slack
+from app.routers import health, tasks, prompts, kpis, coach, digests, slack, agents
 from app.db import init_db
+from app.ai.base_agent import close_shared_openai_client
+from app.scheduler import start_scheduler, shutdown_scheduler
+from app.ai.job_queue import agent_job_queue
+from app.services.deferred_delivery import deferred_delivery
+from app.services.kpi_service import KPIService
 
 # إعداد الـ logging
 structlog.configure(
@@ -51,6 +56,7 @@ app.include_router(kpis.router)
 app.include_router(coach.router)
 app.include_router(digests.router)
 app.include_router(slack.router)
+app.include_router(agents.router)
 
 @app.on_event("startup")
 async def startup_event():
@@ -64,9 +70,15 @@ async def startup_event():
         try:
             await init_db()
             logger.info("✅ Database initialized successfully")
+            await KPIService().ensure_performance_snapshots()
         except Exception as e:
             logger.error(f"❌ Database initialization failed: {e}")
             # لا نوقف التطبيق إذا فشل MongoDB
+        
+        # المهام المجدولة والطوابير تحتاج قاعدة البيانات
+        start_scheduler()
+        agent_job_queue.start()
+        deferred_delivery.start()
     else:
         logger.info("⚠️ Database initialization disabled by DISABLE_DB flag")
     
@@ -76,6 +88,10 @@ async def startup_event():
 async def shutdown_event():
     """تنظيف النظام عند الإغلاق"""
     logger.info("🛑 Shutting down Siyadah Ops AI...")
+    shutdown_scheduler()
+    await agent_job_queue.stop()
+    await deferred_delivery.stop()
+    await close_shared_openai_client()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,30 @@
+"""اختبارات مفتاح دمج الطلبات المتطابقة في AgentManager"""
+from app.ai.agent_manager import AgentManager
+
+make_key = AgentManager._make_flight_key
+
+def test_email_fields_are_casefolded():
+    first = make_key("coach", "generate_message", {"user_email": " Sara@D10.sa", "drift": 0.3})
+    second = make_key("coach", "generate_message", {"user_email": "sara@d10.sa", "drift": 0.3})
+    assert first == second
+
+def test_nested_email_fields_are_casefolded():
+    first = make_key("coach", "generate_message", {"user_data": {"user_email": "SARA@d10.sa"}, "emails": []})
+    second = make_key("coach", "generate_message", {"user_data": {"user_email": "sara@d10.sa"}, "emails": []})
+    assert first == second
+
+def test_free_text_is_not_normalised():
+    first = make_key("orchestrator", "answer", {"question": "ما هو KPI؟"})
+    second = make_key("orchestrator", "answer", {"question": "ما هو kpi؟"})
+    spaced = make_key("orchestrator", "answer", {"question": "ما  هو KPI؟"})
+    assert len({first, second, spaced}) == 3
+
+def test_key_is_hashed():
+    key = make_key("coach", "generate_message", {"summary": "x" * 10000})
+    assert key.startswith("coach:generate_message:")
+    assert len(key) < 100
+
+def test_email_lists_are_casefolded():
+    first = make_key("digest", "send", {"emails": ["A@d10.sa", "b@d10.sa"]})
+    second = make_key("digest", "send", {"emails": ["a@d10.sa", "B@D10.sa"]})
+    assert first == second
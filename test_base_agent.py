@@ -0,0 +1,35 @@
+"""اختبارات استدعاء الـ LLM في BaseAgent"""
+import asyncio
+from types import SimpleNamespace
+from app.ai.base_agent import BaseAgent
+from app.ai.circuit_breaker import CircuitBreaker, CLOSED
+
+class FakeAgent(BaseAgent):
+    def _get_default_prompt(self, prompt_name: str) -> str:
+        return ""
+
+    def _get_fallback_response(self) -> str:
+        return "fallback"
+
+def make_agent(content, finish_reason="stop"):
+    async def create(**kwargs):
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=None)
+
+    agent = FakeAgent("test")
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return agent
+
+def make_breaker():
+    return CircuitBreaker("test", failure_threshold=1, slow_call_seconds=0, open_seconds=30, half_open_max_calls=1)
+
+def test_none_content_is_not_a_breaker_failure():
+    breaker = make_breaker()
+    result = asyncio.run(make_agent(None, finish_reason="content_filter")._call_llm([], breaker))
+    assert result is None
+    assert breaker.state == CLOSED
+    assert breaker.consecutive_failures == 0
+
+def test_content_is_stripped():
+    result = asyncio.run(make_agent("  مرحبا  ")._call_llm([], make_breaker()))
+    assert result == "مرحبا"
@@ -0,0 +1,157 @@
+"""اختبارات الـ circuit breaker والبث عبر BaseAgent"""
+import asyncio
+import time
+from types import SimpleNamespace
+from app.ai.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from test_base_agent import FakeAgent
+
+def make_breaker(**overrides):
+    options = {"failure_threshold": 2, "slow_call_seconds": 0, "open_seconds": 30, "half_open_max_calls": 1}
+    options.update(overrides)
+    return CircuitBreaker("test", **options)
+
+def force_half_open(breaker):
+    breaker.state = OPEN
+    breaker.opened_at = time.monotonic() - breaker.open_seconds - 1
+
+def test_opens_after_threshold_and_rejects():
+    breaker = make_breaker()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.allow_request() is False
+    assert breaker.get_stats()["rejected_calls"] == 1
+
+def test_slow_call_counts_as_failure():
+    breaker = make_breaker(failure_threshold=1, slow_call_seconds=1)
+    breaker.record_success(2.0)
+    assert breaker.state == OPEN
+
+def test_half_open_allows_limited_probes_and_recovers():
+    breaker = make_breaker()
+    force_half_open(breaker)
+    assert breaker.allow_request() is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() is False
+
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() is True
+
+def test_failed_probe_reopens():
+    breaker = make_breaker()
+    force_half_open(breaker)
+    breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+def test_release_frees_probe_slot():
+    breaker = make_breaker()
+    force_half_open(breaker)
+    breaker.allow_request()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() is True
+
+def make_streaming_agent(chunks, stall: bool = False):
+    class Stream:
+        def __aiter__(self):
+            return self._chunks()
+
+        async def _chunks(self):
+            for text in chunks:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+            if stall:
+                await asyncio.Event().wait()
+
+    async def create(**kwargs):
+        return Stream()
+
+    agent = FakeAgent("stream-test")
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return agent
+
+def test_stream_cancelled_before_first_chunk_releases_probe(monkeypatch):
+    import app.ai.base_agent as base_agent
+    breaker = make_breaker()
+    force_half_open(breaker)
+    monkeypatch.setattr(base_agent, "get_circuit_breaker", lambda agent_type, model: breaker)
+
+    async def scenario():
+        stream = make_streaming_agent([None], stall=True).stream_openai([])
+        consumer = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        assert breaker.half_open_in_flight == 1
+        consumer.cancel()
+        await asyncio.gather(consumer, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert breaker.state == HALF_OPEN
+    assert breaker.half_open_in_flight == 0
+    assert breaker.consecutive_failures == 0
+
+def test_stream_closed_after_first_chunk_counts_as_success(monkeypatch):
+    import app.ai.base_agent as base_agent
+    breaker = make_breaker()
+    force_half_open(breaker)
+    monkeypatch.setattr(base_agent, "get_circuit_breaker", lambda agent_type, model: breaker)
+
+    async def scenario():
+        stream = make_streaming_agent(["أ", "ب"]).stream_openai([])
+        assert await stream.__anext__() == "أ"
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    assert breaker.state == CLOSED
+    assert breaker.half_open_in_flight == 0
+
+def make_stalling_agent():
+    async def create(**kwargs):
+        await asyncio.Event().wait()
+
+    agent = FakeAgent("call-test")
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return agent
+
+def test_cancelled_call_releases_probe():
+    breaker = make_breaker()
+    force_half_open(breaker)
+
+    async def scenario():
+        assert breaker.allow_request()
+        call = asyncio.ensure_future(make_stalling_agent()._call_llm([], breaker))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert breaker.state == HALF_OPEN
+    assert breaker.half_open_in_flight == 0
+    assert breaker.consecutive_failures == 0
+
+def test_rate_limiter_errors_are_not_breaker_failures(monkeypatch):
+    import app.ai.base_agent as base_agent
+    breaker = make_breaker(failure_threshold=1)
+    force_half_open(breaker)
+
+    async def rejected(priority, tokens):
+        raise asyncio.TimeoutError("rate limiter wait exceeded")
+
+    monkeypatch.setattr(base_agent.llm_rate_limiter, "acquire", rejected)
+
+    async def scenario():
+        assert breaker.allow_request()
+        assert await make_stalling_agent()._call_llm([], breaker) is None
+        # stream_openai يحجز الاستدعاء التجريبي بنفسه
+        stream = make_streaming_agent(["أ"]).stream_openai([])
+        try:
+            await stream.__anext__()
+        except asyncio.TimeoutError:
+            pass
+
+    monkeypatch.setattr(base_agent, "get_circuit_breaker", lambda agent_type, model: breaker)
+    asyncio.run(scenario())
+    assert breaker.state == HALF_OPEN
+    assert breaker.half_open_in_flight == 0
+    assert breaker.consecutive_failures == 0
@@ -0,0 +1,68 @@
+"""اختبارات CoachAI: الـ placeholder في الردود المخزنة"""
+import asyncio
+import pytest
+from app.ai.coach import CoachAI, NAME_PLACEHOLDER
+from app.ai.response_cache import coach_response_cache
+
+USER_DATA = {"name": "سارة", "department": "sales", "drift": 0.3, "summary": "ملخص"}
+
+@pytest.fixture
+def coach(monkeypatch):
+    coach_response_cache.clear()
+    agent = CoachAI()
+
+    async def prompt(prompt_name):
+        return ("system" if prompt_name == "system" else "اكتب رسالة لـ {name}"), 1
+
+    monkeypatch.setattr(agent, "get_prompt_with_version", prompt)
+    yield agent
+    coach_response_cache.clear()
+
+def fake_complete(agent, monkeypatch, responses):
+    calls = []
+
+    async def complete(messages, **kwargs):
+        calls.append(messages[1]["content"])
+        return responses[len(calls) - 1]
+
+    monkeypatch.setattr(agent, "_complete", complete)
+    return calls
+
+def test_placeholder_response_is_cached_and_personalised(coach, monkeypatch):
+    calls = fake_complete(coach, monkeypatch, [f"أحسنت يا {NAME_PLACEHOLDER}"])
+
+    first = asyncio.run(coach.generate_coach_message(USER_DATA, check_schedule=False))
+    second = asyncio.run(coach.generate_coach_message({**USER_DATA, "name": "علي"}, check_schedule=False))
+
+    assert first["message"] == "أحسنت يا سارة"
+    assert second["message"] == "أحسنت يا علي"
+    assert len(calls) == 1
+    assert "حرفياً" in calls[0]
+
+def test_missing_placeholder_is_not_cached(coach, monkeypatch):
+    calls = fake_complete(coach, monkeypatch, ["أحسنت يا Name", "أحسنت يا سارة"])
+
+    result = asyncio.run(coach.generate_coach_message(USER_DATA, check_schedule=False))
+
+    assert result["message"] == "أحسنت يا سارة"
+    assert len(calls) == 2
+    # الطلب الثاني خاص بالموظف وباسمه الحقيقي
+    assert NAME_PLACEHOLDER not in calls[1] and "سارة" in calls[1]
+    assert coach_response_cache.get_stats()["entries"] == 0
+
+def test_current_time_uses_employee_timezone(coach, monkeypatch):
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+
+    async def prompt(prompt_name):
+        return ("system" if prompt_name == "system" else "الساعة {current_time}"), 1
+
+    monkeypatch.setattr(coach, "get_prompt_with_version", prompt)
+    calls = fake_complete(coach, monkeypatch, ["رد", "رد"])
+
+    for timezone in ("Asia/Tokyo", "America/New_York"):
+        asyncio.run(coach.generate_coach_message({**USER_DATA, "timezone": timezone},
+                                                 bypass_cache=True, check_schedule=False))
+
+    expected = [f"الساعة {datetime.now(ZoneInfo(zone)).strftime('%H:%M')}" for zone in ("Asia/Tokyo", "America/New_York")]
+    assert calls == expected
@@ -0,0 +1,74 @@
+"""اختبارات سجل التباعد بين رسائل الكوتش"""
+import asyncio
+import pytest
+from app.ai.coach import CoachAI
+from app.services.coach_throttle import CoachThrottleLedger, COACH_MESSAGE_TYPE
+import app.ai.coach as coach_module
+
+EMAIL = "sara@d10.sa"
+
+def test_reserve_blocks_until_released(mongo_db):
+    ledger = CoachThrottleLedger()
+
+    async def scenario():
+        first, _ = await ledger.try_reserve(EMAIL)
+        second, _ = await ledger.try_reserve(EMAIL)
+        ledger.release(EMAIL)
+        third, _ = await ledger.try_reserve(EMAIL)
+        return first, second, third
+
+    assert asyncio.run(scenario()) == (True, False, True)
+    assert ledger.stats["released"] == 1
+
+def test_release_after_record_keeps_message(mongo_db):
+    ledger = CoachThrottleLedger()
+
+    async def scenario():
+        await ledger.try_reserve(EMAIL)
+        await ledger.record(EMAIL, "رسالة", "good")
+        ledger.release(EMAIL)
+        return await ledger.try_reserve(EMAIL)
+
+    allowed, last_message = asyncio.run(scenario())
+    assert allowed is False
+    assert last_message["performance_level"] == "good"
+    assert mongo_db.sync.messages.count_documents({"user_email": EMAIL, "type": COACH_MESSAGE_TYPE}) == 1
+
+@pytest.fixture
+def ledger(monkeypatch, mongo_db):
+    ledger = CoachThrottleLedger()
+    monkeypatch.setattr(coach_module, "coach_throttle", ledger)
+    monkeypatch.setattr(coach_module.QuietMode, "should_send_message", staticmethod(lambda *args, **kwargs: True))
+    return ledger
+
+USER_DATA = {"name": "سارة", "department": "sales", "drift": 0.3, "user_email": EMAIL}
+
+def test_coach_failure_releases_reservation(ledger, monkeypatch):
+    coach = CoachAI()
+
+    async def broken_prompt(prompt_name):
+        raise RuntimeError("prompt store down")
+
+    monkeypatch.setattr(coach, "get_prompt_with_version", broken_prompt)
+    result = asyncio.run(coach.generate_coach_message(USER_DATA))
+
+    assert result["source"] == "fallback"
+    assert ledger.stats["released"] == 1
+    assert asyncio.run(ledger.try_reserve(EMAIL))[0] is True
+
+def test_coach_cancellation_releases_reservation(ledger, monkeypatch):
+    coach = CoachAI()
+
+    async def slow_prompt(prompt_name):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(coach, "get_prompt_with_version", slow_prompt)
+
+    async def scenario():
+        task = asyncio.ensure_future(coach.generate_coach_message(USER_DATA))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return await ledger.try_reserve(EMAIL)
+
+    assert asyncio.run(scenario())[0] is True
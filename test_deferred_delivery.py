@@ -0,0 +1,63 @@
+"""اختبارات جدولة الرسائل المؤجلة في الذاكرة"""
+import asyncio
+from datetime import datetime, timedelta
+from app.services.deferred_delivery import DeferredDeliveryScheduler
+
+def make_scheduler(monkeypatch):
+    scheduler = DeferredDeliveryScheduler(release_per_minute=0, horizon_minutes=60, claim_timeout_minutes=10)
+    scheduler._loaded_until = datetime.utcnow() + timedelta(hours=1)
+    released = []
+
+    async def no_refresh():
+        pass
+
+    async def release(message_id):
+        released.append(message_id)
+
+    monkeypatch.setattr(scheduler, "_load_due_soon", no_refresh)
+    monkeypatch.setattr(scheduler, "_release", release)
+    return scheduler, released
+
+def run_briefly(scheduler):
+    async def scenario():
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+    asyncio.run(scenario())
+
+def test_rescheduled_message_skips_stale_entry(monkeypatch):
+    scheduler, released = make_scheduler(monkeypatch)
+    now = datetime.utcnow()
+    later = now + timedelta(minutes=30)
+
+    scheduler._schedule(now - timedelta(seconds=1), "moved")
+    scheduler._schedule(later, "moved")
+    scheduler._schedule(now - timedelta(seconds=1), "due")
+    run_briefly(scheduler)
+
+    assert released == ["due"]
+    assert scheduler._scheduled == {"moved": later}
+    assert scheduler.get_stats()["next_delivery_at"] == later.isoformat()
+
+def test_rescheduled_earlier_is_released_once(monkeypatch):
+    scheduler, released = make_scheduler(monkeypatch)
+    now = datetime.utcnow()
+
+    scheduler._schedule(now + timedelta(minutes=30), "moved")
+    scheduler._schedule(now - timedelta(seconds=1), "moved")
+    scheduler._schedule(now - timedelta(seconds=1), "moved")
+    run_briefly(scheduler)
+
+    assert released == ["moved"]
+    assert scheduler._scheduled == {}
+
+def test_moved_beyond_horizon_drops_old_entry(monkeypatch):
+    scheduler, released = make_scheduler(monkeypatch)
+    now = datetime.utcnow()
+
+    scheduler._schedule(now - timedelta(seconds=1), "moved")
+    scheduler._schedule(now + timedelta(days=1), "moved")
+    run_briefly(scheduler)
+
+    assert released == []
+    assert scheduler.get_stats()["scheduled_in_memory"] == 0
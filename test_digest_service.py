@@ -0,0 +1,87 @@
+"""اختبارات تقرير المدير المبني من aggregation واحد"""
+import asyncio
+import pytest
+from app.services.digest_service import DigestService
+from app.services.kpi_service import KPIService
+
+@pytest.fixture
+def team(mongo_db):
+    db = mongo_db.sync
+    manager_id = db.users.insert_one({"email": "boss@d10.sa", "name": "المدير"}).inserted_id
+    sara = db.users.insert_one({"email": "sara@d10.sa", "name": "سارة", "department": "sales", "manager_id": manager_id}).inserted_id
+    omar = db.users.insert_one({"email": "omar@d10.sa", "name": "عمر", "department": "tech", "manager_id": manager_id}).inserted_id
+    db.users.insert_one({"email": "other@d10.sa", "manager_id": None})
+
+    db.kpis.insert_many([
+        {"user_id": sara, "month": "2026-01", "target": 100, "actual": 50, "drift": 0.5},
+        {"user_id": sara, "month": "2026-02", "target": 100, "actual": 80, "drift": 0.2}
+    ])
+    db.tasks.insert_many([
+        {"title": "1", "assignee_user_id": sara, "status": "open"},
+        {"title": "2", "assignee_user_id": sara, "status": "overdue"},
+        {"title": "3", "assignee_user_id": sara, "status": "done"},
+        {"title": "4", "assignee_user_id": omar, "status": "done"}
+    ])
+    asyncio.run(KPIService().rebuild_performance_snapshots({}))
+    return mongo_db
+
+def load(email):
+    return asyncio.run(DigestService().load_manager_team(email))
+
+def test_manager_team_in_one_aggregation(team):
+    manager = load("boss@d10.sa")
+
+    members = {member["email"]: member for member in manager["team"]}
+    assert set(members) == {"sara@d10.sa", "omar@d10.sa"}
+
+    sara = members["sara@d10.sa"]
+    assert sara["latest_kpi"] == {"month": "2026-02", "target": 100, "actual": 80, "drift": 0.2}
+    assert (sara["performance_level"], sara["open_tasks"]) == ("good", 2)
+
+    omar = members["omar@d10.sa"]
+    assert "latest_kpi" not in omar
+    assert (omar["drift"], omar["performance_level"], omar["open_tasks"]) == (0.0, "no_data", 0)
+
+@pytest.mark.parametrize("team_size", [1, 10, 100])
+def test_manager_team_is_one_aggregate_for_any_team_size(mongo_db, mongo_calls, team_size):
+    db = mongo_db.sync
+    manager_id = db.users.insert_one({"email": "boss@d10.sa", "name": "المدير"}).inserted_id
+    members = db.users.insert_many([
+        {"email": f"member{index}@d10.sa", "name": f"Member {index}", "department": "sales", "manager_id": manager_id}
+        for index in range(team_size)
+    ]).inserted_ids
+    db.kpis.insert_many([
+        {"user_id": user_id, "month": "2026-02", "target": 100, "actual": 70, "drift": 0.3} for user_id in members
+    ])
+    db.tasks.insert_many([{"title": "t", "assignee_user_id": user_id, "status": "open"} for user_id in members])
+    asyncio.run(KPIService().rebuild_performance_snapshots({}))
+    mongo_calls.clear()
+
+    manager = load("boss@d10.sa")
+
+    assert len(manager["team"]) == team_size
+    assert mongo_calls == ["users.aggregate"]
+
+def test_team_performance_comes_from_the_snapshot(team):
+    team.sync.user_performance.update_one(
+        {"user_email": "sara@d10.sa"},
+        {"$set": {"month": "2026-03", "target": 100, "actual": 95, "drift": 0.05}}
+    )
+
+    members = {member["email"]: member for member in load("boss@d10.sa")["team"]}
+    assert members["sara@d10.sa"]["latest_kpi"]["month"] == "2026-03"
+    assert members["sara@d10.sa"]["performance_level"] == "excellent"
+
+def test_unknown_manager_and_empty_team(team):
+    assert load("ghost@d10.sa") is None
+    assert load("sara@d10.sa")["team"] == []
+
+def test_rendered_digest(team):
+    service = DigestService()
+    content = asyncio.run(service.build_manager_digest("boss@d10.sa"))
+
+    assert "🟡 <strong>سارة</strong>" in content
+    assert "الهدف: 100 | المحقق: 80" in content
+    assert "لدى فريقك 2 مهمة مفتوحة" in content
+    assert asyncio.run(service.build_manager_digest("ghost@d10.sa")) == "المدير غير موجود"
+    assert "لا يوجد أعضاء في فريقك" in asyncio.run(service.build_manager_digest("sara@d10.sa"))
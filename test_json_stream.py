@@ -0,0 +1,49 @@
+"""اختبارات التحليل التدريجي لـ JSON المنسق"""
+import json
+from app.ai.json_stream import TaskStreamParser, parse_project_json, recover_truncated_project
+
+PROJECT = {
+    "project_name": "إطلاق",
+    "tasks": [
+        {"title": "مهمة {1}", "notes": "فيها \"اقتباس\" و ] و }"},
+        {"title": "مهمة 2", "subtasks": [{"title": "فرعية"}]},
+        {"title": "مهمة 3"}
+    ],
+    "summary": "تم"
+}
+
+def feed_in_chunks(text, size):
+    parser = TaskStreamParser()
+    batches = [parser.feed(text[start:start + size]) for start in range(0, len(text), size)]
+    return parser, batches
+
+def test_tasks_emitted_once_for_any_chunk_size():
+    text = json.dumps(PROJECT, ensure_ascii=False)
+    for size in (1, 3, 7, 64, len(text)):
+        _, batches = feed_in_chunks(text, size)
+        tasks = [task for batch in batches for task in batch]
+        assert tasks == PROJECT["tasks"], size
+
+def test_task_emitted_as_soon_as_its_object_closes():
+    parser = TaskStreamParser()
+    assert parser.feed('{"tasks": [{"title": "أ"') == []
+    assert parser.feed('}, {"title"') == [{"title": "أ"}]
+    assert parser.feed(': "ب"}]') == [{"title": "ب"}]
+    # ما بعد نهاية المصفوفة لا يُحلل
+    assert parser.feed(', "extra": [{"title": "ج"}]}') == []
+
+def test_malformed_task_is_skipped():
+    parser = TaskStreamParser()
+    assert parser.feed('{"tasks": [{"title": x}, {"title": "ب"}]}') == [{"title": "ب"}]
+
+def test_recover_truncated_project_keeps_complete_tasks():
+    text = '{"project_name": "إطلاق", "tasks": [{"title": "أ"}, {"title": "ب", "desc'
+    assert recover_truncated_project(text) == {"project_name": "إطلاق", "tasks": [{"title": "أ"}]}
+
+def test_parse_project_json_statuses():
+    text = json.dumps(PROJECT, ensure_ascii=False)
+    assert parse_project_json(text) == (PROJECT, "parsed")
+    assert parse_project_json(f"هذه الخطة:\n```json\n{text}\n```") == (PROJECT, "repaired")
+    data, status = parse_project_json(text[:text.index('"مهمة 3"')])
+    assert status == "repaired" and len(data["tasks"]) == 2
+    assert parse_project_json("لا يوجد JSON") == (None, "failed")
@@ -0,0 +1,78 @@
+"""اختبارات تجميع أداء الأقسام في قاعدة البيانات"""
+import asyncio
+import pytest
+from app.services.kpi_service import KPIService
+from app.services.digest_service import DigestService
+
+@pytest.fixture
+def company(mongo_db):
+    db = mongo_db.sync
+
+    def employee(email, department, *kpis):
+        user_id = db.users.insert_one({"email": email, "department": department}).inserted_id
+        for month, drift in kpis:
+            db.kpis.insert_one({"user_id": user_id, "month": month, "target": 100, "actual": 100 - drift * 100, "drift": drift})
+
+    # أحدث شهر هو الذي يحدد المستوى
+    employee("a@d10.sa", "sales", ("2026-01", 0.9), ("2026-02", 0.1))
+    employee("b@d10.sa", "sales", ("2026-02", 0.2))
+    employee("c@d10.sa", "sales", ("2026-02", 0.3333333))
+    employee("d@d10.sa", "sales")
+    employee("e@d10.sa", "tech", ("2026-02", 0.5))
+    db.users.insert_one({"email": "f@d10.sa"})
+    # اللقطات كما يبنيها بدء التشغيل (d و f بدون KPI لا لقطة لهما)
+    asyncio.run(KPIService().rebuild_performance_snapshots({"email": {"$nin": ["d@d10.sa", "f@d10.sa"]}}))
+    return mongo_db
+
+def test_department_rollups(company):
+    rollups = asyncio.run(KPIService().get_department_rollups())
+
+    assert [rollup["department"] for rollup in rollups] == ["general", "sales", "tech"]
+    sales = rollups[1]
+    assert sales == {
+        "department": "sales",
+        "total": 4,
+        "excellent": 1,
+        "good": 1,
+        "needs_improvement": 1,
+        "critical": 0,
+        "no_data": 1,
+        # متوسط من لديهم KPI فقط، مقرب لأربع خانات
+        "avg_drift": round((0.1 + 0.2 + 0.3333333) / 3, 4)
+    }
+    assert rollups[0] == {"department": "general", "total": 1, "excellent": 0, "good": 0,
+                          "needs_improvement": 0, "critical": 0, "no_data": 1, "avg_drift": 0.0}
+    assert rollups[2]["critical"] == 1
+
+def test_rollups_for_one_department(company):
+    rollups = asyncio.run(KPIService().get_department_rollups("tech"))
+    assert [(rollup["department"], rollup["total"], rollup["avg_drift"]) for rollup in rollups] == [("tech", 1, 0.5)]
+
+def test_levels_match_python_thresholds(company):
+    service = KPIService()
+    for drift in (0.0, 0.1499, 0.15, 0.2499, 0.25, 0.3499, 0.35, 1.0):
+        company.sync.users.delete_many({})
+        company.sync.kpis.delete_many({})
+        company.sync.user_performance.delete_many({})
+        user_id = company.sync.users.insert_one({"email": "x@d10.sa", "department": "qa"}).inserted_id
+        company.sync.kpis.insert_one({"user_id": user_id, "month": "2026-02", "drift": drift})
+        asyncio.run(service.rebuild_performance_snapshots({}))
+
+        [rollup] = asyncio.run(service.get_department_rollups())
+        assert rollup[service._get_performance_level(drift)] == 1, drift
+
+def test_executive_digest_counts_no_data_as_critical(company):
+    rollups = asyncio.run(KPIService().get_department_rollups())
+    content = DigestService().render_executive_digest(rollups)
+
+    assert "<strong>إجمالي الموظفين:</strong> 6" in content
+    assert "<strong>حرج:</strong> 3 (50.0%)" in content
+
+def test_rollups_read_the_snapshot_not_kpis(company):
+    # upsert_kpi يكتب اللقطة مع الـ KPI - الـ rollup يتبعها ولا يعيد حساب أحدث شهر
+    company.sync.user_performance.update_one({"user_email": "e@d10.sa"}, {"$set": {"drift": 0.05}})
+    company.sync.user_performance.insert_one({"user_email": "d@d10.sa", "month": "2026-02", "drift": 0.3})
+
+    sales, tech = asyncio.run(KPIService().get_department_rollups())[1:]
+    assert (tech["excellent"], tech["critical"]) == (1, 0)
+    assert (sales["needs_improvement"], sales["no_data"]) == (2, 0)
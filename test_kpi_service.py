@@ -0,0 +1,159 @@
+"""اختبارات KPIService على قاعدة mongomock"""
+import asyncio
+import pytest
+from app.services.kpi_service import KPIService
+
+@pytest.fixture
+def kpi_db(mongo_db):
+    mongo_db.sync.users.create_index("email", unique=True)
+    mongo_db.sync.kpis.create_index([("user_id", 1), ("month", 1)], unique=True)
+    mongo_db.sync.user_performance.create_index("user_email", unique=True)
+    return mongo_db
+
+def upsert(email, month, target, actual):
+    return asyncio.run(KPIService().upsert_kpi(email, month, target, actual))
+
+def test_upsert_creates_user_and_computes_drift(kpi_db):
+    result = upsert("sara@d10.sa", "2026-01", 100, 70)
+
+    assert result["drift"] == pytest.approx(0.3)
+    assert result["department"] == "general"
+    user = kpi_db.sync.users.find_one({"email": "sara@d10.sa"})
+    assert user["name"] == "sara" and user["role"] == "employee"
+    kpi = kpi_db.sync.kpis.find_one({"user_id": user["_id"], "month": "2026-01"})
+    assert (kpi["target"], kpi["actual"]) == (100, 70)
+
+def test_upsert_same_month_updates_in_place(kpi_db):
+    first = upsert("sara@d10.sa", "2026-01", 100, 70)
+    second = upsert("sara@d10.sa", "2026-01", 100, 120)
+
+    assert second["id"] == first["id"]
+    assert second["drift"] == 0.0
+    assert kpi_db.sync.kpis.count_documents({}) == 1
+
+def test_zero_target_has_no_drift(kpi_db):
+    assert upsert("sara@d10.sa", "2026-01", 0, 10)["drift"] == 0.0
+
+def test_upsert_keeps_existing_department_and_marks_message_stale(kpi_db):
+    kpi_db.sync.users.insert_one({"email": "ali@d10.sa", "name": "Ali", "department": "sales"})
+    kpi_db.sync.coach_messages.insert_one({"user_email": "ali@d10.sa", "message": "قديمة"})
+
+    result = upsert("ali@d10.sa", "2026-02", 200, 100)
+
+    assert result["department"] == "sales"
+    assert kpi_db.sync.coach_messages.find_one({"user_email": "ali@d10.sa"})["stale"] is True
+
+def test_upsert_is_one_round_trip_per_collection(kpi_db, mongo_calls):
+    expected = [
+        "users.find_one_and_update",
+        "kpis.find_one_and_update",
+        "coach_messages.update_one",
+        "user_performance.update_one"
+    ]
+    upsert("sara@d10.sa", "2026-01", 100, 70)
+    assert sorted(mongo_calls) == sorted(expected)
+
+    # التحديث لنفس الشهر لا يضيف قراءة قبل الكتابة
+    mongo_calls.clear()
+    upsert("sara@d10.sa", "2026-01", 100, 90)
+    assert sorted(mongo_calls) == sorted(expected)
+
+def test_concurrent_upserts_leave_one_kpi(kpi_db):
+    async def scenario():
+        service = KPIService()
+        await service.upsert_kpi("sara@d10.sa", "2026-01", 100, 50)
+        await asyncio.gather(*(service.upsert_kpi("sara@d10.sa", "2026-01", 100, actual) for actual in (60, 70, 80)))
+
+    asyncio.run(scenario())
+    assert kpi_db.sync.kpis.count_documents({}) == 1
+
+def performance(email):
+    return asyncio.run(KPIService().get_user_performance(email))
+
+def test_snapshot_keeps_latest_month_with_out_of_order_upserts(kpi_db):
+    upsert("sara@d10.sa", "2026-03", 100, 90)
+    upsert("sara@d10.sa", "2026-01", 100, 10)
+    upsert("sara@d10.sa", "2026-02", 100, 50)
+
+    result = performance("sara@d10.sa")
+    assert result["month"] == "2026-03"
+    assert result["drift"] == pytest.approx(0.1)
+    assert kpi_db.sync.user_performance.count_documents({}) == 1
+
+def test_snapshot_moves_forward_to_newer_month(kpi_db):
+    upsert("sara@d10.sa", "2026-01", 100, 10)
+    upsert("sara@d10.sa", "2026-02", 100, 80)
+    assert performance("sara@d10.sa")["month"] == "2026-02"
+
+def test_user_edits_are_reflected_without_new_kpi(kpi_db):
+    upsert("sara@d10.sa", "2026-01", 100, 70)
+    kpi_db.sync.users.update_one({"email": "sara@d10.sa"}, {"$set": {"department": "sales", "name": "سارة"}})
+
+    result = performance("sara@d10.sa")
+    assert (result["department"], result["name"]) == ("sales", "سارة")
+
+    service = KPIService()
+    in_sales = asyncio.run(service.get_users_performance(department="sales"))
+    in_general = asyncio.run(service.get_users_performance(department="general"))
+    assert [item["user_email"] for item in in_sales] == ["sara@d10.sa"]
+    assert in_general == []
+
+@pytest.fixture
+def rebuilds(monkeypatch, kpi_db):
+    """تسجيل استدعاءات بناء اللقطات مع تنفيذها الفعلي"""
+    calls = []
+    rebuild = KPIService.rebuild_performance_snapshots
+
+    async def recording_rebuild(self, match):
+        calls.append(match)
+        await rebuild(self, match)
+
+    monkeypatch.setattr(KPIService, "rebuild_performance_snapshots", recording_rebuild)
+    return calls
+
+def test_department_path_rebuilds_missing_snapshots(kpi_db, rebuilds):
+    upsert("sara@d10.sa", "2026-01", 100, 70)
+    kpi_db.sync.users.update_one({"email": "sara@d10.sa"}, {"$set": {"department": "sales"}})
+    new_user = kpi_db.sync.users.insert_one({"email": "omar@d10.sa", "name": "Omar", "department": "sales"}).inserted_id
+
+    results = asyncio.run(KPIService().get_users_performance(department="sales"))
+
+    by_email = {item["user_email"]: item for item in results}
+    assert set(by_email) == {"sara@d10.sa", "omar@d10.sa"}
+    assert by_email["omar@d10.sa"]["performance_level"] == "no_data"
+    assert by_email["sara@d10.sa"]["month"] == "2026-01"
+    assert rebuilds == [{"_id": {"$in": [new_user]}}]
+    # اللقطة المبنية تُستخدم في الطلب التالي بدون إعادة بناء
+    asyncio.run(KPIService().get_users_performance(department="sales"))
+    assert len(rebuilds) == 1
+
+def test_rebuild_uses_latest_kpi_and_keeps_newer_snapshot(kpi_db):
+    user_id = kpi_db.sync.users.insert_one({"email": "omar@d10.sa", "name": "Omar", "department": "tech"}).inserted_id
+    kpi_db.sync.kpis.insert_many([
+        {"user_id": user_id, "month": "2026-02", "target": 100, "actual": 60, "drift": 0.4},
+        {"user_id": user_id, "month": "2026-01", "target": 100, "actual": 90, "drift": 0.1}
+    ])
+
+    result = performance("omar@d10.sa")
+    assert (result["month"], result["performance_level"]) == ("2026-02", "critical")
+
+    # لقطة موجودة لا تُستبدل بإعادة البناء (كتابة متزامنة أحدث)
+    kpi_db.sync.user_performance.update_one({"user_email": "omar@d10.sa"}, {"$set": {"month": "2026-03"}})
+    asyncio.run(KPIService().rebuild_performance_snapshots({}))
+    assert performance("omar@d10.sa")["month"] == "2026-03"
+
+def test_unknown_user_is_not_found(kpi_db, rebuilds):
+    assert performance("ghost@d10.sa") == {"error": "User not found"}
+    assert rebuilds == []
+
+def test_bulk_upsert_keeps_latest_month(kpi_db):
+    async def rows():
+        for index, month in enumerate(("2026-03", "2026-01")):
+            yield {"row": index + 1, "user_email": "sara@d10.sa", "month": month, "target": 100, "actual": 50 + index}
+
+    async def scenario():
+        return [result async for result in KPIService().bulk_upsert_kpis(rows(), batch_size=10)]
+
+    results = asyncio.run(scenario())
+    assert results[-1] == {"summary": True, "rows": 2, "inserted": 2, "updated": 0, "failed": 0}
+    assert performance("sara@d10.sa")["month"] == "2026-03"
@@ -0,0 +1,86 @@
+"""اختبارات اتجاه الـ drift والتحقق من صيغة الشهر"""
+import asyncio
+from datetime import datetime
+import numpy as np
+import pytest
+from pydantic import ValidationError
+from app.schemas import KPIUpsert
+from app.services.kpi_service import KPIService, compute_drift_trends, _month_label
+
+def recent_months(count):
+    now = datetime.utcnow()
+    current = now.year * 12 + now.month - 1
+    return [_month_label(index) for index in range(current - count + 1, current + 1)]
+
+@pytest.mark.parametrize("month", ["Sept", "2026-9", "2026-13", "2026-00", "26-01", "2026-01-01"])
+def test_malformed_month_is_rejected(month):
+    with pytest.raises(ValidationError):
+        KPIUpsert(user_email="sara@d10.sa", month=month, target=100, actual=50)
+
+def test_valid_month_is_accepted():
+    assert KPIUpsert(user_email="sara@d10.sa", month="2026-09", target=100, actual=50).month == "2026-09"
+
+def test_compute_drift_trends_handles_gaps():
+    # موظف واحد، 4 أشهر، الشهر الثالث بدون KPI
+    trends = compute_drift_trends(
+        user_positions=np.array([0, 0, 0]),
+        month_positions=np.array([0, 1, 3]),
+        targets=np.array([100.0, 100.0, 0.0]),
+        actuals=np.array([50.0, 80.0, 10.0]),
+        n_users=1,
+        n_months=4,
+        window=2
+    )
+    np.testing.assert_allclose(trends["drift"][0], [0.5, 0.2, np.nan, 0.0])
+    np.testing.assert_allclose(trends["delta"][0], [np.nan, -0.3, np.nan, np.nan])
+    np.testing.assert_allclose(trends["rolling_avg"][0], [0.5, 0.35, 0.2, 0.0])
+    # انحدار على (0, 0.5) و (1, 0.2) و (3, 0.0)
+    assert trends["slope"][0] == pytest.approx(-0.15714, abs=1e-4)
+    np.testing.assert_allclose(trends["company_drift"], [0.5, 0.2, np.nan, 0.0])
+
+def test_drift_trends_output_skips_malformed_rows(mongo_db):
+    months = recent_months(3)
+    sara = mongo_db.sync.users.insert_one({"email": "sara@d10.sa", "department": "sales"}).inserted_id
+    ali = mongo_db.sync.users.insert_one({"email": "ali@d10.sa", "department": "tech"}).inserted_id
+    mongo_db.sync.kpis.insert_many([
+        {"user_id": sara, "department": "sales", "month": months[0], "target": 100, "actual": 60},
+        {"user_id": sara, "department": "sales", "month": months[2], "target": 100, "actual": 90},
+        {"user_id": ali, "department": "tech", "month": months[1], "target": 200, "actual": 100},
+        # صفوف قديمة قبل التحقق من الصيغة
+        {"user_id": ali, "department": "tech", "month": "Sept", "target": 100, "actual": 0},
+        {"user_id": ali, "department": "tech", "month": f"{months[2][:4]}-9", "target": 100, "actual": 0}
+    ])
+
+    trends = asyncio.run(KPIService().get_drift_trends(months=3, window=2))
+
+    assert trends["months"] == months
+    rows = dict(zip(trends["users"], range(len(trends["users"]))))
+    assert set(rows) == {"sara@d10.sa", "ali@d10.sa"}
+    assert trends["drift"][rows["sara@d10.sa"]] == [0.4, None, 0.1]
+    assert trends["drift"][rows["ali@d10.sa"]] == [None, 0.5, None]
+    assert trends["slope"][rows["sara@d10.sa"]] == pytest.approx(-0.15)
+    assert trends["company"]["drift"] == [0.4, 0.5, 0.1]
+
+    sales = asyncio.run(KPIService().get_drift_trends(department="sales", months=3, window=2))
+    assert sales["users"] == ["sara@d10.sa"]
+
+def test_drift_trends_without_data(mongo_db):
+    trends = asyncio.run(KPIService().get_drift_trends(months=2))
+    assert trends["users"] == [] and trends["company"]["drift"] == [None, None]
+
+def test_user_with_only_future_months_is_not_listed(mongo_db):
+    months = recent_months(2)
+    year, month = int(months[-1][:4]), int(months[-1][5:7])
+    next_month = _month_label(year * 12 + month)
+    sara = mongo_db.sync.users.insert_one({"email": "sara@d10.sa"}).inserted_id
+    omar = mongo_db.sync.users.insert_one({"email": "omar@d10.sa"}).inserted_id
+    mongo_db.sync.kpis.insert_many([
+        {"user_id": sara, "month": months[1], "target": 100, "actual": 80},
+        {"user_id": omar, "month": next_month, "target": 100, "actual": 10}
+    ])
+
+    trends = asyncio.run(KPIService().get_drift_trends(months=2, window=2))
+
+    assert trends["users"] == ["sara@d10.sa"]
+    assert trends["drift"] == [[None, 0.2]]
+    assert trends["rolling_avg"] == [[None, 0.2]]
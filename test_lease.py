@@ -0,0 +1,172 @@
+"""اختبارات القفل الموزع وتشغيل المهام المجدولة مرة واحدة"""
+import asyncio
+import pytest
+from app.db import MongoLease, run_exclusive
+from app.services.digest_fanout import DigestFanout
+
+TTL = 0.3
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_concurrent_run_exclusive_runs_job_once(mongo_db):
+    started = []
+
+    async def job(lease):
+        started.append(lease.token)
+        assert lease.is_held()
+        await asyncio.sleep(TTL)
+
+    async def scenario():
+        return await asyncio.gather(*(
+            run_exclusive("digest", "2026-10-18", job, ttl_seconds=TTL, takeover_window_seconds=5)
+            for _ in range(2)
+        ))
+
+    assert sorted(run(scenario())) == ["completed", "skipped"]
+    assert started == [1]
+    assert mongo_db.sync.job_runs.find_one({"_id": "digest:2026-10-18"})["token"] == 1
+
+def test_second_acquire_is_rejected_until_release(mongo_db):
+    async def scenario():
+        first, second = MongoLease("jobs", TTL), MongoLease("jobs", TTL)
+        results = [await first.acquire(), await second.acquire()]
+        await first.release()
+        results.append(await second.acquire())
+        return results, first.token, second.token
+
+    results, first_token, second_token = run(scenario())
+    assert results == [True, False, True]
+    # التوكن يزيد مع كل حيازة
+    assert first_token is None and second_token == 2
+
+def test_failed_renew_cancels_job_without_marker(mongo_db, monkeypatch):
+    reached_end = []
+
+    async def broken_renew(self):
+        raise RuntimeError("mongo unreachable")
+
+    monkeypatch.setattr(MongoLease, "renew", broken_renew)
+
+    async def job(lease):
+        await asyncio.sleep(TTL * 2)
+        reached_end.append(True)
+
+    outcome = run(run_exclusive("digest", "2026-10-18", job, ttl_seconds=TTL, takeover_window_seconds=1))
+
+    assert outcome is None
+    assert reached_end == []
+    assert mongo_db.sync.job_runs.count_documents({}) == 0
+
+def test_stale_holder_cannot_overwrite_newer_marker(mongo_db):
+    async def job(lease):
+        # حائز أحدث (توكن أعلى) استلم التشغيل وأكمله قبل أن ننتهي
+        mongo_db.sync.job_runs.insert_one({"_id": "digest:2026-10-18", "token": lease.token + 1, "owner": "newer"})
+
+    outcome = run(run_exclusive("digest", "2026-10-18", job, ttl_seconds=TTL, takeover_window_seconds=1))
+
+    assert outcome is None
+    marker = mongo_db.sync.job_runs.find_one({"_id": "digest:2026-10-18"})
+    assert (marker["token"], marker["owner"]) == (2, "newer")
+
+class FakeLease:
+    def __init__(self, held_for, token=7):
+        self.token = token
+        self.held_for = held_for
+
+    def is_held(self):
+        self.held_for -= 1
+        return self.held_for >= 0
+
+def test_digest_fanout_stops_sending_after_lease_is_lost(mongo_db):
+    sent = []
+    fanout = DigestFanout(concurrency=1)
+
+    async def send(recipient):
+        sent.append(recipient)
+        return {"sent": True}
+
+    summary = run(fanout._run("manager", ["a@d10.sa", "b@d10.sa", "c@d10.sa"], send, 1, FakeLease(held_for=1)))
+
+    assert sent == ["a@d10.sa"]
+    assert (summary["status"], summary["sent"], summary["skipped"]) == ("lease_lost", 1, 2)
+    run_doc = mongo_db.sync.digest_runs.find_one()
+    assert run_doc["lease_token"] == 7 and run_doc["status"] == "lease_lost"
+
+def test_takeover_skips_recipients_already_delivered(mongo_db):
+    sent = []
+    fanout = DigestFanout(concurrency=1)
+    recipients = ["a@d10.sa", "b@d10.sa", "c@d10.sa"]
+
+    async def send(recipient):
+        sent.append(recipient)
+        return {"sent": True}
+
+    async def scenario():
+        # الحائز الأول يفقد القفل بعد أول تقرير، والحائز الجديد يستلم نفس التشغيل
+        await fanout._run("manager", recipients, send, 1, FakeLease(held_for=1, token=7), "2026-10-18")
+        takeover = await fanout._run("manager", recipients, send, 1, FakeLease(held_for=3, token=8), "2026-10-18")
+        # حائز قديم يعود متأخراً لا يرسل لمن حجزه الحائز الأحدث
+        stale = await fanout._run("manager", recipients, send, 1, FakeLease(held_for=3, token=7), "2026-10-18")
+        return takeover, stale
+
+    takeover, stale = run(scenario())
+
+    assert sent == recipients
+    assert (takeover["status"], takeover["sent"], takeover["already_delivered"]) == ("completed", 2, 1)
+    assert (stale["sent"], stale["already_delivered"]) == (0, 3)
+    deliveries = {doc["_id"]: (doc["status"], doc["token"]) for doc in mongo_db.sync.digest_deliveries.find()}
+    assert deliveries == {
+        "manager:2026-10-18:a@d10.sa": ("sent", 7),
+        "manager:2026-10-18:b@d10.sa": ("sent", 8),
+        "manager:2026-10-18:c@d10.sa": ("sent", 8),
+    }
+
+def test_failed_delivery_is_retried_on_takeover(mongo_db):
+    attempts = []
+    fanout = DigestFanout(concurrency=1)
+
+    async def send(recipient):
+        attempts.append(recipient)
+        return {"sent": len(attempts) > 1, "error": "smtp down"}
+
+    async def scenario():
+        await fanout._run("executive", ["ceo@d10.sa"], send, 1, FakeLease(held_for=1, token=3), "2026-W42")
+        return await fanout._run("executive", ["ceo@d10.sa"], send, 1, FakeLease(held_for=1, token=4), "2026-W42")
+
+    summary = run(scenario())
+
+    assert attempts == ["ceo@d10.sa", "ceo@d10.sa"]
+    assert summary["sent"] == 1
+    assert mongo_db.sync.digest_deliveries.find_one()["status"] == "sent"
+
+def test_manual_digest_run_shares_the_scheduled_lease(mongo_db, monkeypatch):
+    from app import scheduler
+    from app.services.digest_fanout import digest_fanout
+
+    runs = []
+
+    async def fake_run(lease=None, run_key=None):
+        runs.append((lease.token, run_key))
+        return {"status": "completed", "sent": 1}
+
+    monkeypatch.setattr(digest_fanout, "run_manager_digests", fake_run)
+    monkeypatch.setitem(scheduler.DIGEST_JOBS, "manager", ("send_manager_digests", lambda: "2026-10-18"))
+
+    async def scenario():
+        holder = MongoLease("send_manager_digests", ttl_seconds=60)
+        assert await holder.acquire()
+        # التشغيل المجدول جارٍ: اليدوي لا ينتظر ولا يرسل
+        busy = await scheduler.run_digest_now("manager")
+        await holder.release()
+        first = await scheduler.run_digest_now("manager")
+        # تشغيل اليوم اكتمل: لا إرسال مكرر
+        again = await scheduler.run_digest_now("manager")
+        return busy, first, again
+
+    busy, first, again = run(scenario())
+
+    assert busy == (None, None)
+    assert first == ("completed", {"status": "completed", "sent": 1})
+    assert again == ("skipped", None)
+    assert len(runs) == 1 and runs[0][1] == "2026-10-18"
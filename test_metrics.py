@@ -0,0 +1,34 @@
+"""اختبارات الـ histogram الخاص بزمن الاستجابة"""
+import random
+from app.ai.metrics import LatencyHistogram, BUCKET_COUNT
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(99) == 0.0
+    assert histogram.summary()["count"] == 0
+
+def test_percentiles_within_relative_error():
+    generator = random.Random(7)
+    samples = [generator.lognormvariate(-2, 1) for _ in range(20000)]
+    histogram = LatencyHistogram()
+    for sample in samples:
+        histogram.record(sample)
+
+    ordered = sorted(samples)
+    for percent in (50, 90, 99):
+        exact = ordered[int(percent / 100 * len(ordered)) - 1]
+        assert abs(histogram.percentile(percent) - exact) / exact < 0.03, percent
+    assert histogram.max == ordered[-1]
+    assert histogram.count == len(samples)
+
+def test_percentile_never_exceeds_max():
+    histogram = LatencyHistogram()
+    histogram.record(0.1234)
+    assert histogram.percentile(100) == 0.1234
+
+def test_memory_is_constant_and_huge_values_are_bounded():
+    histogram = LatencyHistogram()
+    histogram.record(0.0)
+    histogram.record(10 ** 6)
+    assert len(histogram.counts) == BUCKET_COUNT
+    assert histogram.counts[0] == 1 and histogram.counts[-1] == 1
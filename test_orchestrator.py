@@ -0,0 +1,43 @@
+"""اختبارات بث تفكيك الأهداف في OrchestratorAI"""
+import asyncio
+import json
+from app.ai.orchestrator import OrchestratorAI
+from app.schemas import TaskBreakdown
+
+def stream(response, chunk_size=7):
+    orchestrator = OrchestratorAI()
+
+    async def build_messages(goal_text, **kwargs):
+        return []
+
+    async def stream_openai(messages, **kwargs):
+        for start in range(0, len(response), chunk_size):
+            yield response[start:start + chunk_size]
+
+    orchestrator._build_messages = build_messages
+    orchestrator.stream_openai = stream_openai
+
+    async def collect():
+        return [event async for event in orchestrator.stream_goal_to_tasks("زيادة المبيعات")]
+
+    return asyncio.run(collect())
+
+def test_streamed_tasks_are_validated_like_the_final_project():
+    response = json.dumps({
+        "project_title": "خطة",
+        "tasks": [
+            {"id": 1, "title": "تحليل السوق", "estimated_days": "ثلاثة", "department": "sales"},
+            {"id": 2, "description": "بدون عنوان"},
+            {"id": 3, "title": "حملة تسويق", "priority": "high"}
+        ]
+    }, ensure_ascii=False)
+
+    events = stream(response)
+
+    tasks = [event["data"] for event in events if event["event"] == "task"]
+    assert [task["title"] for task in tasks] == ["تحليل السوق", "حملة تسويق"]
+    for task in tasks:
+        TaskBreakdown(**task)
+    assert tasks[0]["estimated_days"] == 1 and tasks[0]["department"] == "sales"
+    assert events[-1]["event"] == "project"
+    assert [task["title"] for task in events[-1]["data"]["tasks"]] == ["تحليل السوق", "حملة تسويق"]
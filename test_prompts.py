@@ -0,0 +1,27 @@
+"""اختبارات تعديل الـ prompts من لوحة الإدارة"""
+import asyncio
+from app.routers.prompts import update_prompt
+from app.schemas import PromptUpdate
+
+def update(template):
+    return asyncio.run(update_prompt("coach", "system", PromptUpdate(template=template)))
+
+def test_update_bumps_version(mongo_db):
+    mongo_db.sync.ai_prompts.insert_one({
+        "agent_type": "coach", "prompt_name": "system", "template": "قديم", "version": 3, "is_active": True
+    })
+
+    update("جديد $1")
+
+    prompt = mongo_db.sync.ai_prompts.find_one()
+    assert (prompt["template"], prompt["version"]) == ("جديد $1", 4)
+
+def test_legacy_prompt_without_version_moves_past_default(mongo_db):
+    # BaseAgent يقرأ المستند بدون version كنسخة 1 - التعديل الأول يجب أن يغير البصمة
+    mongo_db.sync.ai_prompts.insert_one({
+        "agent_type": "coach", "prompt_name": "system", "template": "قديم", "is_active": True
+    })
+
+    update("جديد")
+
+    assert mongo_db.sync.ai_prompts.find_one()["version"] == 2
@@ -0,0 +1,44 @@
+"""اختبارات محدد معدل الـ LLM"""
+import asyncio
+from app.ai.rate_limiter import LLMRateLimiter, TokenBucket
+
+def test_adjust_never_exceeds_capacity():
+    limiter = LLMRateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+    limiter.token_bucket.consume(100)
+
+    limiter.adjust(estimated_tokens=500, actual_tokens=10)
+
+    assert limiter.token_bucket.tokens == limiter.token_bucket.capacity
+
+def test_adjust_charges_underestimates():
+    limiter = LLMRateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+    limiter.token_bucket.consume(100)
+
+    limiter.adjust(estimated_tokens=100, actual_tokens=300)
+
+    assert 690 <= limiter.token_bucket.tokens <= 701
+
+def test_bucket_wait_time():
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+    assert 0.9 < bucket.time_until(1) <= 1.0
+    assert TokenBucket(0).time_until(10) == 0.0
+
+def test_interactive_served_before_background():
+    async def scenario():
+        # طلب واحد في الثانية - الطلبات المنتظرة تُخدم حسب الأولوية
+        limiter = LLMRateLimiter(requests_per_minute=600, tokens_per_minute=0)
+        limiter.request_bucket.tokens = 0
+        order = []
+
+        async def request(priority, name):
+            await limiter.acquire(priority)
+            order.append(name)
+
+        background = asyncio.create_task(request("background", "background"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(request("interactive", "interactive"))
+        await asyncio.gather(background, interactive)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "background"]